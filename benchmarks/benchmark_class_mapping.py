@@ -0,0 +1,73 @@
+"""Benchmark of class code remapping: per-point np.vectorize mapping vs. lookup-table mapping.
+
+Usage:
+    python benchmarks/benchmark_class_mapping.py --num-points 10000000
+
+Mimics the mappings of TargetTransform (preprocessing, then codes to consecutive integers) and of
+the Interpolator (consecutive integers back to codes), on random codes from the default config.
+
+"""
+
+import argparse
+import os.path as osp
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(osp.dirname(osp.dirname(__file__)))
+from myria3d.pctl.transforms.transforms import ClassCodeMapper, TargetTransform  # noqa
+
+CLASSIFICATION_PREPROCESSING_DICT = {3: 5, 4: 5, 160: 64, 161: 64, 162: 64, 0: 1, 7: 1, 46: 1}
+CLASSIFICATION_DICT = {1: "unclassified", 2: "ground", 5: "vegetation", 6: "building"}
+CLASSIFICATION_DICT.update({9: "water", 17: "bridge", 64: "lasting_above"})
+
+
+def time_mapping(mapping, values, repeat: int) -> float:
+    """Apply the mapping and return the best throughput in points per second."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        mapping(values)
+        best = min(best, time.perf_counter() - start)
+    return len(values) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--num-points", type=int, default=10_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    source_codes = list(CLASSIFICATION_PREPROCESSING_DICT) + list(CLASSIFICATION_DICT)
+    codes = np.random.choice(source_codes, size=args.num_points).astype(np.int32)
+    indices = np.random.randint(0, len(CLASSIFICATION_DICT), size=args.num_points)
+
+    # Former implementation, kept here as a reference.
+    d = CLASSIFICATION_PREPROCESSING_DICT
+    preprocessing_mapper = np.vectorize(lambda class_code: d.get(class_code, class_code))
+    consecutive = {code: index for index, code in enumerate(CLASSIFICATION_DICT)}
+    mapper = np.vectorize(lambda class_code: consecutive.get(class_code))
+    reverse = dict(enumerate(CLASSIFICATION_DICT))
+
+    def vectorize_target(y):
+        return mapper(preprocessing_mapper(y))
+
+    def vectorize_reverse(preds):
+        return np.vectorize(reverse.get)(preds)
+
+    target_transform = TargetTransform(CLASSIFICATION_PREPROCESSING_DICT, CLASSIFICATION_DICT)
+    reverse_code_mapper = ClassCodeMapper(reverse)
+
+    print(f"Mapping {args.num_points} points (points/s, higher is better):")
+    for name, mapping, values in [
+        ("target, np.vectorize", vectorize_target, codes),
+        ("target, lookup table", target_transform.transform, codes),
+        ("reverse, np.vectorize", vectorize_reverse, indices),
+        ("reverse, lookup table", reverse_code_mapper, indices),
+    ]:
+        print(f"{name:<24}{time_mapping(mapping, values, args.repeat):>16,.0f}")
+
+
+if __name__ == "__main__":
+    main()
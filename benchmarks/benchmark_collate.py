@@ -0,0 +1,105 @@
+"""Benchmark of collation: PyG's generic Collater vs. the specialized CSRCollater.
+
+Usage:
+    python benchmarks/benchmark_collate.py --batch-size 32 --num-nodes 12500 --num-workers 2
+
+Collates synthetic samples with the attributes of evaluation samples (positions, features,
+targets, idx_in_original_cloud, and copies of the full cloud), first in the main process, then
+through a DataLoader with workers, which includes the transfer of batches to the main process.
+
+"""
+
+import argparse
+import os.path as osp
+import sys
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset
+from torch_geometric.data import Data
+
+sys.path.append(osp.dirname(osp.dirname(__file__)))
+from myria3d.pctl.dataloader.dataloader import (  # noqa
+    CSRCollater,
+    GeometricNoneProofCollater,
+)
+
+
+class SyntheticDataset(Dataset):
+    def __init__(self, num_samples: int, num_nodes: int):
+        self.num_samples = num_samples
+        self.num_nodes = num_nodes
+
+    def __len__(self):
+        return self.num_samples
+
+    def __getitem__(self, idx):
+        return get_sample(self.num_nodes)
+
+
+def get_sample(num_nodes: int) -> Data:
+    num_nodes_full = 4 * num_nodes
+    return Data(
+        pos=torch.rand((num_nodes, 3)),
+        x=torch.rand((num_nodes, 9)),
+        y=torch.randint(0, 7, (num_nodes,)),
+        x_features_names=["Intensity", "ReturnNumber", "NumberOfReturns", "Red", "Green", "Blue"]
+        + ["Infrared", "rgb_avg", "ndvi"],
+        basename="tile",
+        idx_in_original_cloud=np.arange(num_nodes_full),
+        copies={
+            "pos_copy": torch.rand((num_nodes_full, 3)),
+            "transformed_y_copy": torch.randint(0, 7, (num_nodes_full,)),
+            "sampled_idx": torch.randint(0, num_nodes_full, (num_nodes,)),
+        },
+    )
+
+
+def time_collate(collate_fn, samples, repeat: int) -> float:
+    """Best time to collate samples, in ms."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        collate_fn(samples)
+        best = min(best, time.perf_counter() - start)
+    return 1000 * best
+
+
+def time_dataloader(collate_fn, args) -> float:
+    """Mean time per batch when iterating through a DataLoader with workers, in ms."""
+    dataset = SyntheticDataset(args.num_batches * args.batch_size, args.num_nodes)
+    dataloader = DataLoader(
+        dataset, batch_size=args.batch_size, num_workers=args.num_workers, collate_fn=collate_fn
+    )
+    iterator = iter(dataloader)
+    next(iterator)  # exclude workers start
+    start = time.perf_counter()
+    num_batches = sum(1 for _ in iterator)
+    return 1000 * (time.perf_counter() - start) / num_batches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--num-nodes", type=int, default=12500)
+    parser.add_argument("--num-workers", type=int, default=2)
+    parser.add_argument("--num-batches", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    samples = [get_sample(args.num_nodes) for _ in range(args.batch_size)]
+    collaters = [("pyg Collater", GeometricNoneProofCollater()), ("CSRCollater", CSRCollater())]
+
+    print(f"Collating {args.batch_size} samples of {args.num_nodes} points (ms, lower is better):")
+    print(f"{'collater':<16}{'main process':>16}{'dataloader':>16}")
+    for name, collate_fn in collaters:
+        print(
+            f"{name:<16}"
+            f"{time_collate(collate_fn, samples, args.repeat):>16.2f}"
+            f"{time_dataloader(collate_fn, args):>16.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
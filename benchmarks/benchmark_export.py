@@ -0,0 +1,123 @@
+"""Benchmark of inference throughput of RandLA-Net: eager, with folded batch norms, and compiled.
+
+Usage:
+    python benchmarks/benchmark_export.py --ckpt-path /path/to/model.ckpt --las /path/to/cloud.las
+
+Batches are made of subtiles of the LAS file (subtile_width x subtile_width squares, randomly
+subsampled to num_nodes points), or of random clouds if no LAS file is given. Features are random:
+they do not change the amount of compute. Without a checkpoint or an exported model, a model with
+default hyperparameters and random weights is used.
+
+Reports the time of the warmup of the compiled model (i.e. compilation), and the throughput of
+forward passes of the neural network, after warmup, in each mode. Modes are cumulative: the
+compiled model has folded batch norms, as in predict.
+
+"""
+
+import argparse
+import os.path as osp
+import sys
+import time
+
+import laspy
+import numpy as np
+import torch
+from torch_geometric.data import Batch, Data
+
+sys.path.append(osp.dirname(osp.dirname(__file__)))
+from myria3d.models.export import (  # noqa
+    compile_model,
+    fold_batch_norms,
+    load_model_for_inference,
+    warmup,
+)
+from myria3d.models.model import Model  # noqa
+from myria3d.models.modules.pyg_randla_net import get_pyramid  # noqa
+
+
+def get_clouds(args) -> list:
+    if args.las is None:
+        return [
+            torch.rand((args.num_nodes, 3)) * torch.tensor([50.0, 50.0, 10.0])
+            for _ in range(args.batch_size * args.num_batches)
+        ]
+    las = laspy.read(args.las)
+    xyz = np.stack([las.x, las.y, las.z], axis=1)
+    xyz = xyz - xyz.min(axis=0)
+    cells = np.floor(xyz[:, :2] / args.subtile_width).astype(np.int64)
+    _, cell_idx = np.unique(cells, axis=0, return_inverse=True)
+    clouds = []
+    for cell in range(cell_idx.max() + 1):
+        pos = xyz[cell_idx.reshape(-1) == cell]
+        keep = np.random.choice(len(pos), args.num_nodes, replace=len(pos) < args.num_nodes)
+        clouds.append(torch.from_numpy(pos[keep]).float())
+    return clouds
+
+
+def get_batches(clouds, num_features: int, batch_size: int, device) -> list:
+    batches = []
+    for start in range(0, len(clouds), batch_size):
+        samples = [
+            Data(x=torch.rand((len(pos), num_features)), pos=pos)
+            for pos in clouds[start : start + batch_size]
+        ]
+        batches.append(Batch.from_data_list(samples).to(device))
+    return batches
+
+
+@torch.no_grad()
+def time_s(model: Model, batches: list, device: torch.device) -> float:
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for batch in batches:
+        model.model(batch.x, batch.pos, batch.batch, batch.ptr, get_pyramid(batch))
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ckpt-path", default=None, help="Checkpoint or exported model.")
+    parser.add_argument("--las", default=None)
+    parser.add_argument("--subtile-width", type=float, default=50.0)
+    parser.add_argument("--num-nodes", type=int, default=12500)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--num-batches", type=int, default=5)
+    parser.add_argument("--device", default="cpu")
+    args = parser.parse_args()
+    device = torch.device(args.device)
+
+    if args.ckpt_path is None:
+        model = Model(
+            neural_net_class_name="PyGRandLANet",
+            neural_net_hparams={"num_features": 9, "num_classes": 7, "return_logits": True},
+        ).eval()
+    else:
+        model = load_model_for_inference(args.ckpt_path)
+    model.to(device)
+    num_features = model.hparams.neural_net_hparams["num_features"]
+    batches = get_batches(get_clouds(args), num_features, args.batch_size, device)
+    num_points = sum(batch.num_nodes for batch in batches)
+
+    warmup(model, args.batch_size, args.num_nodes)
+    results = {"eager": (0.0, time_s(model, batches, device))}
+    fold_batch_norms(model)
+    results["folded"] = (0.0, time_s(model, batches, device))
+    start = time.perf_counter()
+    compile_model(model)
+    warmup(model, args.batch_size, args.num_nodes)
+    results["compiled"] = (time.perf_counter() - start, time_s(model, batches, device))
+
+    print(f"{len(batches)} batches, {num_points} points, on {device}")
+    print(f"{'mode':<12}{'warmup s':>10}{'time s':>10}{'points/s':>12}{'speedup':>10}")
+    for mode, (warmup_s, run_s) in results.items():
+        print(
+            f"{mode:<12}{warmup_s:>10.1f}{run_s:>10.2f}{num_points / run_s:>12.0f}"
+            f"{results['eager'][1] / run_s:>10.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""Benchmark of HDF5 read throughput for a fully random vs. a block-shuffled sampling order.
+
+Usage:
+    python benchmarks/benchmark_hdf5_read_order.py path/to/dataset.hdf5 --num-samples 2000
+
+Only raw samples are read (no transforms), so that the measure isolates I/O.
+Nota: OS page cache strongly favors the second run on a same file. Drop caches between runs,
+or use a dataset larger than RAM, to get meaningful numbers.
+
+"""
+
+import argparse
+import os.path as osp
+import sys
+import time
+
+from torch.utils.data import RandomSampler
+
+sys.path.append(osp.dirname(osp.dirname(__file__)))
+from myria3d.pctl.dataset.hdf5 import HDF5Dataset  # noqa
+from myria3d.pctl.sampler.sampler import BlockShuffleSampler  # noqa
+
+
+def time_reads(dataset: HDF5Dataset, indices) -> float:
+    """Read samples in the given order and return the throughput in samples per second."""
+    start = time.perf_counter()
+    for idx in indices:
+        dataset._get_data(dataset.samples_hdf5_paths[idx])
+    return len(indices) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("hdf5_file_path")
+    parser.add_argument("--num-samples", type=int, default=2000)
+    parser.add_argument("--window-size", type=int, default=400)
+    args = parser.parse_args()
+
+    dataset = HDF5Dataset(args.hdf5_file_path, epsg=None, las_paths_by_split_dict=None)
+    block_ids = [osp.dirname(path) for path in dataset.samples_hdf5_paths]
+
+    random_order = list(RandomSampler(range(len(dataset))))[: args.num_samples]
+    block_order = list(BlockShuffleSampler(block_ids, window_size=args.window_size))
+    block_order = block_order[: args.num_samples]
+
+    print(f"random order:         {time_reads(dataset, random_order):.1f} samples/s")
+    print(f"block-shuffled order: {time_reads(dataset, block_order):.1f} samples/s")
+
+
+if __name__ == "__main__":
+    main()
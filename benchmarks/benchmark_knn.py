@@ -0,0 +1,95 @@
+"""Benchmark of knn backends, for neighbor graphs of samples and for full-tile interpolation.
+
+Usage:
+    python benchmarks/benchmark_knn.py --device cpu
+    python benchmarks/benchmark_knn.py --device cuda --tile-num-points 10000000
+
+Points are drawn on a noisy 2.5D surface, as lidar points. Samples are 50m x 50m subtiles of
+12,500 to 40,000 points, with the kNN graph of RandLA-Net (K=16). Full-tile interpolation is from
+subsampled points to all points of a 1km x 1km tile, with the K of predict.interpolator.
+"kdtree" is CPU only and is skipped on other devices.
+
+"""
+
+import argparse
+import os.path as osp
+import sys
+import time
+
+import torch
+
+sys.path.append(osp.dirname(osp.dirname(__file__)))
+from myria3d.models.modules.knn import KNN_BACKENDS, knn  # noqa
+
+
+def get_surface_points(num_points: int, width: float, device: torch.device) -> torch.Tensor:
+    xy = torch.rand((num_points, 2), device=device) * width
+    z = 3 * torch.sin(xy[:, :1] / 5) + 2 * torch.rand((num_points, 1), device=device)
+    return torch.cat([xy, z], dim=1)
+
+
+def time_ms(run, device: torch.device, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        run()
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        best = min(best, time.perf_counter() - start)
+    return 1000 * best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--samples-num-points", type=int, nargs="+", default=[12500, 40000])
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--num-neighbors", type=int, default=16)
+    parser.add_argument("--tile-num-points", type=int, default=2_000_000)
+    parser.add_argument("--tile-subsampling", type=int, default=4)
+    parser.add_argument("--interpolation-k", type=int, default=10)
+    parser.add_argument("--num-workers", type=int, default=torch.get_num_threads())
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    backends = [b for b in KNN_BACKENDS if device.type == "cpu" or b != "kdtree"]
+    print(f"{'search':<44}" + "".join(f"{b:>16}" for b in backends) + "   (ms)")
+
+    for num_points in args.samples_num_points:
+        pos = torch.cat(
+            [get_surface_points(num_points, 50, device) for _ in range(args.batch_size)]
+        )
+        batch = torch.arange(args.batch_size, device=device).repeat_interleave(num_points)
+        name = f"graph: {args.batch_size} x {num_points} pts, K={args.num_neighbors}"
+        timings = [
+            time_ms(
+                lambda: knn(pos, pos, args.num_neighbors, batch, batch, args.num_workers, backend),
+                device,
+                args.repeat,
+            )
+            for backend in backends
+        ]
+        print(f"{name:<44}" + "".join(f"{t:>16.1f}" for t in timings))
+
+    pos_y = get_surface_points(args.tile_num_points, 1000, device)
+    pos_x = pos_y[torch.randperm(args.tile_num_points, device=device)]
+    pos_x = pos_x[: args.tile_num_points // args.tile_subsampling]
+    name = f"interpolation: {pos_x.size(0)} -> {pos_y.size(0)} pts, K={args.interpolation_k}"
+    timings = [
+        time_ms(
+            lambda: knn(
+                pos_x, pos_y, args.interpolation_k, num_workers=args.num_workers, backend=backend
+            ),
+            device,
+            1,
+        )
+        for backend in backends
+    ]
+    print(f"{name:<44}" + "".join(f"{t:>16.1f}" for t in timings))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Benchmark of RandLA-Net local feature aggregation: message passing vs. dense, and checkpointing.
+
+Usage:
+    python benchmarks/benchmark_local_feature_aggregation.py --num-nodes 50000 --device cuda
+
+Times a forward and backward pass of a DilatedResidualBlock (kNN graph excluded), and measures its
+peak memory: exactly with CUDA, and approximately from allocation events of the profiler on CPU.
+
+Then does the same for the whole PyGRandLANet, on a batch of 4 clouds, with and without
+checkpointing of its dilated residual blocks. Checkpointing does not lower the peak memory of a
+single block, whose activations are recomputed during its backward, but that of the network,
+which then only stores the inputs of each block until backward.
+
+"""
+
+import argparse
+import itertools
+import os.path as osp
+import sys
+import time
+
+import torch
+from torch.profiler import ProfilerActivity, profile
+
+sys.path.append(osp.dirname(osp.dirname(__file__)))
+from myria3d.models.modules.pyg_randla_net import (  # noqa
+    DilatedResidualBlock,
+    PyGRandLANet,
+    knn_neighbors,
+)
+
+
+def peak_memory_mb(run, device: torch.device) -> float:
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+        start = torch.cuda.memory_allocated()
+        run()
+        torch.cuda.synchronize()
+        return (torch.cuda.max_memory_allocated() - start) / 2**20
+    with profile(activities=[ProfilerActivity.CPU], profile_memory=True) as prof:
+        run()
+    current = peak = 0
+    for event in sorted(prof.events(), key=lambda e: e.time_range.start):
+        current += event.self_cpu_memory_usage
+        peak = max(peak, current)
+    return peak / 2**20
+
+
+def time_ms(run, device: torch.device, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        start = time.perf_counter()
+        run()
+        if device.type == "cuda":
+            torch.cuda.synchronize()
+        best = min(best, time.perf_counter() - start)
+    return 1000 * best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--num-nodes", type=int, default=50000)
+    parser.add_argument("--num-neighbors", type=int, default=16)
+    parser.add_argument("--d-in", type=int, default=32)
+    parser.add_argument("--d-out", type=int, default=128)
+    parser.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    pos = torch.rand((args.num_nodes, 3), device=device)
+    x = torch.rand((args.num_nodes, args.d_in), device=device, requires_grad=True)
+    batch = torch.zeros(args.num_nodes, dtype=torch.long, device=device)
+    neighbors = knn_neighbors(pos, args.num_neighbors, batch)
+
+    print(
+        f"DilatedResidualBlock({args.d_in}, {args.d_out}) on {args.num_nodes} points, "
+        f"K={args.num_neighbors}, {device}:"
+    )
+    print(f"{'aggregation':<16}{'forward+backward ms':>22}{'peak memory MB':>18}")
+    block = DilatedResidualBlock(args.num_neighbors, args.d_in, args.d_out).to(device)
+    for name, dense in [("message passing", False), ("dense", True)]:
+        block.dense = dense
+
+        def run():
+            out, _, _ = block(x, pos, batch, neighbors)
+            out.sum().backward()
+
+        run()  # warmup
+        print(
+            f"{name:<16}"
+            f"{time_ms(run, device, args.repeat):>22.1f}"
+            f"{peak_memory_mb(run, device):>18.1f}"
+        )
+
+    num_clouds = 4
+    x = torch.rand((args.num_nodes, args.d_in), device=device)
+    batch = torch.arange(num_clouds, device=device).repeat_interleave(args.num_nodes // num_clouds)
+    batch = torch.cat([batch, batch.new_full((args.num_nodes - len(batch),), num_clouds - 1)])
+    ptr = torch.cat([batch.new_zeros(1), torch.bincount(batch).cumsum(0)])
+    print(f"\nPyGRandLANet on {num_clouds} clouds of {args.num_nodes} points in total:")
+    print(
+        f"{'aggregation':<16}{'checkpointing':>14}{'forward+backward ms':>22}{'peak memory MB':>18}"
+    )
+    for (name, dense), checkpointing in itertools.product(
+        [("message passing", False), ("dense", True)], [False, True]
+    ):
+        model = PyGRandLANet(
+            args.d_in,
+            8,
+            num_neighbors=args.num_neighbors,
+            dense_aggregation=dense,
+            checkpointing=checkpointing,
+        ).to(device)
+
+        def run():
+            model(x, pos, batch, ptr).sum().backward()
+
+        run()  # warmup
+        print(
+            f"{name:<16}"
+            f"{str(checkpointing):>14}"
+            f"{time_ms(run, device, args.repeat):>22.1f}"
+            f"{peak_memory_mb(run, device):>18.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""Report of int8 quantized inference on CPU: per-class IoU deltas and speedup vs. float32.
+
+Usage:
+    python benchmarks/benchmark_quantization.py --ckpt-path /path/to/model.ckpt --num-batches 10 \
+        datamodule.hdf5_file_path=/path/to/dataset.hdf5 [other hydra overrides]
+
+Runs the float32 model (with folded batch norms, as in predict) and its quantized version on the
+same batches of the test split of the HDF5 dataset, e.g. the one built from the test LAS with
+`python run.py task.task_name=create_hdf5`. Predictions are interpolated to all points of each
+subtile, as at test time, and IoUs are computed against the targets of all points. Times include
+interpolation.
+
+Quantization is dynamic: activations are quantized with a scale computed for each batch, so that
+no calibration data is needed.
+
+"""
+
+import argparse
+import os.path as osp
+import sys
+import time
+
+import hydra
+import torch
+from hydra import compose, initialize
+
+sys.path.append(osp.dirname(osp.dirname(__file__)))
+from myria3d.models.export import (  # noqa
+    fold_batch_norms,
+    load_model_for_inference,
+    quantize_model,
+)
+
+
+def run(model, batch, num_classes: int, seed: int):
+    """Time a forward pass and return its confusion matrix. Same seed, same decimations."""
+    torch.manual_seed(seed)
+    start = time.perf_counter()
+    targets, logits = model(batch)
+    time_s = time.perf_counter() - start
+    preds = logits.argmax(dim=1)
+    confmat = torch.bincount(
+        targets * num_classes + preds, minlength=num_classes * num_classes
+    ).view(num_classes, num_classes)
+    return confmat, time_s
+
+
+def get_iou(confmat: torch.Tensor) -> torch.Tensor:
+    true_positives = confmat.diag().double()
+    union = confmat.sum(dim=0) + confmat.sum(dim=1) - true_positives
+    return true_positives / union.clamp(min=1)
+
+
+@torch.no_grad()
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--ckpt-path", required=True, help="Checkpoint or exported model.")
+    parser.add_argument("--num-batches", type=int, default=10)
+    parser.add_argument("overrides", nargs="*", help="Hydra overrides of configs/config.yaml.")
+    args = parser.parse_args()
+
+    with initialize(config_path="../configs/", job_name="config"):
+        config = compose(config_name="config", overrides=args.overrides)
+    datamodule = hydra.utils.instantiate(config.datamodule)
+    datamodule.prepare_data("test")
+
+    model = fold_batch_norms(load_model_for_inference(args.ckpt_path))
+    quantized = quantize_model(fold_batch_norms(load_model_for_inference(args.ckpt_path)))
+    class_names = list(model.hparams.classification_dict.values())
+    num_classes = len(class_names)
+
+    confmats = {"float32": 0, "int8": 0}
+    times_s = {"float32": 0.0, "int8": 0.0}
+    for batch_idx, batch in enumerate(datamodule.test_dataloader()):
+        if batch_idx == args.num_batches:
+            break
+        batch = datamodule.on_after_batch_transfer(batch, 0)
+        for mode, mode_model in [("float32", model), ("int8", quantized)]:
+            confmat, time_s = run(mode_model, batch, num_classes, seed=batch_idx)
+            confmats[mode] = confmats[mode] + confmat
+            times_s[mode] += time_s
+
+    iou = {mode: get_iou(confmat) for mode, confmat in confmats.items()}
+    print(f"{'class':<20}{'IoU float32':>14}{'IoU int8':>12}{'delta':>10}")
+    for idx, class_name in enumerate(class_names):
+        print(
+            f"{class_name:<20}{iou['float32'][idx]:>14.4f}{iou['int8'][idx]:>12.4f}"
+            f"{iou['int8'][idx] - iou['float32'][idx]:>+10.4f}"
+        )
+    # Classes absent from targets are ignored in the mean IoU.
+    present = confmats["float32"].sum(dim=1) > 0
+    mean_iou = {mode: values[present].mean() for mode, values in iou.items()}
+    print(
+        f"{'mean':<20}{mean_iou['float32']:>14.4f}{mean_iou['int8']:>12.4f}"
+        f"{mean_iou['int8'] - mean_iou['float32']:>+10.4f}"
+    )
+    print(
+        f"time: float32 {times_s['float32']:.2f} s, int8 {times_s['int8']:.2f} s, "
+        f"speedup x{times_s['float32'] / times_s['int8']:.2f}"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,11 @@
+from typing import Dict, List, Tuple
+
 from pytorch_lightning import Callback
 import torch
 from torchmetrics import Accuracy, F1Score, JaccardIndex, Precision, Recall, ConfusionMatrix
 
 from myria3d.callbacks.comet_callbacks import log_comet_cm
+from myria3d.pctl.dataloader.dataloader import split_idx_in_original_cloud
 
 
 class ModelMetrics(Callback):
@@ -103,3 +106,88 @@ class ModelMetrics(Callback):
 
     def on_test_epoch_end(self, trainer, pl_module):
         self._end_of_epoch("test", pl_module)
+
+
+class FullTileTestMetrics(Callback):
+    """Compute test metrics on full source tiles, reassembled from their subtiles.
+
+    Full-resolution predictions of subtiles are gathered by source tile, and logits of points that
+    were predicted several times (e.g. at the border of subtiles) are summed, so that each point
+    of a tile is evaluated exactly once. Points that never got a prediction (e.g. artefacts)
+    are not evaluated.
+
+    Tiles are expected to come one after the other, as with the (unshuffled) test dataloader:
+    a tile is reduced to a confusion matrix as soon as a batch without any of its subtiles
+    comes in, which keeps memory bounded by the size of a tile whatever the number of workers.
+
+    With multiple devices, subtiles of a tile are split across ranks, and confusion matrices are
+    summed across ranks before computing metrics. Points predicted on several ranks, e.g. in
+    subtiles repeated by the DistributedSampler to even out ranks, are then counted more than once.
+
+    """
+
+    def __init__(self, num_classes=7):
+        self.num_classes = num_classes
+        self.confusion_matrices_by_tile: Dict[str, torch.Tensor] = {}
+        self._pending: Dict[str, List[Tuple[torch.Tensor, torch.Tensor, torch.Tensor]]] = {}
+
+    def on_test_epoch_start(self, trainer, pl_module):
+        self.confusion_matrices_by_tile = {}
+        self._pending = {}
+
+    def on_test_batch_end(self, trainer, pl_module, outputs, batch, batch_idx):
+        idx_in_original_cloud = split_idx_in_original_cloud(batch)
+        sizes = [len(idx) for idx in idx_in_original_cloud]
+        logits = outputs["logits"].detach().cpu().split(sizes)
+        targets = outputs["targets"].cpu().split(sizes)
+        for basename, idx, sample_logits, sample_targets in zip(
+            batch.basename, idx_in_original_cloud, logits, targets
+        ):
+            self._pending.setdefault(basename, []).append(
+                (torch.from_numpy(idx).long(), sample_logits, sample_targets)
+            )
+        for basename in list(self._pending):
+            if basename not in batch.basename:
+                self._reduce_tile(basename)
+
+    def on_test_epoch_end(self, trainer, pl_module):
+        for basename in list(self._pending):
+            self._reduce_tile(basename)
+        confmat = torch.zeros((self.num_classes, self.num_classes), dtype=torch.long)
+        for tile_confmat in self.confusion_matrices_by_tile.values():
+            confmat += tile_confmat
+        # With multiple devices, each rank only saw its share of the subtiles: counts are summed
+        # across ranks, which all take part in the reduction, even without any tile.
+        confmat = trainer.strategy.reduce(confmat.to(pl_module.device), reduce_op="sum")
+        confmat = confmat.cpu().double()
+        if not confmat.sum():
+            return
+
+        true_positives = confmat.diag()
+        union = confmat.sum(dim=0) + confmat.sum(dim=1) - true_positives
+        iou = true_positives / union.clamp(min=1)
+        pl_module.log("test/full_tile/acc", true_positives.sum() / confmat.sum().clamp(min=1))
+        # Classes absent from both targets and predictions are ignored in the mean IoU.
+        pl_module.log("test/full_tile/iou", iou[union > 0].mean())
+        class_names = pl_module.hparams.classification_dict.values()
+        for value, class_name in zip(iou, class_names):
+            pl_module.log(f"test/full_tile/iou/{class_name}", value)
+
+    def _reduce_tile(self, basename: str) -> None:
+        """Reduce predictions of a tile to a confusion matrix, counting each point only once."""
+        idx, logits, targets = (torch.cat(chunks) for chunks in zip(*self._pending.pop(basename)))
+        unique_idx, inverse = torch.unique(idx, return_inverse=True)
+        reduced_logits = torch.zeros((len(unique_idx), logits.size(1)), dtype=logits.dtype)
+        reduced_logits.index_add_(0, inverse, logits)
+        reduced_targets = torch.empty(len(unique_idx), dtype=targets.dtype)
+        reduced_targets.scatter_(0, inverse, targets)
+
+        preds = reduced_logits.argmax(dim=1)
+        confmat = torch.bincount(
+            reduced_targets * self.num_classes + preds, minlength=self.num_classes**2
+        ).reshape(self.num_classes, self.num_classes)
+        # Should a tile come in again later (unordered dataloader), its predictions are accumulated,
+        # at the cost of exactness for points predicted in both parts.
+        if basename in self.confusion_matrices_by_tile:
+            confmat += self.confusion_matrices_by_tile[basename]
+        self.confusion_matrices_by_tile[basename] = confmat
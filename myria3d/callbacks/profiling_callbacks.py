@@ -0,0 +1,37 @@
+from pytorch_lightning import Callback, LightningModule, Trainer
+
+from myria3d.utils import utils
+
+log = utils.get_logger(__name__)
+
+
+class TransformsProfilingLogger(Callback):
+    """Log statistics of each data transform once per epoch, then reset them.
+
+    Statistics are recorded by the datamodule when `datamodule.profile_transforms=true`, and are
+    aggregated over dataloader workers. Nothing is logged otherwise.
+
+    """
+
+    def on_train_epoch_end(self, trainer: Trainer, pl_module: LightningModule) -> None:
+        # Validation of the epoch is already done: its samples were prepared with eval transforms.
+        self._log_and_reset(trainer, pl_module, "train", "train")
+        self._log_and_reset(trainer, pl_module, "eval", "val")
+
+    def on_test_epoch_end(self, trainer: Trainer, pl_module: LightningModule) -> None:
+        self._log_and_reset(trainer, pl_module, "eval", "test")
+
+    def _log_and_reset(
+        self, trainer: Trainer, pl_module: LightningModule, profiler_name: str, phase: str
+    ) -> None:
+        profilers = getattr(trainer.datamodule, "transforms_profilers", {})
+        if profiler_name not in profilers:
+            return
+        profiler = profilers[profiler_name]
+        summary = profiler.summary()
+        if not summary:
+            return
+        log.info(f"Transforms profiling ({phase}):\n{profiler.format()}")
+        metrics = {f"{phase}/transforms/{key}": value for key, value in summary.items()}
+        pl_module.log_dict(metrics, on_step=False, on_epoch=True)
+        profiler.reset()
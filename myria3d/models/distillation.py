@@ -0,0 +1,109 @@
+import torch
+import torch.nn.functional as F
+from torch_geometric.data import Batch
+
+from myria3d.models.export import load_model_for_inference
+from myria3d.models.model import Model
+from myria3d.models.modules.pyg_randla_net import get_pyramid
+from myria3d.utils import utils
+
+log = utils.get_logger(__name__)
+
+TEACHER_PREFIX = "teacher."
+
+
+class DistillationModel(Model):
+    """Training of a student neural network on the logits of a trained teacher Model.
+
+    The student is the neural network of this Model, e.g. a narrower PyGRandLANet (see its
+    channels argument). It is trained on a mix of the distillation loss (KL divergence between
+    teacher and student distributions at a temperature) and of the usual criterion on targets.
+    Validation and test are those of Model, i.e. on targets only.
+
+    The teacher is frozen, in eval mode, and is not saved in checkpoints: those hold the student
+    only, and load as a plain Model, e.g. in predict or for export.
+
+    """
+
+    def __init__(self, **kwargs):
+        """Initialization method of the DistillationModel lightning module.
+
+        In addition to the kwargs of Model:
+            teacher_ckpt_path (str): checkpoint or exported model of the teacher.
+            distillation_temperature (float, optional): temperature of softmaxes of the
+                distillation loss. Defaults to 4.0.
+            distillation_alpha (float, optional): weight of the distillation loss, the criterion
+                on targets having a weight of 1 - alpha. Defaults to 0.9.
+
+        """
+        super().__init__(**kwargs)
+        teacher = load_model_for_inference(kwargs["teacher_ckpt_path"])
+        if teacher.hparams.get("num_classes") != kwargs.get("num_classes"):
+            raise ValueError(
+                f"Teacher has {teacher.hparams.get('num_classes')} classes, "
+                f"while the student has {kwargs.get('num_classes')}."
+            )
+        self.teacher = teacher.model
+        self.teacher.requires_grad_(False)
+        self.teacher.eval()
+        self.temperature = kwargs.get("distillation_temperature", 4.0)
+        self.alpha = kwargs.get("distillation_alpha", 0.9)
+
+    def train(self, mode: bool = True):
+        """Set the student in training mode, while the teacher stays in eval mode."""
+        super().train(mode)
+        self.teacher.eval()
+        return self
+
+    def training_step(self, batch: Batch, batch_idx: int) -> dict:
+        """Training step, with a distillation loss.
+
+        Args:
+            batch (torch_geometric.data.Batch): Batch of data including x (features), pos (xyz positions),
+            and y (targets, optionnal) in (B*N,C) format.
+            batch_idx (int): batch identified (unused)
+
+        Returns:
+            dict: a dict containing the loss, logits, and targets.
+        """
+        targets, logits = self.forward(batch)
+        with torch.no_grad():
+            teacher_logits = self.teacher(
+                batch.x, batch.pos, batch.batch, batch.ptr, get_pyramid(batch)
+            )
+        self.criterion = self.criterion.to(logits.device)
+        distillation_loss = self.distillation_loss(logits, teacher_logits)
+        target_loss = self.criterion(logits, targets)
+        loss = self.alpha * distillation_loss + (1 - self.alpha) * target_loss
+        self.log("train/distillation_loss", distillation_loss, on_step=True, on_epoch=True)
+        self.log("train/target_loss", target_loss, on_step=True, on_epoch=True)
+        self.log("train/loss", loss, on_step=True, on_epoch=True, prog_bar=False)
+        return {"loss": loss, "logits": logits, "targets": targets}
+
+    def distillation_loss(
+        self, logits: torch.Tensor, teacher_logits: torch.Tensor
+    ) -> torch.Tensor:
+        """KL divergence from the teacher to the student distribution, softened by a temperature.
+
+        Scaled by temperature**2, so that its gradients keep the same magnitude whatever the
+        temperature. Teacher outputs may be logits or log-probabilities: softmaxes are the same.
+
+        """
+        return F.kl_div(
+            F.log_softmax(logits / self.temperature, dim=1),
+            F.log_softmax(teacher_logits.float() / self.temperature, dim=1),
+            reduction="batchmean",
+            log_target=True,
+        ) * (self.temperature**2)
+
+    def on_save_checkpoint(self, checkpoint: dict) -> None:
+        checkpoint["state_dict"] = {
+            key: value
+            for key, value in checkpoint["state_dict"].items()
+            if not key.startswith(TEACHER_PREFIX)
+        }
+
+    def on_load_checkpoint(self, checkpoint: dict) -> None:
+        # Checkpoints hold the student only: the teacher keeps the weights it was loaded with.
+        for key, value in self.teacher.state_dict().items():
+            checkpoint["state_dict"][TEACHER_PREFIX + key] = value
@@ -0,0 +1,195 @@
+"""Export of a trained Model to an inference artifact, and its compilation for inference.
+
+An exported model is a plain torch file with the weights of the neural network and the few
+hyperparameters needed for inference. Unlike a Lightning checkpoint, it holds no optimizer state
+and no training objects (criterion, optimizer and scheduler partials) that require the training
+environment to be unpickled.
+
+At inference, the neural network can be compiled with torch.compile. Neighbor searches and
+decimations run eagerly between compiled regions (see myria3d.models.modules.knn), and shapes are
+dynamic, so that batches of any number of points reuse the same compiled code. Compilation happens
+at the first forward passes: warmup runs them on synthetic batches, before actual data.
+
+Before that, batch normalizations are folded into the linear layers that precede them, which
+removes a pass over the (N * K, C) edge tensors of each local feature aggregation.
+
+For CPU inference, linear layers can also be quantized to int8, with dynamic quantization: weights
+are quantized once, and activations on the fly with a scale computed for each batch.
+
+"""
+
+from typing import Callable, Dict, Optional
+
+import torch
+from torch import nn
+from torch_geometric.data import Batch, Data
+from torch_geometric.nn import MLP
+from torch_geometric.nn.norm import BatchNorm
+
+from myria3d._version import __version__
+from myria3d.models.model import Model
+from myria3d.models.modules.pyg_randla_net import get_pyramid
+from myria3d.utils import utils
+
+log = utils.get_logger(__name__)
+
+# Hyperparameters of Model used at inference.
+INFERENCE_HPARAMS = [
+    "neural_net_class_name",
+    "neural_net_hparams",
+    "d_in",
+    "num_classes",
+    "classification_dict",
+    "interpolation_k",
+    "num_workers",
+    "interpolation_knn_backend",
+]
+
+
+def export_model(model: Model, path: str) -> None:
+    """Save the neural network of a Model and its inference hyperparameters to path."""
+    hparams = {key: model.hparams[key] for key in INFERENCE_HPARAMS if key in model.hparams}
+    torch.save(
+        {
+            "myria3d_version": __version__,
+            "hparams": hparams,
+            "state_dict": model.model.state_dict(),
+        },
+        path,
+    )
+
+
+def is_exported_model(checkpoint: Dict) -> bool:
+    return "pytorch-lightning_version" not in checkpoint and "hparams" in checkpoint
+
+
+def load_model_for_inference(path: str) -> Model:
+    """Load a Model from an exported model or from a Lightning checkpoint, in eval mode."""
+    checkpoint = torch.load(path, map_location="cpu", weights_only=False)
+    if not is_exported_model(checkpoint):
+        return Model.load_from_checkpoint(path).eval()
+    model = Model(**checkpoint["hparams"])
+    model.model.load_state_dict(checkpoint["state_dict"])
+    return model.eval()
+
+
+@torch.no_grad()
+def fold_batch_norms(model: nn.Module) -> nn.Module:
+    """Fold batch normalizations of all MLPs (e.g. SharedMLP) into their linear layers, in place.
+
+    Outputs are unchanged in eval mode, up to float rounding. Batch normalizations are replaced by
+    identities, so the model must not be trained anymore.
+
+    Raises:
+        ValueError: if the model is in training mode, where batch normalizations use batch
+            statistics instead of running statistics.
+
+    """
+    if model.training:
+        raise ValueError("Batch normalizations can only be folded in eval mode.")
+    for mlp in model.modules():
+        if not isinstance(mlp, MLP) or mlp.act_first:
+            continue
+        for idx, (lin, norm) in enumerate(zip(mlp.lins, mlp.norms)):
+            if isinstance(norm, BatchNorm) and norm.module.track_running_stats:
+                fold_batch_norm(lin, norm.module)
+                mlp.norms[idx] = nn.Identity()
+    return model
+
+
+def fold_batch_norm(lin: nn.Module, norm: nn.BatchNorm1d) -> None:
+    """Fold an eval-mode batch normalization into the linear layer before it, in place."""
+    scale = norm.running_var.add(norm.eps).rsqrt()
+    if norm.affine:
+        scale = scale * norm.weight
+    bias = lin.bias if lin.bias is not None else torch.zeros_like(norm.running_mean)
+    bias = (bias - norm.running_mean) * scale
+    if norm.affine:
+        bias = bias + norm.bias
+    lin.weight.copy_(lin.weight * scale.unsqueeze(1))
+    lin.bias = nn.Parameter(bias)
+
+
+@torch.no_grad()
+def quantize_model(model: Model) -> Model:
+    """Quantize linear layers of the neural network of a Model to int8, for CPU inference.
+
+    Linear layers of PyG MLPs (e.g. SharedMLP) are turned into torch Linear layers first, since
+    dynamic quantization only maps the latter. Fold batch norms before, so that they are quantized
+    with the linear layers.
+
+    Raises:
+        ValueError: if the model is not on CPU, where quantized kernels run.
+
+    """
+    if any(param.device.type != "cpu" for param in model.parameters()):
+        raise ValueError("Quantized inference runs on CPU only. Set predict.gpus=0.")
+    for mlp in model.modules():
+        if isinstance(mlp, MLP):
+            mlp.lins = nn.ModuleList([to_torch_linear(lin) for lin in mlp.lins])
+    model.model = torch.ao.quantization.quantize_dynamic(
+        model.model, {nn.Linear}, dtype=torch.qint8
+    )
+    return model
+
+
+def to_torch_linear(lin: nn.Module) -> nn.Linear:
+    """Copy of a PyG Linear layer as a torch Linear layer, with the same weights."""
+    torch_lin = nn.Linear(lin.in_channels, lin.out_channels, bias=lin.bias is not None)
+    torch_lin.load_state_dict(lin.state_dict())
+    return torch_lin
+
+
+def compile_model(model: Model, mode: Optional[str] = None) -> Model:
+    """Compile the neural network of a Model for inference, with dynamic shapes.
+
+    Args:
+        model (Model): model, in eval mode.
+        mode (str, optional): torch.compile mode (e.g. "max-autotune"). Defaults to None.
+
+    """
+    model.model = torch.compile(model.model, dynamic=True, mode=mode)
+    return model
+
+
+@torch.no_grad()
+def warmup(
+    model: Model,
+    batch_size: int,
+    num_nodes: int,
+    num_steps: int = 2,
+    pyramid_transform: Optional[Callable] = None,
+) -> None:
+    """Run forward passes of the neural network on synthetic batches, e.g. to compile it.
+
+    Clouds are random points (see get_synthetic_batch). Each step uses a different number of points
+    per cloud (num_nodes, then num_nodes - 1, etc.), so that dynamic shapes are compiled at once.
+
+    Args:
+        model (Model): model, on the device of inference.
+        batch_size (int): number of clouds of each batch.
+        num_nodes (int): typical number of points of a cloud, after subsampling.
+        num_steps (int, optional): number of forward passes. Defaults to 2.
+        pyramid_transform (Callable, optional): RandLANetPyramid transform of the inference
+            dataloader, if any. Defaults to None.
+
+    """
+    for step in range(num_steps):
+        batch = get_synthetic_batch(model, batch_size, num_nodes - step, pyramid_transform)
+        model.model(batch.x, batch.pos, batch.batch, batch.ptr, get_pyramid(batch))
+
+
+def get_synthetic_batch(
+    model: Model, batch_size: int, num_nodes: int, pyramid_transform: Optional[Callable] = None
+) -> Batch:
+    """Batch of clouds of random points in a 50m x 50m x 10m box, on the device of the model."""
+    num_features = model.hparams.neural_net_hparams["num_features"]
+    samples = []
+    for _ in range(batch_size):
+        data = Data(
+            x=torch.rand((num_nodes, num_features)),
+            pos=torch.rand((num_nodes, 3)) * torch.tensor([50.0, 50.0, 10.0]),
+        )
+        samples.append(data if pyramid_transform is None else pyramid_transform(data))
+    # Quantized models have no parameters to get the device from.
+    return Batch.from_data_list(samples).to(model.device)
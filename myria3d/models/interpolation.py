@@ -11,6 +11,7 @@ from torch_scatter import scatter_sum
 from pdaltools import las_info
 
 from myria3d.pctl.dataset.utils import get_pdal_info_metadata, get_pdal_reader
+from myria3d.pctl.transforms.transforms import ClassCodeMapper
 
 log = logging.getLogger(__name__)
 
@@ -53,6 +54,7 @@ class Interpolator:
             class_index: class_code
             for class_index, class_code in enumerate(classification_dict.keys())
         }
+        self.reverse_code_mapper = ClassCodeMapper(self.reverse_mapper)
 
         self.logits: List[torch.Tensor] = []
         self.idx_in_full_cloud_list: List[np.ndarray] = []
@@ -105,7 +107,8 @@ class Interpolator:
         """
 
         # Concatenate elements from different batches
-        logits: torch.Tensor = torch.cat(self.logits).cpu()
+        # In float32, whatever the precision of inference, for probabilities and entropy.
+        logits: torch.Tensor = torch.cat(self.logits).cpu().float()
         idx_in_full_cloud: np.ndarray = np.concatenate(self.idx_in_full_cloud_list)
         del self.logits
         del self.idx_in_full_cloud_list
@@ -143,7 +146,7 @@ class Interpolator:
 
         if self.predicted_classification_channel:
             preds = torch.argmax(logits, dim=1)
-            preds = np.vectorize(self.reverse_mapper.get)(preds)
+            preds = self.reverse_code_mapper(preds).numpy()
 
         del logits
 
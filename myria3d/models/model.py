@@ -2,9 +2,9 @@ import torch
 from pytorch_lightning import LightningModule
 from torch import nn
 from torch_geometric.data import Batch
-from torch_geometric.nn import knn_interpolate
 
-from myria3d.models.modules.pyg_randla_net import PyGRandLANet
+from myria3d.models.modules.knn import knn_interpolate
+from myria3d.models.modules.pyg_randla_net import PyGRandLANet, get_pyramid
 from myria3d.utils import utils
 
 log = utils.get_logger(__name__)
@@ -76,7 +76,7 @@ class Model(LightningModule):
             torch.Tensor (B*N,C): logits
 
         """
-        logits = self.model(batch.x, batch.pos, batch.batch, batch.ptr)
+        logits = self.model(batch.x, batch.pos, batch.batch, batch.ptr, get_pyramid(batch))
         if self.training or "copies" not in batch:
             # In training mode and for validation, we directly optimize on subsampled points, for
             # 1) Speed of training - because interpolation multiplies a step duration by a 5-10 factor!
@@ -86,16 +86,18 @@ class Model(LightningModule):
         # During evaluation on test data and inference, we interpolate predictions back to original positions
         # KNN is way faster on CPU than on GPU by a 3 to 4 factor.
         logits = logits.cpu()
-        batch_y = self._get_batch_tensor_by_enumeration(batch.idx_in_original_cloud)
-        logits = knn_interpolate(
-            logits.cpu(),
-            batch.copies["pos_sampled_copy"].cpu(),
-            batch.copies["pos_copy"].cpu(),
-            batch_x=batch.batch.cpu(),
-            batch_y=batch_y.cpu(),
-            k=self.hparams.interpolation_k,
-            num_workers=self.hparams.num_workers,
-        )
+        batch_y = get_batch_y(batch)
+        if "voxel_idx" in batch.copies:
+            # Exact back-projection: each point gets the logits of the sampled point of its voxel.
+            logits = self._backproject_by_voxel(logits, batch, batch_y)
+        else:
+            logits = self._knn_interpolate(
+                logits,
+                self._get_sampled_pos(batch, batch_y),
+                batch.copies["pos_copy"],
+                batch.batch,
+                batch_y,
+            )
         targets = None  # no targets in inference mode.
         if "transformed_y_copy" in batch.copies:
             # eval (test/val).
@@ -191,8 +193,95 @@ class Model(LightningModule):
             "monitor": self.hparams.monitor,
         }
 
-    def _get_batch_tensor_by_enumeration(self, pos_x: torch.Tensor) -> torch.Tensor:
-        """Get batch tensor (e.g. [0,0,1,1,2,2,...,B-1,B-1] )
-        from shape B,N,... to shape (N,...).
+    def _knn_interpolate(self, logits, pos_x, pos_y, batch_x, batch_y) -> torch.Tensor:
+        return knn_interpolate(
+            logits,
+            pos_x.cpu(),
+            pos_y.cpu(),
+            batch_x=batch_x.cpu(),
+            batch_y=batch_y.cpu(),
+            k=self.hparams.interpolation_k,
+            num_workers=self.hparams.num_workers,
+            backend=self.hparams.get("interpolation_knn_backend", "torch_cluster"),
+        )
+
+    def _get_sampled_pos(self, batch: Batch, batch_y: torch.Tensor) -> torch.Tensor:
+        """Unnormalized positions of sampled points, from their indices in pos_copy if available."""
+        if "sampled_idx" not in batch.copies:
+            return batch.copies["pos_sampled_copy"]
+        # Indices are local to each sample: offset them by the number of points of previous samples.
+        num_points = torch.bincount(batch_y, minlength=batch.num_graphs)
+        offsets = (torch.cumsum(num_points, dim=0) - num_points).to(batch.batch.device)
+        return batch.copies["pos_copy"][batch.copies["sampled_idx"] + offsets[batch.batch]]
+
+    def _backproject_by_voxel(self, logits, batch: Batch, batch_y: torch.Tensor) -> torch.Tensor:
+        """Gather logits of the sampled point of the voxel of each point.
+
+        Points whose voxel has no sampled point anymore (e.g. dropped by FixedPoints or
+        MaximumNumNodes) fall back to kNN interpolation.
+
         """
-        return torch.cat([torch.full((len(sample_pos),), i) for i, sample_pos in enumerate(pos_x)])
+        node_idx = get_voxel_backprojection_idx(
+            batch.copies["voxel_idx"].cpu(),
+            batch_y,
+            batch.sampled_voxel_idx.cpu(),
+            batch.batch.cpu(),
+        )
+        found = node_idx >= 0
+        full_logits = logits.new_empty((node_idx.size(0), logits.size(1)))
+        full_logits[found] = logits[node_idx[found]]
+        if not found.all():
+            missing = ~found
+            full_logits[missing] = self._knn_interpolate(
+                logits,
+                self._get_sampled_pos(batch, batch_y),
+                batch.copies["pos_copy"][missing.to(batch.copies["pos_copy"].device)],
+                batch.batch,
+                batch_y[missing],
+            )
+        return full_logits
+
+
+def get_batch_y(batch: Batch) -> torch.Tensor:
+    """Get the sample of each point of the original clouds (e.g. [0,0,1,1,1,...,B-1]), on CPU.
+
+    Sizes of samples come from idx_in_original_cloud_ptr if collated by CSRCollater, else from the
+    list of idx_in_original_cloud of each sample.
+
+    """
+    ptr = getattr(batch, "idx_in_original_cloud_ptr", None)
+    if ptr is None:
+        sizes = torch.tensor([len(idx) for idx in batch.idx_in_original_cloud], dtype=torch.long)
+    else:
+        sizes = ptr.cpu().diff()
+    return torch.repeat_interleave(sizes)
+
+
+def get_voxel_backprojection_idx(
+    voxel_idx: torch.Tensor,
+    batch_y: torch.Tensor,
+    sampled_voxel_idx: torch.Tensor,
+    batch_x: torch.Tensor,
+) -> torch.Tensor:
+    """Get the index of the sampled point that shares the voxel of each full-resolution point.
+
+    Voxel indices are local to each sample of the batch: they are made global with per-sample offsets.
+
+    Args:
+        voxel_idx (torch.Tensor): voxel of each full-resolution point, of shape (N,).
+        batch_y (torch.Tensor): sample of each full-resolution point, of shape (N,).
+        sampled_voxel_idx (torch.Tensor): voxel of each sampled point, of shape (M,).
+        batch_x (torch.Tensor): sample of each sampled point, of shape (M,).
+
+    Returns:
+        torch.Tensor: index of a sampled point for each full-resolution point, of shape (N,),
+        or -1 if no sampled point is left in its voxel.
+
+    """
+    batch_size = int(max(batch_y.max(), batch_x.max())) + 1 if batch_y.numel() else 0
+    num_voxels = torch.zeros(batch_size, dtype=torch.long)
+    num_voxels.scatter_reduce_(0, batch_y, voxel_idx + 1, reduce="amax")
+    offsets = torch.cumsum(num_voxels, dim=0) - num_voxels
+    node_by_voxel = torch.full((int(num_voxels.sum()),), -1, dtype=torch.long)
+    node_by_voxel[sampled_voxel_idx + offsets[batch_x]] = torch.arange(sampled_voxel_idx.size(0))
+    return node_by_voxel[voxel_idx + offsets[batch_y]]
@@ -0,0 +1,279 @@
+"""K nearest neighbors search, with backends selectable at each call site.
+
+- "torch_cluster": brute force search by cloud (CPU, multithreaded with num_workers) or GPU.
+- "kdtree": scipy's cKDTree, built for each cloud, with queries on all cores. CPU only.
+- "voxel_grid": exact search among the points of the 3x3x3 voxels around each query, for voxels
+  sized after the density of points. Points whose k-th neighbor may lie outside of these voxels
+  fall back to "kdtree". Any device.
+
+All backends follow torch_cluster's conventions, including for clouds with less than k points.
+
+Searches are excluded from torch.compile graphs: they are custom kernels or scipy calls, with outputs
+of data-dependent sizes, which run eagerly between compiled regions.
+
+"""
+
+from typing import Optional, Tuple
+
+import numpy as np
+import torch
+from scipy.spatial import cKDTree
+from torch import LongTensor, Tensor
+from torch_geometric.nn.pool import knn as torch_cluster_knn
+from torch_scatter import scatter
+
+KNN_BACKENDS = ["torch_cluster", "kdtree", "voxel_grid"]
+
+
+@torch.compiler.disable
+def knn(
+    x: Tensor,
+    y: Tensor,
+    k: int,
+    batch_x: Optional[Tensor] = None,
+    batch_y: Optional[Tensor] = None,
+    num_workers: int = 1,
+    backend: str = "torch_cluster",
+) -> LongTensor:
+    """For each element in y, find the k nearest points in x, in the same cloud.
+
+    Args:
+        x (Tensor): (N, D) positions to search in.
+        y (Tensor): (M, D) query positions.
+        k (int): number of neighbors.
+        batch_x (Tensor, optional): sorted cloud of each point of x. Defaults to None.
+        batch_y (Tensor, optional): sorted cloud of each point of y. Defaults to None.
+        num_workers (int, optional): number of CPU workers of "torch_cluster". Defaults to 1.
+        backend (str, optional): one of KNN_BACKENDS. Defaults to "torch_cluster".
+
+    Returns:
+        LongTensor: (2, E) indices in y and x of pairs of neighbors, grouped by query in order.
+
+    """
+    if backend == "torch_cluster":
+        return torch_cluster_knn(x, y, k, batch_x, batch_y, num_workers=num_workers)
+    if backend == "kdtree":
+        return kdtree_knn(x, y, k, batch_x, batch_y)
+    if backend == "voxel_grid":
+        return voxel_grid_knn(x, y, k, batch_x, batch_y)
+    raise ValueError(f"Unknown knn backend {backend}. Choose among {KNN_BACKENDS}.")
+
+
+def knn_graph(
+    x: Tensor,
+    k: int,
+    batch: Optional[Tensor] = None,
+    num_workers: int = 1,
+    backend: str = "torch_cluster",
+) -> LongTensor:
+    """kNN graph of points, including self-loops, with edges from neighbors to centroids."""
+    row, col = knn(x, x, k, batch, batch, num_workers=num_workers, backend=backend)
+    return torch.stack([col, row], dim=0)
+
+
+def knn_interpolate(
+    x: Tensor,
+    pos_x: Tensor,
+    pos_y: Tensor,
+    batch_x: Optional[Tensor] = None,
+    batch_y: Optional[Tensor] = None,
+    k: int = 3,
+    num_workers: int = 1,
+    backend: str = "torch_cluster",
+) -> Tensor:
+    """Interpolate features of k nearest points, weighted by inverse squared distance.
+
+    Same as torch_geometric.nn.knn_interpolate, with a knn backend.
+
+    """
+    with torch.no_grad():
+        y_idx, x_idx = knn(pos_x, pos_y, k, batch_x, batch_y, num_workers, backend)
+        diff = pos_x[x_idx] - pos_y[y_idx]
+        squared_distance = (diff * diff).sum(dim=-1, keepdim=True)
+        weights = 1.0 / torch.clamp(squared_distance, min=1e-16)
+
+    y = scatter(x[x_idx] * weights, y_idx, dim=0, dim_size=pos_y.size(0), reduce="sum")
+    y = y / scatter(weights, y_idx, dim=0, dim_size=pos_y.size(0), reduce="sum")
+    return y
+
+
+def kdtree_knn(
+    x: Tensor,
+    y: Tensor,
+    k: int,
+    batch_x: Optional[Tensor] = None,
+    batch_y: Optional[Tensor] = None,
+) -> LongTensor:
+    """kNN with a cKDTree for each cloud, queried on all cores."""
+    ptr_x, ptr_y = _get_ptr(batch_x, x.size(0)), _get_ptr(batch_y, y.size(0))
+    num_clouds = min(len(ptr_x), len(ptr_y)) - 1
+    x_np, y_np = x.detach().cpu().numpy(), y.detach().cpu().numpy()
+    rows, cols = [], []
+    for cloud in range(num_clouds):
+        x_start, x_end = ptr_x[cloud], ptr_x[cloud + 1]
+        y_start, y_end = ptr_y[cloud], ptr_y[cloud + 1]
+        cloud_k = min(k, x_end - x_start)
+        if cloud_k == 0 or y_end == y_start:
+            continue
+        tree = cKDTree(x_np[x_start:x_end])
+        _, idx = tree.query(y_np[y_start:y_end], k=[*range(1, cloud_k + 1)], workers=-1)
+        rows.append(np.repeat(np.arange(y_start, y_end), cloud_k))
+        cols.append(idx.reshape(-1) + x_start)
+    if not rows:
+        return torch.empty((2, 0), dtype=torch.long, device=x.device)
+    row, col = torch.from_numpy(np.concatenate(rows)), torch.from_numpy(np.concatenate(cols))
+    return torch.stack([row, col], dim=0).long().to(x.device)
+
+
+def voxel_grid_knn(
+    x: Tensor,
+    y: Tensor,
+    k: int,
+    batch_x: Optional[Tensor] = None,
+    batch_y: Optional[Tensor] = None,
+    voxel_size: Optional[float] = None,
+) -> LongTensor:
+    """Exact kNN among the points of the 3x3x3 voxels around each query.
+
+    Any point within voxel_size of a query is in these voxels: the result is exact for queries
+    whose k-th neighbor is within voxel_size. Other queries fall back to kdtree_knn.
+
+    Args:
+        voxel_size (float, optional): size of voxels. Defaults to the side of the square
+            expected to hold k points, for points spread over the xy extent of x.
+
+    """
+    device = x.device
+    if x.size(0) == 0 or y.size(0) == 0:
+        return torch.empty((2, 0), dtype=torch.long, device=device)
+    if batch_x is None:
+        batch_x = torch.zeros(x.size(0), dtype=torch.long, device=device)
+    if batch_y is None:
+        batch_y = torch.zeros(y.size(0), dtype=torch.long, device=device)
+
+    origin = torch.minimum(x.min(dim=0).values, y.min(dim=0).values)
+    if voxel_size is None:
+        extent = (x.max(dim=0).values - origin)[:2].clamp(min=1e-6)
+        voxel_size = float(torch.sqrt(k * extent.prod() / x.size(0)).clamp(min=1e-6))
+
+    # Voxels of each cloud, with a margin of one voxel on each side for neighboring voxels.
+    coords_x = ((x - origin) / voxel_size).floor().long() + 1
+    coords_y = ((y - origin) / voxel_size).floor().long() + 1
+    dims = torch.maximum(coords_x.max(dim=0).values, coords_y.max(dim=0).values) + 2
+
+    def keys(batch: Tensor, coords: Tensor) -> Tensor:
+        key = batch
+        for dim in range(coords.size(1)):
+            key = key * dims[dim] + coords[:, dim]
+        return key
+
+    grid = VoxelGrid(x, keys(batch_x, coords_x))
+    # Neighboring voxels along the last dimension have consecutive keys: they are searched at once,
+    # as a single range of points, from the voxel below to the voxel above.
+    num_dims = coords_y.size(1)
+    offsets = torch.cartesian_prod(*[torch.arange(-1, 2, device=device)] * (num_dims - 1))
+    offsets = torch.cat(
+        [offsets.view(-1, num_dims - 1), offsets.new_full((len(offsets), 1), -1)], 1
+    )
+    lower_keys = torch.stack([keys(batch_y, coords_y + offset) for offset in offsets], dim=1)
+
+    row, col, exact = grid.knn(y, lower_keys, k, voxel_size)
+    if not exact.all():
+        # Fall back to exact search, with indices of queries and points mapped back.
+        inexact = (~exact).nonzero().squeeze(1)
+        keep = exact[row]
+        row, col = row[keep], col[keep]
+        x_idx = torch.isin(batch_x, batch_y[inexact].unique()).nonzero().squeeze(1)
+        fallback_row, fallback_col = kdtree_knn(
+            x[x_idx], y[inexact], k, batch_x[x_idx], batch_y[inexact]
+        )
+        row = torch.cat([row, inexact[fallback_row]])
+        col = torch.cat([col, x_idx[fallback_col]])
+        # Group by query again.
+        regroup = torch.sort(row, stable=True)[1]
+        row, col = row[regroup], col[regroup]
+
+    return torch.stack([row, col], dim=0)
+
+
+class VoxelGrid:
+    """Points sorted by voxel, to search among the points of ranges of consecutive voxels."""
+
+    def __init__(self, x: Tensor, keys: LongTensor):
+        self.sorted_keys, self.order = torch.sort(keys)
+        # A point at infinity, for padding.
+        self.sorted_x = torch.cat([x[self.order], x.new_full((1, x.size(1)), float("inf"))])
+        self.padding_idx = x.size(0)
+
+    def knn(
+        self, y: Tensor, lower_keys: LongTensor, k: int, voxel_size: float, max_size: int = 2**24
+    ) -> Tuple[LongTensor, LongTensor, Tensor]:
+        """kNN of queries among points of voxels [lower_key, lower_key + 2], and whether it is exact.
+
+        Queries are processed by chunks, so that dense (Q, num_candidates) tensors hold in max_size.
+
+        """
+        device = y.device
+        starts = torch.searchsorted(self.sorted_keys, lower_keys, side="left")  # Q, R
+        counts = torch.searchsorted(self.sorted_keys, lower_keys + 2, side="right") - starts
+        num_candidates = counts.sum(dim=1)
+
+        rows, cols, exact = [], [], []
+        start = 0
+        while start < y.size(0):
+            # Largest chunk whose dense tensors hold in max_size.
+            max_candidates = torch.cummax(num_candidates[start:], dim=0).values
+            sizes = max_candidates * torch.arange(1, len(max_candidates) + 1, device=device)
+            end = start + max(1, int((sizes <= max_size).sum()))
+            row, col, chunk_exact = self._knn_chunk(
+                y[start:end], starts[start:end], counts[start:end], k, voxel_size
+            )
+            rows.append(row + start)
+            cols.append(col)
+            exact.append(chunk_exact)
+            start = end
+        return torch.cat(rows), torch.cat(cols), torch.cat(exact)
+
+    def _knn_chunk(self, y, starts, counts, k, voxel_size):
+        device = y.device
+        num_queries = y.size(0)
+        num_candidates = counts.sum(dim=1)
+        max_candidates = int(num_candidates.max())
+        total = int(num_candidates.sum())
+
+        # Flat candidates, grouped by query: positions in sorted points, and rank in their query.
+        counts, starts = counts.flatten(), starts.flatten()
+        flat = torch.arange(total, device=device)
+        ranges_first = torch.cumsum(counts, 0) - counts
+        position = torch.repeat_interleave(starts - ranges_first, counts, output_size=total) + flat
+        query = torch.repeat_interleave(
+            torch.arange(num_queries, device=device), num_candidates, output_size=total
+        )
+        rank = flat - (torch.cumsum(num_candidates, 0) - num_candidates)[query]
+        candidates = torch.full(
+            (num_queries, max_candidates), self.padding_idx, dtype=torch.long, device=device
+        )
+        candidates[query, rank] = position
+
+        # k nearest candidates of each query.
+        diff = self.sorted_x[candidates] - y.unsqueeze(1)
+        squared_distance = (diff * diff).sum(dim=2)  # inf for padding
+        k_found = min(k, max_candidates)
+        nearest_distance, nearest = torch.topk(squared_distance, k_found, dim=1, largest=False)
+        found = nearest_distance.isfinite()
+        row = torch.arange(num_queries, device=device).unsqueeze(1).expand_as(nearest)[found]
+        col = self.order[candidates.gather(1, nearest)[found]]
+
+        # Exact if k neighbors were found, all within voxel_size of the query.
+        if k_found < k:
+            exact = torch.zeros(num_queries, dtype=torch.bool, device=device)
+        else:
+            exact = nearest_distance[:, -1] < voxel_size**2
+        return row, col, exact
+
+
+def _get_ptr(batch: Optional[Tensor], num_nodes: int) -> np.ndarray:
+    if batch is None:
+        return np.array([0, num_nodes])
+    count = torch.bincount(batch.cpu()).numpy()
+    return np.concatenate([[0], np.cumsum(count)])
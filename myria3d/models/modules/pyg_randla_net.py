@@ -1,23 +1,27 @@
 import os.path as osp
+from contextlib import contextmanager, nullcontext
 from numbers import Number
-from typing import Tuple
+from typing import Dict, List, Optional, Sequence, Tuple
 
 import torch
 import torch.nn.functional as F
 import torch_geometric.transforms as T
 from torch import LongTensor, Tensor
 from torch.nn import Linear
+from torch.nn.modules.batchnorm import _BatchNorm
+from torch.utils.checkpoint import checkpoint
+from torch_geometric.data import Batch
 from torch_geometric.datasets import ShapeNet
 from torch_geometric.loader import DataLoader
 from torch_geometric.nn import MLP
 from torch_geometric.nn.conv import MessagePassing
-from torch_geometric.nn.pool import knn_graph
-from torch_geometric.nn.unpool import knn_interpolate
 from torch_geometric.utils import softmax
 from torch_scatter import scatter
 from torchmetrics.functional import jaccard_index
 from tqdm import tqdm
 
+from myria3d.models.modules.knn import knn, knn_graph, knn_interpolate
+
 
 class PyGRandLANet(torch.nn.Module):
     def __init__(
@@ -27,8 +31,30 @@ class PyGRandLANet(torch.nn.Module):
         decimation: int = 4,
         num_neighbors: int = 16,
         return_logits: bool = False,
+        dense_aggregation: bool = False,
+        knn_backend: str = "torch_cluster",
+        checkpointing: bool = False,
+        channels: Sequence[int] = (32, 128, 256, 512),
     ):
+        """RandLA-Net.
+
+        Args:
+            dense_aggregation (bool, optional): run local feature aggregations on dense
+                (N, K, C) tensors instead of with message passing. Same weights. Defaults to False.
+            knn_backend (str, optional): backend of neighbor searches (see KNN_BACKENDS).
+                Defaults to "torch_cluster".
+            checkpointing (bool, optional): recompute activations of the dilated residual blocks
+                during backward instead of storing them, in training. Same outputs and gradients.
+                Defaults to False.
+            channels (Sequence[int], optional): output channels of the 4 dilated residual blocks,
+                which the decoder mirrors. Multiples of 8. Narrower networks are cheaper, e.g. as
+                students of a distillation (see DistillationModel). Defaults to (32, 128, 256, 512).
+
+        """
         super().__init__()
+        if len(channels) != 4 or any(c % 8 for c in channels):
+            raise ValueError(f"Expected 4 multiples of 8 as channels, got {channels}.")
+        c1, c2, c3, c4 = channels
 
         self.decimation = decimation
         # An option to return logits instead of probas
@@ -40,32 +66,50 @@ class PyGRandLANet(torch.nn.Module):
         d_bottleneck = max(32, num_classes, num_features)
 
         self.fc0 = Linear(num_features, d_bottleneck)
-        self.block1 = DilatedResidualBlock(num_neighbors, d_bottleneck, 32)
-        self.block2 = DilatedResidualBlock(num_neighbors, 32, 128)
-        self.block3 = DilatedResidualBlock(num_neighbors, 128, 256)
-        self.block4 = DilatedResidualBlock(num_neighbors, 256, 512)
-        self.mlp_summit = SharedMLP([512, 512])
-        self.fp4 = FPModule(1, SharedMLP([512 + 256, 256]))
-        self.fp3 = FPModule(1, SharedMLP([256 + 128, 128]))
-        self.fp2 = FPModule(1, SharedMLP([128 + 32, 32]))
-        self.fp1 = FPModule(1, SharedMLP([32 + 32, d_bottleneck]))
+        kwargs = {
+            "dense": dense_aggregation,
+            "knn_backend": knn_backend,
+            "checkpointing": checkpointing,
+        }
+        self.block1 = DilatedResidualBlock(num_neighbors, d_bottleneck, c1, **kwargs)
+        self.block2 = DilatedResidualBlock(num_neighbors, c1, c2, **kwargs)
+        self.block3 = DilatedResidualBlock(num_neighbors, c2, c3, **kwargs)
+        self.block4 = DilatedResidualBlock(num_neighbors, c3, c4, **kwargs)
+        self.mlp_summit = SharedMLP([c4, c4])
+        self.fp4 = FPModule(1, SharedMLP([c4 + c3, c3]), knn_backend)
+        self.fp3 = FPModule(1, SharedMLP([c3 + c2, c2]), knn_backend)
+        self.fp2 = FPModule(1, SharedMLP([c2 + c1, c1]), knn_backend)
+        self.fp1 = FPModule(1, SharedMLP([c1 + c1, d_bottleneck]), knn_backend)
         self.mlp_classif = SharedMLP([d_bottleneck, 64, 32], dropout=[0.0, 0.5])
         self.fc_classif = Linear(32, num_classes)
 
-    def forward(self, x, pos, batch, ptr):
+    def forward(self, x, pos, batch, ptr, pyramid: Optional[Dict[str, Tensor]] = None):
+        """Forward pass.
+
+        If a pyramid precomputed in dataloader workers (see RandLANetPyramid transform) is given,
+        neighbors, decimations and upsamplings are taken from it instead of being computed here.
+
+        """
         x = x if x is not None else pos
 
-        b1_out = self.block1(self.fc0(x), pos, batch)
-        b1_out_decimated, ptr1 = decimate(b1_out, ptr, self.decimation)
+        if pyramid is not None:
+            neighbors, idx_decim, idx_upsampling = get_pyramid_indices(
+                pyramid, ptr, self.decimation, num_levels=4
+            )
+        else:
+            neighbors = idx_decim = idx_upsampling = [None] * 4
 
-        b2_out = self.block2(*b1_out_decimated)
-        b2_out_decimated, ptr2 = decimate(b2_out, ptr1, self.decimation)
+        b1_out = self.block1(self.fc0(x), pos, batch, neighbors[0])
+        b1_out_decimated, ptr1 = decimate(b1_out, ptr, self.decimation, idx_decim[0])
 
-        b3_out = self.block3(*b2_out_decimated)
-        b3_out_decimated, ptr3 = decimate(b3_out, ptr2, self.decimation)
+        b2_out = self.block2(*b1_out_decimated, neighbors[1])
+        b2_out_decimated, ptr2 = decimate(b2_out, ptr1, self.decimation, idx_decim[1])
 
-        b4_out = self.block4(*b3_out_decimated)
-        b4_out_decimated, _ = decimate(b4_out, ptr3, self.decimation)
+        b3_out = self.block3(*b2_out_decimated, neighbors[2])
+        b3_out_decimated, ptr3 = decimate(b3_out, ptr2, self.decimation, idx_decim[2])
+
+        b4_out = self.block4(*b3_out_decimated, neighbors[3])
+        b4_out_decimated, _ = decimate(b4_out, ptr3, self.decimation, idx_decim[3])
 
         mlp_out = (
             self.mlp_summit(b4_out_decimated[0]),
@@ -73,13 +117,14 @@ class PyGRandLANet(torch.nn.Module):
             b4_out_decimated[2],
         )
 
-        fp4_out = self.fp4(*mlp_out, *b3_out_decimated)
-        fp3_out = self.fp3(*fp4_out, *b2_out_decimated)
-        fp2_out = self.fp2(*fp3_out, *b1_out_decimated)
-        fp1_out = self.fp1(*fp2_out, *b1_out)
+        fp4_out = self.fp4(*mlp_out, *b3_out_decimated, idx_upsampling[3])
+        fp3_out = self.fp3(*fp4_out, *b2_out_decimated, idx_upsampling[2])
+        fp2_out = self.fp2(*fp3_out, *b1_out_decimated, idx_upsampling[1])
+        fp1_out = self.fp1(*fp2_out, *b1_out, idx_upsampling[0])
 
         x = self.mlp_classif(fp1_out[0])
-        logits = self.fc_classif(x)
+        # In float32 under mixed precision: loss, softmax and entropy are computed from logits.
+        logits = self.fc_classif(x).float()
 
         if self.return_logits:
             return logits
@@ -147,10 +192,64 @@ class LocalFeatureAggregation(MessagePassing):
         # Attention will weight the different features of x
         # along the neighborhood dimension.
         att_features = self.mlp_attention(local_features)  # N * K, d_out
-        att_scores = softmax(att_features, index=index)  # N * K, d_out
+        # In float32 under mixed precision, as the distances above (computed from positions).
+        att_scores = softmax(att_features.float(), index=index)  # N * K, d_out
 
         return att_scores * local_features  # N * K, d_out
 
+    def forward_dense(self, neighbors: Tensor, x: Tensor, pos: Tensor) -> Tensor:
+        """Same as forward, on dense (N, K, C) tensors, with a plain softmax over neighbors.
+
+        Args:
+            neighbors (Tensor): indices of the K neighbors of each point (N, K), -1 if missing.
+            x (Tensor): features (N, d)
+            pos (Tensor): positions (N, 3)
+
+        returns:
+            (Tensor): aggregated features (N, d_out)
+
+        """
+        num_nodes, k = neighbors.shape
+        valid = neighbors >= 0
+        # Missing neighbors are only found in clouds with less than K points.
+        padded = not bool(valid.all())
+        neighbors = neighbors.clamp(min=0)
+
+        pos_i = pos.unsqueeze(1).expand(num_nodes, k, pos.size(1))  # N, K, 3
+        pos_j = pos[neighbors]  # N, K, 3
+        pos_diff = pos_j - pos_i
+        distance = torch.sqrt((pos_diff * pos_diff).sum(2, keepdim=True))
+        relative_infos = torch.cat([pos_i, pos_j, pos_diff, distance], dim=2)  # N, K, 10
+        local_spatial_encoding = self._apply_shared_mlp(
+            self.mlp_encoder, relative_infos, valid if padded else None
+        )  # N, K, d
+        local_features = torch.cat([x[neighbors], local_spatial_encoding], dim=2)  # N, K, 2d
+
+        att_features = self._apply_shared_mlp(
+            self.mlp_attention, local_features, valid if padded else None
+        )  # N, K, d_out
+        if padded:
+            att_features = att_features.masked_fill(~valid.unsqueeze(2), float("-inf"))
+            local_features = local_features.masked_fill(~valid.unsqueeze(2), 0)
+        att_scores = att_features.float().softmax(dim=1)  # N, K, d_out
+
+        out = (att_scores * local_features).sum(dim=1)  # N, d_out
+        out = self.mlp_post_attention(out)  # N, d_out
+        return out
+
+    def _apply_shared_mlp(self, mlp: MLP, x: Tensor, valid: Optional[Tensor]) -> Tensor:
+        """Apply a SharedMLP to (N, K, C) tensors, only on valid neighbors if given.
+
+        Missing neighbors are excluded so that they do not affect batch statistics.
+
+        """
+        if valid is None:
+            return mlp(x.flatten(0, 1)).unflatten(0, x.shape[:2])
+        values = mlp(x[valid])  # Of the dtype of the MLP under mixed precision.
+        out = values.new_zeros(x.shape[:2] + (values.size(1),))
+        out[valid] = values
+        return out
+
 
 class DilatedResidualBlock(torch.nn.Module):
     def __init__(
@@ -158,11 +257,25 @@ class DilatedResidualBlock(torch.nn.Module):
         num_neighbors,
         d_in: int,
         d_out: int,
+        dense: bool = False,
+        knn_backend: str = "torch_cluster",
+        checkpointing: bool = False,
     ):
+        """Dilated residual block of RandLA-Net.
+
+        With checkpointing, only the inputs of the block are kept for backward, instead of the
+        (N * K, C) edge tensors of its local feature aggregations and the outputs of its MLPs.
+        These are recomputed during backward, which costs one more forward pass of the block,
+        neighbor searches excluded. See benchmarks/benchmark_local_feature_aggregation.py.
+
+        """
         super().__init__()
         self.num_neighbors = num_neighbors
         self.d_in = d_in
         self.d_out = d_out
+        self.dense = dense
+        self.knn_backend = knn_backend
+        self.checkpointing = checkpointing
 
         # MLP on input
         self.mlp1 = SharedMLP([d_in, d_out // 8])
@@ -176,19 +289,90 @@ class DilatedResidualBlock(torch.nn.Module):
 
         self.lrelu = torch.nn.LeakyReLU(**lrelu02_kwargs)
 
-    def forward(self, x, pos, batch):
-        edge_index = knn_graph(pos, self.num_neighbors, batch=batch, loop=True)
+    def forward(self, x, pos, batch, neighbors: Optional[Tensor] = None):
+        """Forward pass, with precomputed (N, K) neighbors if given (-1 if missing)."""
+        # Neighbors, or edge_index, are not recomputed with checkpointing.
+        if self.dense:
+            if neighbors is None:
+                neighbors = knn_neighbors(pos, self.num_neighbors, batch, self.knn_backend)
+            graph = neighbors
+        elif neighbors is None:
+            graph = knn_graph(pos, self.num_neighbors, batch, backend=self.knn_backend)
+        else:
+            graph = neighbors_to_edge_index(neighbors)
+
+        if self.checkpointing and self.training and torch.is_grad_enabled():
+            x = checkpoint(
+                self._forward_features,
+                x,
+                pos,
+                graph,
+                use_reentrant=False,
+                context_fn=lambda: (nullcontext(), frozen_running_stats(self)),
+            )
+        else:
+            x = self._forward_features(x, pos, graph)
+        return x, pos, batch
 
+    def _forward_features(self, x: Tensor, pos: Tensor, graph: LongTensor) -> Tensor:
+        """Features of the block, given (N, K) neighbors if dense, or an edge_index otherwise."""
         shortcut_of_x = self.shortcut(x)  # N, d_out
         x = self.mlp1(x)  # N, d_out//8
-        x = self.lfa1(edge_index, x, pos)  # N, d_out//2
-        x = self.lfa2(edge_index, x, pos)  # N, d_out//2
+        if self.dense:
+            x = self.lfa1.forward_dense(graph, x, pos)  # N, d_out//2
+            x = self.lfa2.forward_dense(graph, x, pos)  # N, d_out//2
+        else:
+            x = self.lfa1(graph, x, pos)  # N, d_out//2
+            x = self.lfa2(graph, x, pos)  # N, d_out//2
         x = self.mlp2(x)  # N, d_out
-        x = self.lrelu(x + shortcut_of_x)  # N, d_out
+        return self.lrelu(x + shortcut_of_x)  # N, d_out
+
+
+@contextmanager
+def frozen_running_stats(module: torch.nn.Module):
+    """Do not update running statistics of batch norms, e.g. when activations are recomputed."""
+    norms = [
+        norm
+        for norm in module.modules()
+        if isinstance(norm, _BatchNorm) and norm.track_running_stats
+    ]
+    states = [(norm.momentum, norm.num_batches_tracked.clone()) for norm in norms]
+    for norm in norms:
+        norm.momentum = 0.0
+    try:
+        yield
+    finally:
+        for norm, (momentum, num_batches_tracked) in zip(norms, states):
+            norm.momentum = momentum
+            norm.num_batches_tracked.copy_(num_batches_tracked)
+
+
+def knn_neighbors(
+    pos: Tensor, k: int, batch: Optional[Tensor] = None, backend: str = "torch_cluster"
+) -> LongTensor:
+    """Get the k nearest neighbors of each point (including itself) in its cloud.
+
+    :rtype: :class:`LongTensor`: (N, k) indices of neighbors, padded with -1 for points of clouds
+        with less than k points.
+
+    """
+    row, col = knn(pos, pos, k, batch, batch, backend=backend)
+    # Neighbors are grouped by query point, in order.
+    count = torch.bincount(row, minlength=pos.size(0))
+    rank = torch.arange(row.size(0), device=pos.device) - (torch.cumsum(count, 0) - count)[row]
+    neighbors = torch.full((pos.size(0), k), -1, dtype=torch.long, device=pos.device)
+    neighbors[row, rank] = col
+    return neighbors
 
-        return x, pos, batch
 
+def neighbors_to_edge_index(neighbors: LongTensor) -> LongTensor:
+    """Turn (N, k) neighbors into an edge_index from neighbors to centroids, as knn_graph."""
+    valid = neighbors >= 0
+    target = torch.arange(neighbors.size(0), device=neighbors.device).unsqueeze(1)
+    return torch.stack([neighbors[valid], target.expand_as(neighbors)[valid]])
 
+
+@torch.compiler.disable
 def decimation_indices(ptr: LongTensor, decimation_factor: Number) -> Tuple[Tensor, LongTensor]:
     """Get indices which downsample each point cloud by a decimation factor.
 
@@ -204,6 +388,8 @@ def decimation_indices(ptr: LongTensor, decimation_factor: Number) -> Tuple[Tens
     :rtype: (:class:`Tensor`, :class:`LongTensor`): indices for downsampling
         and resulting updated ptr.
 
+    Runs eagerly under torch.compile: sizes of outputs depend on ptr values.
+
     """
     if decimation_factor < 1:
         raise ValueError(
@@ -213,41 +399,110 @@ def decimation_indices(ptr: LongTensor, decimation_factor: Number) -> Tuple[Tens
 
     batch_size = ptr.size(0) - 1
     bincount = ptr[1:] - ptr[:-1]
-    decimated_bincount = torch.div(bincount, decimation_factor, rounding_mode="floor")
-    # Decimation should not empty clouds completely.
-    decimated_bincount = torch.max(torch.ones_like(decimated_bincount), decimated_bincount)
-    idx_decim = torch.cat(
-        [
-            (ptr[i] + torch.randperm(bincount[i], device=ptr.device)[: decimated_bincount[i]])
-            for i in range(batch_size)
-        ],
-        dim=0,
+    ptr_decim = decimated_ptr(ptr, decimation_factor)
+    decimated_bincount = ptr_decim[1:] - ptr_decim[:-1]
+    # Random permutation of the points of each cloud, all at once: points are sorted by cloud, and
+    # then by a random rank drawn without replacement, so that sort keys are distinct. The first
+    # points of each cloud are then a uniformly drawn subset, as with a randperm for each cloud.
+    num_nodes = int(ptr[-1])
+    batch = torch.repeat_interleave(
+        torch.arange(batch_size, device=ptr.device), bincount, output_size=num_nodes
     )
-    # Get updated ptr (e.g. for future decimations)
-    ptr_decim = ptr.clone()
-    for i in range(batch_size):
-        ptr_decim[i + 1] = ptr_decim[i] + decimated_bincount[i]
+    keys = batch * num_nodes + torch.randperm(num_nodes, device=ptr.device)
+    perm = torch.sort(keys)[1]
+    # Rank of each point in the permutation of its cloud.
+    rank = torch.arange(num_nodes, device=ptr.device) - ptr[batch]
+    idx_decim = perm[rank < decimated_bincount[batch]]
 
     return idx_decim, ptr_decim
 
 
-def decimate(tensors, ptr: Tensor, decimation_factor: int):
-    """Decimate each element of the given tuple of tensors."""
-    idx_decim, ptr_decim = decimation_indices(ptr, decimation_factor)
+def decimated_ptr(ptr: LongTensor, decimation_factor: Number) -> LongTensor:
+    """Get ptr of clouds after decimation (e.g. for future decimations)."""
+    bincount = ptr[1:] - ptr[:-1]
+    decimated_bincount = torch.div(bincount, decimation_factor, rounding_mode="floor")
+    # Decimation should not empty clouds completely.
+    decimated_bincount = torch.max(torch.ones_like(decimated_bincount), decimated_bincount)
+    return torch.cat([ptr.new_zeros(1), torch.cumsum(decimated_bincount, dim=0)])
+
+
+def decimate(tensors, ptr: Tensor, decimation_factor: int, idx_decim: Optional[Tensor] = None):
+    """Decimate each element of the given tuple of tensors, with given indices if any."""
+    if idx_decim is None:
+        idx_decim, ptr_decim = decimation_indices(ptr, decimation_factor)
+    else:
+        ptr_decim = decimated_ptr(ptr, decimation_factor)
     tensors_decim = tuple(tensor[idx_decim] for tensor in tensors)
     return tensors_decim, ptr_decim
 
 
+def get_pyramid(batch: Batch) -> Optional[Dict[str, Tensor]]:
+    """Get the pyramid precomputed by the RandLANetPyramid transform, if any."""
+    pyramid = {key: batch[key] for key in batch.keys() if key.startswith("pyramid_")}
+    return pyramid or None
+
+
+def get_pyramid_indices(
+    pyramid: Dict[str, Tensor], ptr: LongTensor, decimation_factor: Number, num_levels: int
+) -> Tuple[List[Tensor], List[Tensor], List[Tensor]]:
+    """Turn a collated pyramid, with indices local to each cloud, into indices in the batch.
+
+    Args:
+        pyramid (Dict[str, Tensor]): pyramid_neighbors_{level} (N_l, K) (-1 for missing neighbors),
+            pyramid_decimation_{level} (N_l+1,) and pyramid_upsampling_{level} (N_l,) indices.
+        ptr (LongTensor): indices of samples in the batch.
+        decimation_factor (Number): decimation factor, which must be the one of the pyramid.
+        num_levels (int): number of levels of the pyramid.
+
+    Returns:
+        Tuple[List[Tensor], List[Tensor], List[Tensor]]: for each level, the (N_l, K) neighbors
+        (-1 if missing), the indices for downsampling, and the indices of nearest points for
+        upsampling.
+
+    """
+    neighbors_list, idx_decim, idx_upsampling = [], [], []
+    batch = torch.repeat_interleave(torch.arange(ptr.size(0) - 1, device=ptr.device), ptr.diff())
+    for level in range(num_levels):
+        ptr_decim = decimated_ptr(ptr, decimation_factor)
+        batch_decim = torch.repeat_interleave(
+            torch.arange(ptr.size(0) - 1, device=ptr.device), ptr_decim.diff()
+        )
+        neighbors = pyramid[f"pyramid_neighbors_{level}"]
+        decimation = pyramid[f"pyramid_decimation_{level}"]
+        upsampling = pyramid[f"pyramid_upsampling_{level}"]
+        if neighbors.size(0) != ptr[-1] or decimation.size(0) != ptr_decim[-1]:
+            raise ValueError(
+                f"Pyramid does not match the decimation factor of the model ({decimation_factor})."
+            )
+
+        offsets = ptr[batch].unsqueeze(1)
+        neighbors_list.append(torch.where(neighbors >= 0, neighbors + offsets, neighbors))
+        idx_decim.append(decimation + ptr[batch_decim])
+        idx_upsampling.append(upsampling + ptr_decim[batch])
+
+        ptr, batch = ptr_decim, batch_decim
+    return neighbors_list, idx_decim, idx_upsampling
+
+
 class FPModule(torch.nn.Module):
     """Upsampling with a skip connection."""
 
-    def __init__(self, k, nn):
+    def __init__(self, k, nn, knn_backend: str = "torch_cluster"):
         super().__init__()
         self.k = k
         self.nn = nn
+        self.knn_backend = knn_backend
 
-    def forward(self, x, pos, batch, x_skip, pos_skip, batch_skip):
-        x = knn_interpolate(x, pos, pos_skip, batch, batch_skip, k=self.k)
+    def forward(
+        self, x, pos, batch, x_skip, pos_skip, batch_skip, idx_upsampling: Optional[Tensor] = None
+    ):
+        if idx_upsampling is None:
+            x = knn_interpolate(
+                x, pos, pos_skip, batch, batch_skip, k=self.k, backend=self.knn_backend
+            )
+        else:
+            # Precomputed nearest point, which is what interpolation amounts to with k=1.
+            x = x[idx_upsampling]
         x = torch.cat([x, x_skip], dim=1)
         x = self.nn(x)
         return x, pos_skip, batch_skip
@@ -0,0 +1,222 @@
+"""Structured channel pruning of a trained RandLA-Net, and report of its cost and accuracy.
+
+Channels are ranked by the absolute scaling factor (gamma) of the batch normalization that follows
+them: a channel with a small gamma contributes little to the next layers, whatever its inputs.
+The least important channels of each layer are removed, and the inputs of the layers that consume
+them are removed accordingly, so that the pruned network computes a subset of the features of the
+original network, with the same weights:
+
+- the output channels of a dilated residual block are shared by its last MLP and its shortcut,
+  which are summed: they are ranked by the sum of both gammas, and the same ones are kept in both;
+- local feature aggregations concatenate neighbor features and their position encodings: their
+  attention (a square layer, without batch norm) keeps the concatenation of both kept subsets;
+- decoder layers (FPModule) concatenate upsampled features and skip features from the encoder:
+  their inputs are the kept channels of both.
+
+The pruned network is a PyGRandLANet with narrower channels (see its channels argument), so that
+it trains, exports and predicts as any other model. Its accuracy drops before a short finetuning.
+
+"""
+
+import time
+from typing import Dict, List, Optional, Sequence
+
+import torch
+from torch import Tensor
+from torch.utils.flop_counter import FlopCounterMode
+from torch_geometric.nn.norm import BatchNorm
+
+from myria3d.models.export import get_synthetic_batch
+from myria3d.models.model import Model
+from myria3d.models.modules.pyg_randla_net import (
+    DilatedResidualBlock,
+    LocalFeatureAggregation,
+    PyGRandLANet,
+    SharedMLP,
+    get_pyramid,
+)
+from myria3d.utils import utils
+
+log = utils.get_logger(__name__)
+
+# Default channels of the dilated residual blocks of PyGRandLANet.
+DEFAULT_CHANNELS = (32, 128, 256, 512)
+
+
+def get_pruned_channels(channels: Sequence[int], keep_ratio: float) -> List[int]:
+    """Channels of the dilated residual blocks kept with keep_ratio, as multiples of 8."""
+    if not 0 < keep_ratio <= 1:
+        raise ValueError(f"Expected a keep_ratio in ]0, 1], got {keep_ratio}.")
+    return [max(8, round(c * keep_ratio / 8) * 8) for c in channels]
+
+
+def prune_model(
+    model: Model, keep_ratio: float = 0.5, channels: Optional[Sequence[int]] = None
+) -> Model:
+    """Copy of a Model with a pruned PyGRandLANet, in the same mode as the model.
+
+    Args:
+        model (Model): trained model, with a PyGRandLANet.
+        keep_ratio (float, optional): fraction of channels kept in each dilated residual block and
+            decoder layer. Defaults to 0.5.
+        channels (Sequence[int], optional): channels of the dilated residual blocks of the pruned
+            network, in place of keep_ratio. Defaults to None.
+
+    Raises:
+        ValueError: if the neural network is not a PyGRandLANet, or if channels are not narrower
+            than the ones of the model.
+
+    """
+    if not isinstance(model.model, PyGRandLANet):
+        raise ValueError(f"Only PyGRandLANet can be pruned, got {type(model.model).__name__}.")
+    neural_net_hparams = dict(model.hparams.neural_net_hparams)
+    original_channels = list(neural_net_hparams.get("channels", DEFAULT_CHANNELS))
+    if channels is None:
+        channels = get_pruned_channels(original_channels, keep_ratio)
+    if any(c > original for c, original in zip(channels, original_channels)):
+        raise ValueError(f"Cannot prune channels {original_channels} to wider {channels}.")
+    neural_net_hparams["channels"] = list(channels)
+    hparams = dict(model.hparams)
+    hparams["neural_net_hparams"] = neural_net_hparams
+    pruned = Model(**hparams, criterion=model.criterion)
+    prune_randla_net(model.model, pruned.model)
+    return pruned.to(model.device).train(model.training)
+
+
+@torch.no_grad()
+def prune_randla_net(net: PyGRandLANet, pruned: PyGRandLANet) -> None:
+    """Copy the most important channels of net into the narrower pruned network, in place."""
+    pruned.fc0.load_state_dict(net.fc0.state_dict())
+    cols = torch.arange(net.fc0.out_features)
+    skips = []
+    for name in ["block1", "block2", "block3", "block4"]:
+        cols = prune_block(getattr(net, name), getattr(pruned, name), cols)
+        skips.append(cols)
+    rows = select_channels(get_importance(net.mlp_summit), pruned.mlp_summit.channel_list[-1])
+    copy_mlp(net.mlp_summit, pruned.mlp_summit, rows, cols)
+    cols = rows
+    # Decoder layers concatenate upsampled features and skip features of an encoder block.
+    for name, skip_name in zip(
+        ["fp4", "fp3", "fp2", "fp1"], ["block3", "block2", "block1", "block1"]
+    ):
+        mlp, pruned_mlp = getattr(net, name).nn, getattr(pruned, name).nn
+        skip = skips[int(skip_name[-1]) - 1]
+        num_upsampled = mlp.channel_list[0] - getattr(net, skip_name).d_out
+        cols = torch.cat([cols, skip + num_upsampled])
+        # fp1 outputs as many channels as fc0, for the unpruned classification head: all are kept.
+        rows = select_channels(get_importance(mlp), pruned_mlp.channel_list[-1])
+        copy_mlp(mlp, pruned_mlp, rows, cols)
+        cols = rows
+    pruned.mlp_classif.load_state_dict(net.mlp_classif.state_dict())
+    pruned.fc_classif.load_state_dict(net.fc_classif.state_dict())
+
+
+def prune_block(block: DilatedResidualBlock, pruned: DilatedResidualBlock, cols: Tensor) -> Tensor:
+    """Prune a dilated residual block, whose kept input channels are cols.
+
+    Returns:
+        Tensor: kept output channels of the block, in increasing order.
+
+    """
+    # Summed in the residual connection: same channels in both branches.
+    importance = get_importance(block.mlp2) + get_importance(block.shortcut)
+    out = select_channels(importance, pruned.d_out)
+    copy_mlp(block.shortcut, pruned.shortcut, out, cols)
+    rows = select_channels(get_importance(block.mlp1), pruned.mlp1.channel_list[-1])
+    copy_mlp(block.mlp1, pruned.mlp1, rows, cols)
+    rows = prune_lfa(block.lfa1, pruned.lfa1, rows)
+    rows = prune_lfa(block.lfa2, pruned.lfa2, rows)
+    copy_mlp(block.mlp2, pruned.mlp2, out, rows)
+    return out
+
+
+def prune_lfa(
+    lfa: LocalFeatureAggregation, pruned: LocalFeatureAggregation, cols: Tensor
+) -> Tensor:
+    """Prune a local feature aggregation, whose kept input channels are cols.
+
+    Returns:
+        Tensor: kept output channels of the local feature aggregation, in increasing order.
+
+    """
+    num_encodings = pruned.mlp_encoder.channel_list[-1]
+    encodings = select_channels(get_importance(lfa.mlp_encoder), num_encodings)
+    copy_mlp(lfa.mlp_encoder, pruned.mlp_encoder, encodings, torch.arange(10))
+    # Local features are the concatenation of neighbor features and their position encodings.
+    num_features = lfa.mlp_attention.channel_list[0] - lfa.mlp_encoder.channel_list[-1]
+    local_features = torch.cat([cols, encodings + num_features])
+    # Attention scores are computed and applied channel-wise on local features.
+    copy_mlp(lfa.mlp_attention, pruned.mlp_attention, local_features, local_features)
+    out = select_channels(
+        get_importance(lfa.mlp_post_attention), pruned.mlp_post_attention.channel_list[-1]
+    )
+    copy_mlp(lfa.mlp_post_attention, pruned.mlp_post_attention, out, local_features)
+    return out
+
+
+def get_importance(mlp: SharedMLP) -> Tensor:
+    """Importance of the output channels of a single-layer MLP: absolute batch norm scaling."""
+    return mlp.norms[0].module.weight.detach().abs()
+
+
+def select_channels(importance: Tensor, num_channels: int) -> Tensor:
+    """Indices of the num_channels most important channels, in increasing order."""
+    return importance.topk(num_channels).indices.sort().values
+
+
+def copy_mlp(mlp: SharedMLP, pruned: SharedMLP, rows: Tensor, cols: Tensor) -> None:
+    """Copy the kept output channels (rows) and input channels (cols) of a single-layer MLP."""
+    lin, pruned_lin = mlp.lins[0], pruned.lins[0]
+    pruned_lin.weight.copy_(lin.weight[rows][:, cols])
+    if lin.bias is not None:
+        pruned_lin.bias.copy_(lin.bias[rows])
+    norm, pruned_norm = mlp.norms[0], pruned.norms[0]
+    if isinstance(norm, BatchNorm):
+        for name in ["weight", "bias", "running_mean", "running_var"]:
+            getattr(pruned_norm.module, name).copy_(getattr(norm.module, name)[rows])
+        pruned_norm.module.num_batches_tracked.copy_(norm.module.num_batches_tracked)
+
+
+@torch.no_grad()
+def get_cost(
+    model: Model, batch_size: int = 4, num_nodes: int = 12500, num_steps: int = 3
+) -> Dict[str, float]:
+    """Number of parameters, GFLOPs and latency of the neural network of a Model, in eval mode.
+
+    FLOPs are those of matrix multiplications (i.e. linear layers), counted on a synthetic batch
+    (see myria3d.models.export.get_synthetic_batch). Latency is the mean time of num_steps forward
+    passes on this batch, after a first one.
+
+    """
+    training = model.training
+    model.eval()
+    batch = get_synthetic_batch(model, batch_size, num_nodes)
+    with FlopCounterMode(display=False) as flop_counter:
+        model.model(batch.x, batch.pos, batch.batch, batch.ptr, get_pyramid(batch))
+    start = time.perf_counter()
+    for _ in range(num_steps):
+        model.model(batch.x, batch.pos, batch.batch, batch.ptr, get_pyramid(batch))
+    if batch.x.is_cuda:
+        torch.cuda.synchronize()
+    latency_s = (time.perf_counter() - start) / num_steps
+    model.train(training)
+    return {
+        "num_parameters": sum(param.numel() for param in model.model.parameters()),
+        "gflops": flop_counter.get_total_flops() / 1e9,
+        "latency_ms": latency_s * 1000,
+    }
+
+
+def format_report(reports: Dict[str, Dict[str, float]]) -> str:
+    """Markdown table of costs and metrics (e.g. IoUs), with one column per model."""
+    names = list(reports)
+    keys = list(dict.fromkeys(key for report in reports.values() for key in report))
+    lines = [
+        "| | " + " | ".join(names) + " |",
+        "|---" * (len(names) + 1) + "|",
+    ]
+    for key in keys:
+        values = [reports[name].get(key) for name in names]
+        values = ["n/a" if value is None else f"{value:.4g}" for value in values]
+        lines.append(f"| {key} | " + " | ".join(values) + " |")
+    return "\n".join(lines) + "\n"
@@ -1,6 +1,14 @@
-from torch.utils.data import DataLoader
+import math
+from typing import List, Optional
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, get_worker_info
+from torch_geometric.data import Batch, Data
 from torch_geometric.loader.dataloader import Collater
 
+from myria3d.pctl.transforms.transforms import infer_node_keys
+
 
 class GeometricNoneProofDataloader(DataLoader):
     """Torch geometric's dataloader is a simple torch Dataloader with a different Collater.
@@ -30,3 +38,90 @@ class GeometricNoneProofCollater(Collater):
             # empty
             return None
         return super().__call__(data_list)
+
+
+class CSRCollater:
+    """A Collater specialized for myria3d samples, that returns None when given empty batch.
+
+    Contrary to PyG's generic Collater, which introspects every attribute of every sample, the
+    schema of the batch is read once from the first sample, and each per-node tensor (including
+    copies of the full cloud) is concatenated into a single preallocated buffer. Sample boundaries
+    are represented by `ptr`, and by `idx_in_original_cloud_ptr` for idx_in_original_cloud, which is
+    a concatenated tensor rather than a list of numpy arrays, so that it is passed from workers to
+    the main process via shared memory instead of being pickled.
+
+    Buffers are allocated in shared memory in dataloader workers, to avoid a copy when they are
+    sent to the main process. In the main process, they are pinned if pin_memory is set, for faster
+    and asynchronous transfers to GPU. Use the dataloader's pin_memory=True to pin batches
+    that come from workers.
+
+    Nota: batches cannot be split back into samples with `to_data_list`. Use
+    `split_idx_in_original_cloud` to get per-sample idx_in_original_cloud.
+
+    Args:
+        pin_memory (bool, optional): pin buffers allocated in the main process. Defaults to False.
+
+    """
+
+    def __init__(self, pin_memory: bool = False):
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+
+    def __call__(self, data_list: Optional[List[Data]]) -> Optional[Batch]:
+        if data_list is None:
+            return None
+        data_list = [d for d in data_list if d is not None]
+        if not data_list:
+            return None
+
+        first = data_list[0]
+        node_keys = infer_node_keys(first, first.num_nodes, exclude=["idx_in_original_cloud"])
+
+        batch = Batch()
+        for key in node_keys:
+            batch[key] = self._cat([d[key] for d in data_list])
+        num_nodes = torch.tensor([d.num_nodes for d in data_list])
+        batch.batch = torch.repeat_interleave(torch.arange(len(data_list)), num_nodes)
+        batch.ptr = get_ptr(num_nodes)
+
+        for key, item in first:
+            if key in node_keys or key == "num_nodes":
+                continue
+            elif key == "idx_in_original_cloud":
+                idx = [torch.from_numpy(np.asarray(d[key], dtype=np.int64)) for d in data_list]
+                batch[key] = self._cat(idx)
+                batch[f"{key}_ptr"] = get_ptr(torch.tensor([len(i) for i in idx]))
+            elif key == "copies":
+                batch[key] = {k: self._cat([d[key][k] for d in data_list]) for k in item.keys()}
+            elif isinstance(item, torch.Tensor):
+                # e.g. per-node attributes of subsampled points, such as a pyramid.
+                batch[key] = self._cat([d[key] for d in data_list])
+            else:
+                batch[key] = [d[key] for d in data_list]
+        return batch
+
+    def _cat(self, tensors: List[torch.Tensor]) -> torch.Tensor:
+        elem = tensors[0]
+        shape = (sum(t.size(0) for t in tensors),) + elem.shape[1:]
+        if get_worker_info() is not None:
+            # As torch's default_collate: in shared memory, to be sent to the main process as is.
+            storage = elem._typed_storage()._new_shared(math.prod(shape), device=elem.device)
+            out = elem.new(storage).resize_(shape)
+        else:
+            out = torch.empty(shape, dtype=elem.dtype, pin_memory=self.pin_memory)
+        return torch.cat(tensors, dim=0, out=out)
+
+
+def get_ptr(sizes: torch.Tensor) -> torch.Tensor:
+    """Boundaries of consecutive segments of given sizes, e.g. [2, 3] -> [0, 2, 5]."""
+    ptr = torch.zeros(sizes.size(0) + 1, dtype=torch.long)
+    torch.cumsum(sizes, dim=0, out=ptr[1:])
+    return ptr
+
+
+def split_idx_in_original_cloud(batch: Batch) -> List[np.ndarray]:
+    """Get idx_in_original_cloud of each sample, whichever the collater."""
+    if getattr(batch, "idx_in_original_cloud_ptr", None) is None:
+        return batch.idx_in_original_cloud
+    idx = batch.idx_in_original_cloud.cpu().numpy()
+    ptr = batch.idx_in_original_cloud_ptr.tolist()
+    return [idx[start:end] for start, end in zip(ptr[:-1], ptr[1:])]
@@ -1,19 +1,36 @@
+import os.path as osp
 from numbers import Number
 from typing import Callable, Dict, List, Optional
 
+import torch
 from matplotlib import pyplot as plt
 from numpy.typing import ArrayLike
 from pytorch_lightning import LightningDataModule
-from torch_geometric.data import Data
+from torch.utils.data import Subset, WeightedRandomSampler
+from torch_geometric.data import Batch, Data
+from torch_geometric.transforms import FixedPoints
 
-from myria3d.pctl.dataloader.dataloader import GeometricNoneProofDataloader
+from myria3d.pctl.dataloader.dataloader import CSRCollater, GeometricNoneProofDataloader
+from myria3d.pctl.transforms.batch_transforms import to_batch_transforms
 from myria3d.pctl.transforms.compose import CustomCompose
+from myria3d.pctl.transforms.profiling import TransformsProfiler
 from myria3d.pctl.dataset.hdf5 import HDF5Dataset
 from myria3d.pctl.dataset.iterable import InferenceDataset
 from myria3d.pctl.dataset.utils import (
     get_las_paths_by_split_dict,
     pre_filter_below_n_points,
 )
+from myria3d.pctl.sampler.sampler import (
+    BlockShuffleSampler,
+    PointsBudgetBatchSampler,
+    get_class_balancing_weights,
+)
+from myria3d.pctl.transforms.transforms import (
+    COMMON_CODE_FOR_ALL_ARTEFACTS,
+    MaximumNumNodes,
+    MinimumNumNodes,
+    TargetTransform,
+)
 from myria3d.utils import utils
 
 log = utils.get_logger(__name__)
@@ -22,7 +39,34 @@ TRANSFORMS_LIST = List[Callable]
 
 
 class HDF5LidarDataModule(LightningDataModule):
-    """Datamodule to feed train and validation data to the model."""
+    """Datamodule to feed train and validation data to the model.
+
+    By default, batches contain batch_size samples. If points_budget is set, batches are instead
+    made of samples of similar sizes whose total number of points does not exceed the budget.
+
+    By default, training samples are drawn in a fully random order. If block_shuffle_window is set,
+    they are instead shuffled tile by tile and within a bounded window, for near-sequential reads.
+    If class_balancing_alpha is set, they are instead drawn (with replacement) with weights that
+    favor samples containing rare classes, based on per-sample class histograms, and
+    block_shuffle_window is ignored. Batches by points_budget have their own order: it cannot be
+    combined with block_shuffle_window or class_balancing_alpha.
+
+    If fuse_transforms is set, known chains of transforms run as fused passes with fewer copies,
+    with identical outputs.
+
+    If batch_level_transforms is set, normalizations and augmentations are not applied to each sample
+    in dataloader workers, but to whole batches once on device, with per-sample statistics.
+
+    If profile_transforms is set, time, number of points and drop rate of each transform are recorded
+    in transforms_profilers (see TransformsProfilingLogger callback).
+
+    If csr_collate is set, samples are collated by the specialized CSRCollater, into buffers shared
+    with the main process. If pin_memory is set, batches are pinned for faster transfers to GPU.
+
+    If pyramid_transform is set (e.g. to a RandLANetPyramid), it is applied last to each sample in
+    dataloader workers, to precompute the neighbor searches of the model.
+
+    """
 
     def __init__(
         self,
@@ -40,10 +84,25 @@ class HDF5LidarDataModule(LightningDataModule):
         num_workers: int = 1,
         prefetch_factor: int = 2,
         transforms: Optional[Dict[str, TRANSFORMS_LIST]] = None,
+        points_budget: Optional[int] = None,
+        block_shuffle_window: Optional[int] = None,
+        class_balancing_alpha: Optional[float] = None,
+        fuse_transforms: bool = False,
+        batch_level_transforms: bool = False,
+        profile_transforms: bool = False,
+        csr_collate: bool = False,
+        pin_memory: bool = False,
+        pyramid_transform: Optional[Callable] = None,
         **kwargs,
     ):
         super().__init__()
 
+        if points_budget and (block_shuffle_window or class_balancing_alpha is not None):
+            raise ValueError(
+                "datamodule.points_budget cannot be combined with datamodule.block_shuffle_window "
+                "or datamodule.class_balancing_alpha, which are ignored by its batch sampler."
+            )
+
         self.split_csv_path = split_csv_path
         self.data_dir = data_dir
         self.hdf5_file_path = hdf5_file_path
@@ -62,6 +121,20 @@ class HDF5LidarDataModule(LightningDataModule):
         self.batch_size = batch_size
         self.num_workers = num_workers
         self.prefetch_factor = prefetch_factor
+        self.points_budget = points_budget
+        self.block_shuffle_window = block_shuffle_window
+        self.class_balancing_alpha = class_balancing_alpha
+        self.fuse_transforms = fuse_transforms
+        self.batch_level_transforms = batch_level_transforms
+        self.csr_collate = csr_collate
+        self.pin_memory = pin_memory
+        self.pyramid_transform = pyramid_transform
+        # Val and test share the eval transforms.
+        self.transforms_profilers: Dict[str, TransformsProfiler] = {}
+        if profile_transforms:
+            self.transforms_profilers = {
+                stage: TransformsProfiler(num_workers) for stage in ["train", "eval", "predict"]
+            }
 
         t = transforms
         self.preparation_train_transform: TRANSFORMS_LIST = t.get("preparations_train_list", [])
@@ -75,18 +148,65 @@ class HDF5LidarDataModule(LightningDataModule):
     @property
     def train_transform(self) -> CustomCompose:
         return CustomCompose(
-            self.preparation_train_transform
-            + self.normalization_transform
-            + self.augmentation_transform
+            self.preparation_train_transform + self._train_sample_level_transform,
+            fuse=self.fuse_transforms,
+            profiler=self.transforms_profilers.get("train"),
         )
 
     @property
     def eval_transform(self) -> CustomCompose:
-        return CustomCompose(self.preparation_eval_transform + self.normalization_transform)
+        return CustomCompose(
+            self.preparation_eval_transform + self._eval_sample_level_transform,
+            fuse=self.fuse_transforms,
+            profiler=self.transforms_profilers.get("eval"),
+        )
 
     @property
     def predict_transform(self) -> CustomCompose:
-        return CustomCompose(self.preparation_predict_transform + self.normalization_transform)
+        return CustomCompose(
+            self.preparation_predict_transform + self._eval_sample_level_transform,
+            fuse=self.fuse_transforms,
+            profiler=self.transforms_profilers.get("predict"),
+        )
+
+    @property
+    def _train_sample_level_transform(self) -> TRANSFORMS_LIST:
+        if self.batch_level_transforms:
+            return self._pyramid_transform
+        return self.normalization_transform + self.augmentation_transform + self._pyramid_transform
+
+    @property
+    def _eval_sample_level_transform(self) -> TRANSFORMS_LIST:
+        if self.batch_level_transforms:
+            return self._pyramid_transform
+        return self.normalization_transform + self._pyramid_transform
+
+    @property
+    def _pyramid_transform(self) -> TRANSFORMS_LIST:
+        # Last, since it refers to the points as they are. Batch-level transforms do not change them.
+        return [self.pyramid_transform] if self.pyramid_transform else []
+
+    @property
+    def train_batch_transform(self) -> CustomCompose:
+        return CustomCompose(
+            to_batch_transforms(self.normalization_transform + self.augmentation_transform)
+        )
+
+    @property
+    def eval_batch_transform(self) -> CustomCompose:
+        return CustomCompose(to_batch_transforms(self.normalization_transform))
+
+    def on_after_batch_transfer(self, batch: Batch, dataloader_idx: int) -> Batch:
+        """Apply normalizations (and augmentations, for training) to whole batches, on device.
+
+        Also called by predict.py, where there is no trainer.
+
+        """
+        if not self.batch_level_transforms:
+            return batch
+        if self.trainer is not None and self.trainer.training:
+            return self.train_batch_transform(batch)
+        return self.eval_batch_transform(batch)
 
     def prepare_data(self, stage: Optional[str] = None):
         """Prepare dataset containing train, val, test data."""
@@ -146,27 +266,93 @@ class HDF5LidarDataModule(LightningDataModule):
     def train_dataloader(self):
         return GeometricNoneProofDataloader(
             dataset=self.dataset.traindata,
-            batch_size=self.batch_size,
             num_workers=self.num_workers,
             prefetch_factor=self.prefetch_factor,
-            shuffle=True,
+            **self._get_collate_kwargs(),
+            **self._get_batching_kwargs(
+                self.dataset.traindata, self.preparation_train_transform, shuffle=True
+            ),
         )
 
     def val_dataloader(self):
         return GeometricNoneProofDataloader(
             dataset=self.dataset.valdata,
-            batch_size=self.batch_size,
             num_workers=self.num_workers,
             prefetch_factor=self.prefetch_factor,
+            **self._get_collate_kwargs(),
+            **self._get_batching_kwargs(self.dataset.valdata, self.preparation_eval_transform),
         )
 
     def test_dataloader(self):
         return GeometricNoneProofDataloader(
             dataset=self.dataset.testdata,
-            batch_size=self.batch_size,
-            num_workers=1,  # b/c iterable dataset
+            num_workers=self.num_workers,
             prefetch_factor=self.prefetch_factor,
+            **self._get_collate_kwargs(),
+            **self._get_batching_kwargs(self.dataset.testdata, self.preparation_eval_transform),
+        )
+
+    def _get_collate_kwargs(self) -> dict:
+        """Dataloader kwargs defining how samples are collated into batches."""
+        kwargs = {"pin_memory": self.pin_memory}
+        if self.csr_collate:
+            kwargs["collate_fn"] = CSRCollater(pin_memory=self.pin_memory)
+        return kwargs
+
+    def _get_batching_kwargs(
+        self, subset: Subset, preparations: TRANSFORMS_LIST, shuffle: bool = False
+    ) -> dict:
+        """Dataloader kwargs defining how samples are ordered and grouped into batches."""
+        if self.points_budget:
+            num_nodes = [
+                estimate_num_nodes_after_preparations(
+                    self.dataset.samples_num_nodes[idx], preparations
+                )
+                for idx in subset.indices
+            ]
+            batch_sampler = PointsBudgetBatchSampler(
+                num_nodes, self.points_budget, shuffle=shuffle
+            )
+            return {"batch_sampler": batch_sampler}
+
+        if not shuffle:
+            return {"batch_size": self.batch_size, "shuffle": False}
+
+        if self.class_balancing_alpha is not None:
+            weights = get_class_balancing_weights(
+                self._get_class_histograms(subset), self.class_balancing_alpha
+            )
+            sampler = WeightedRandomSampler(weights, num_samples=len(subset))
+            return {"batch_size": self.batch_size, "sampler": sampler}
+
+        if self.block_shuffle_window:
+            # Samples are indexed as {split}/{basename}/{sample_number}: tiles are the blocks.
+            block_ids = [
+                osp.dirname(self.dataset.samples_hdf5_paths[idx]) for idx in subset.indices
+            ]
+            sampler = BlockShuffleSampler(block_ids, window_size=self.block_shuffle_window)
+            return {"batch_size": self.batch_size, "sampler": sampler}
+
+        return {"batch_size": self.batch_size, "shuffle": True}
+
+    def _get_class_histograms(self, subset: Subset) -> torch.Tensor:
+        """Number of points of each class (as targeted by the TargetTransform) in each sample."""
+        target_transform = next(
+            (t for t in self.preparation_train_transform if isinstance(t, TargetTransform)), None
         )
+        if target_transform is None:
+            raise ValueError(
+                "datamodule.class_balancing_alpha requires a TargetTransform in train preparations."
+            )
+        codes_histograms = torch.from_numpy(self.dataset.samples_class_histograms[subset.indices])
+        codes = codes_histograms.sum(dim=0).nonzero().squeeze(1)
+        classes = target_transform.transform(codes.numpy())
+        # Artefacts are dropped during preparations and are therefore not counted.
+        kept = classes != COMMON_CODE_FOR_ALL_ARTEFACTS
+        num_classes = len(target_transform.classification_dict)
+        class_histograms = torch.zeros((len(subset), num_classes), dtype=torch.long)
+        class_histograms.index_add_(1, classes[kept], codes_histograms[:, codes[kept]].long())
+        return class_histograms
 
     def _set_predict_data(self, las_file_to_predict):
         self.predict_dataset = InferenceDataset(
@@ -178,14 +364,20 @@ class HDF5LidarDataModule(LightningDataModule):
             tile_width=self.tile_width,
             subtile_width=self.subtile_width,
             subtile_overlap=self.subtile_overlap_predict,
+            points_budget=self.points_budget,
         )
 
     def predict_dataloader(self):
+        # Load the cloud once in the main process, before it is shared with the workers, which
+        # each prepare a disjoint subset of its subtiles.
+        self.predict_dataset.load_tile()
         return GeometricNoneProofDataloader(
             dataset=self.predict_dataset,
-            batch_size=self.batch_size,
-            num_workers=1,  # always 1 because this is an iterable dataset
+            # With a points budget, batches are already formed by the dataset itself.
+            batch_size=None if self.points_budget else self.batch_size,
+            num_workers=self.num_workers,
             prefetch_factor=self.prefetch_factor,
+            **self._get_collate_kwargs(),
         )
 
     def _visualize_graph(self, data, color=None):
@@ -226,3 +418,20 @@ class HDF5LidarDataModule(LightningDataModule):
 
         # Showing the above plot
         plt.show()
+
+
+def estimate_num_nodes_after_preparations(num_nodes: int, preparations: TRANSFORMS_LIST) -> int:
+    """Estimate the number of points of a sample after its preparations.
+
+    Only transforms with a known effect on the number of points are taken into account, so
+    the estimate is an upper bound if the preparations include e.g. a GridSampling.
+
+    """
+    for transform in preparations:
+        if isinstance(transform, MinimumNumNodes):
+            num_nodes = max(num_nodes, transform.num)
+        elif isinstance(transform, MaximumNumNodes):
+            num_nodes = min(num_nodes, transform.num)
+        elif isinstance(transform, FixedPoints):
+            num_nodes = transform.num
+    return num_nodes
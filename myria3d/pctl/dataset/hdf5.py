@@ -5,6 +5,7 @@ from numbers import Number
 from typing import Callable, List, Optional
 
 import h5py
+import numpy as np
 import torch
 from torch.utils.data import Dataset
 from torch_geometric.data import Data
@@ -21,6 +22,9 @@ from myria3d.utils import utils
 
 log = utils.get_logger(__name__)
 
+# LAS classification codes are stored on a byte.
+NUM_CLASSIFICATION_CODES = 256
+
 
 class HDF5Dataset(Dataset):
     """Single-file HDF5 dataset for collections of large LAS tiles."""
@@ -69,6 +73,8 @@ class HDF5Dataset(Dataset):
         # They are loaded within __getitem__ to support multi-processing training.
         self.dataset = None
         self._samples_hdf5_paths = None
+        self._samples_num_nodes = None
+        self._samples_class_histograms = None
 
         if not las_paths_by_split_dict:
             log.warning(
@@ -134,6 +140,8 @@ class HDF5Dataset(Dataset):
             y=torch.from_numpy(grp["y"][...]),
             idx_in_original_cloud=grp["idx_in_original_cloud"][...],
             x_features_names=grp["x"].attrs["x_features_names"].tolist(),
+            # Source LAS of the sample, e.g. to reassemble test predictions by tile.
+            basename=osp.basename(osp.dirname(sample_hdf5_path)),
             # num_nodes=grp["pos"][...].shape[0],  # Not needed - performed under the hood.
         )
 
@@ -193,6 +201,71 @@ class HDF5Dataset(Dataset):
             )
         return self._samples_hdf5_paths
 
+    @property
+    def samples_num_nodes(self) -> List[int]:
+        """Number of points of each sample (before transforms), in the order of samples_hdf5_paths.
+
+        Only shapes are read from the HDF5 file, and the result is indexed into the file as well.
+
+        """
+        if self._samples_num_nodes:
+            return self._samples_num_nodes
+
+        with h5py.File(self.hdf5_file_path, "r") as hdf5_file:
+            if "samples_num_nodes" in hdf5_file:
+                self._samples_num_nodes = hdf5_file["samples_num_nodes"][...].tolist()
+                return self._samples_num_nodes
+
+        with h5py.File(self.hdf5_file_path, "r") as hdf5_file:
+            self._samples_num_nodes = [
+                hdf5_file[sample_path]["pos"].shape[0] for sample_path in self.samples_hdf5_paths
+            ]
+
+        self._index_into_hdf5("samples_num_nodes", np.array(self._samples_num_nodes))
+        return self._samples_num_nodes
+
+    def _index_into_hdf5(self, name: str, data: np.ndarray) -> None:
+        """Write data computed over all samples into the HDF5 file, to be read at next runs.
+
+        The file cannot be opened in append mode while this process still holds it open read-only,
+        e.g. after samples were read by _get_data: it is closed first, and reopened by _get_data.
+
+        """
+        if self.dataset is not None:
+            self.dataset.close()
+            self.dataset = None
+        with h5py.File(self.hdf5_file_path, "a") as hdf5_file:
+            hdf5_file.create_dataset(name, data.shape, dtype="i", data=data)
+
+    @property
+    def samples_class_histograms(self) -> np.ndarray:
+        """Number of points by classification code of each sample (before transforms).
+
+        Array of shape (num_samples, 256), in the order of samples_hdf5_paths. Computed once by
+        reading the targets of all samples, and indexed into the HDF5 file as well.
+
+        """
+        if self._samples_class_histograms is not None:
+            return self._samples_class_histograms
+
+        with h5py.File(self.hdf5_file_path, "r") as hdf5_file:
+            if "samples_class_histograms" in hdf5_file:
+                self._samples_class_histograms = hdf5_file["samples_class_histograms"][...]
+                return self._samples_class_histograms
+
+        with h5py.File(self.hdf5_file_path, "r") as hdf5_file:
+            self._samples_class_histograms = np.stack(
+                [
+                    np.bincount(
+                        hdf5_file[sample_path]["y"][...], minlength=NUM_CLASSIFICATION_CODES
+                    )
+                    for sample_path in tqdm(self.samples_hdf5_paths, desc="Counting classes...")
+                ]
+            )
+
+        self._index_into_hdf5("samples_class_histograms", self._samples_class_histograms)
+        return self._samples_class_histograms
+
 
 def create_hdf5(
     las_paths_by_split_dict: dict,
@@ -1,20 +1,33 @@
 from numbers import Number
 from typing import Callable, Optional
 
+import numpy as np
 import torch
 from numpy.typing import ArrayLike
+from torch.utils.data import get_worker_info
 from torch.utils.data.dataset import IterableDataset
 from torch_geometric.data import Data
 
 from myria3d.pctl.dataset.utils import (
+    get_subtiles_indices,
+    pdal_read_las_array_as_float32,
     pre_filter_below_n_points,
-    split_cloud_into_samples,
 )
 from myria3d.pctl.points_pre_transform.lidar_hd import lidar_hd_pre_transform
+from myria3d.pctl.sampler.sampler import batch_by_points_budget
 
 
 class InferenceDataset(IterableDataset):
-    """Iterable dataset to load samples from a single las file."""
+    """Iterable dataset to load samples from a single las file.
+
+    The las file is loaded and split into subtiles only once, and kept in shared memory. When used
+    with several dataloader workers, each worker prepares a disjoint subset of the subtiles. Call
+    `load_tile` before iterating with workers so that loading happens in the main process only.
+
+    If a points_budget is given, the dataset yields lists of samples whose total number of
+    points is under the budget, which are meant to be collated as is (i.e. with batch_size=None).
+
+    """
 
     def __init__(
         self,
@@ -26,6 +39,7 @@ class InferenceDataset(IterableDataset):
         tile_width: Number = 1000,
         subtile_width: Number = 50,
         subtile_overlap: Number = 0,
+        points_budget: Optional[int] = None,
     ):
         self.las_file = las_file
         self.epsg = epsg
@@ -37,19 +51,60 @@ class InferenceDataset(IterableDataset):
         self.tile_width = tile_width
         self.subtile_width = subtile_width
         self.subtile_overlap = subtile_overlap
+        self.points_budget = points_budget
+
+        # Set by load_tile
+        self._tile_points: Optional[torch.Tensor] = None
+        self._points_dtype: Optional[np.dtype] = None
+        self._samples_idx: Optional[torch.Tensor] = None
+        self._samples_ptr: Optional[torch.Tensor] = None
+
+    def load_tile(self) -> None:
+        """Load the las file and index its subtiles, if not already done before."""
+        if self._tile_points is not None:
+            return
+
+        points = pdal_read_las_array_as_float32(self.las_file, self.epsg)
+        pos = np.asarray([points["X"], points["Y"], points["Z"]], dtype=np.float32).transpose()
+        samples_idx = list(
+            get_subtiles_indices(pos, self.tile_width, self.subtile_width, self.subtile_overlap)
+        )
+
+        # All dimensions are float32: the named array is stored as a (N, num_dims) tensor in shared
+        # memory, which is accessed by all dataloader workers without copy.
+        self._points_dtype = points.dtype
+        self._tile_points = torch.from_numpy(points.view(np.float32).reshape(len(points), -1))
+        self._tile_points.share_memory_()
+        # Indices of all subtiles are concatenated, and delimited by a ptr (as in pyg batches).
+        self._samples_ptr = torch.tensor([0] + [len(idx) for idx in samples_idx]).cumsum(0)
+        self._samples_idx = torch.from_numpy(
+            np.concatenate(samples_idx) if samples_idx else np.empty((0,), dtype=np.int64)
+        )
+        self._samples_idx.share_memory_()
 
     def __iter__(self):
+        if self.points_budget:
+            return batch_by_points_budget(self.get_iterator(), self.points_budget)
         return self.get_iterator()
 
     def get_iterator(self):
-        """Yield subtiles from all tiles in an exhaustive fashion."""
-        for idx_in_original_cloud, sample_points in split_cloud_into_samples(
-            self.las_file,
-            self.tile_width,
-            self.subtile_width,
-            self.epsg,
-            self.subtile_overlap,
-        ):
+        """Yield subtiles from all tiles in an exhaustive fashion.
+
+        Subtiles are distributed in a round-robin fashion between dataloader workers.
+
+        """
+        self.load_tile()
+        subtiles = range(len(self._samples_ptr) - 1)
+        worker_info = get_worker_info()
+        if worker_info is not None:
+            subtiles = subtiles[worker_info.id :: worker_info.num_workers]
+
+        for subtile in subtiles:
+            start, end = self._samples_ptr[subtile], self._samples_ptr[subtile + 1]
+            sample_idx = self._samples_idx[start:end]
+            # Back to a named array (of shape (n,)) for the points_pre_transform.
+            sample_points = self._tile_points[sample_idx].numpy().view(self._points_dtype)[:, 0]
+            idx_in_original_cloud = sample_idx.numpy()
             sample_data = self.points_pre_transform(sample_points)
             sample_data["x"] = torch.from_numpy(sample_data["x"])
             sample_data["y"] = torch.LongTensor(
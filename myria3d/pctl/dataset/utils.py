@@ -145,17 +145,43 @@ def split_cloud_into_samples(
     """
     points = pdal_read_las_array_as_float32(las_path, epsg)
     pos = np.asarray([points["X"], points["Y"], points["Z"]], dtype=np.float32).transpose()
+    for sample_idx in get_subtiles_indices(pos, tile_width, subtile_width, subtile_overlap):
+        sample_points = points[sample_idx]
+        yield sample_idx, sample_points
+
+
+def get_subtiles_indices(
+    pos: np.ndarray,
+    tile_width: Number,
+    subtile_width: Number,
+    subtile_overlap: Number = 0,
+):
+    """Get indices of the points of each (non-empty) square subtile of a tile.
+
+    Args:
+        pos (np.ndarray): positions of the points of the tile, of shape (N, 3).
+        tile_width (Number): width of input LAS file
+        subtile_width (Number): width of receptive field.
+        subtile_overlap (Number, optional): overlap between adjacent tiles. Defaults to 0.
+
+    Yields:
+        np.ndarray: idx_in_original_cloud of the points of a subtile.
+
+    """
     kd_tree = cKDTree(pos[:, :2] - pos[:, :2].min(axis=0))
     XYs = get_mosaic_of_centers(tile_width, subtile_width, subtile_overlap=subtile_overlap)
-    for center in XYs:
-        radius = subtile_width // 2  # Square receptive field.
-        minkowski_p = np.inf
-        sample_idx = np.array(kd_tree.query_ball_point(center, r=radius, p=minkowski_p))
+    radius = subtile_width // 2  # Square receptive field.
+    minkowski_p = np.inf
+    # All subtiles are queried at once, on all cores. Points are in the same order as with
+    # queries one subtile at a time.
+    samples_idx = kd_tree.query_ball_point(
+        XYs, r=radius, p=minkowski_p, workers=-1, return_sorted=False
+    )
+    for sample_idx in samples_idx:
         if not len(sample_idx):
             # no points in this receptive fields
             continue
-        sample_points = points[sample_idx]
-        yield sample_idx, sample_points
+        yield np.array(sample_idx)
 
 
 def pre_filter_below_n_points(data, min_num_nodes=1):
@@ -0,0 +1,221 @@
+from typing import Dict, Hashable, Iterable, Iterator, List, Optional, Sequence
+
+import torch
+from torch import Tensor
+from torch.utils.data import Sampler
+from torch_geometric.data import Data
+
+
+class PointsBudgetBatchSampler(Sampler):
+    """Batch sampler that groups samples into batches under a total number of points.
+
+    Samples are sorted by number of points within windows of `bucket_size` samples, and then
+    packed greedily into batches whose total number of points does not exceed `points_budget`.
+    Grouping samples of similar sizes makes both step duration and memory usage predictable.
+    A sample that is larger than the budget on its own gets a batch of its own.
+
+    Batches are shuffled when `shuffle=True`. Call `set_epoch` at the start of each epoch
+    (Lightning does it for you) to get a different order at each epoch.
+
+    Nota: not compatible with the distributed sampler injected by Lightning in multi-GPU settings.
+
+    Args:
+        num_nodes (Sequence[int]): number of points of each sample of the dataset.
+        points_budget (int): maximal total number of points in a batch.
+        max_batch_size (int, optional): maximal number of samples in a batch. Defaults to None (no limit).
+        shuffle (bool, optional): whether to shuffle samples and batches. Defaults to False.
+        bucket_size (int, optional): size of the windows of shuffled samples that are sorted by number
+            of points before packing. Smaller windows give more randomness, larger windows give more
+            homogeneous batches. Defaults to 1024.
+        seed (int, optional): seed for shuffling, combined with the current epoch. Defaults to 0.
+
+    """
+
+    def __init__(
+        self,
+        num_nodes: Sequence[int],
+        points_budget: int,
+        max_batch_size: Optional[int] = None,
+        shuffle: bool = False,
+        bucket_size: int = 1024,
+        seed: int = 0,
+    ):
+        if points_budget < 1:
+            raise ValueError(f"points_budget should be a positive integer (got {points_budget}).")
+        self.num_nodes = torch.as_tensor(num_nodes, dtype=torch.long)
+        self.points_budget = points_budget
+        self.max_batch_size = max_batch_size
+        self.shuffle = shuffle
+        self.bucket_size = bucket_size
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def __iter__(self) -> Iterator[List[int]]:
+        return iter(self._make_batches())
+
+    def __len__(self) -> int:
+        return len(self._make_batches())
+
+    def _make_batches(self) -> List[List[int]]:
+        """Pack samples into batches. Deterministic for a given seed and epoch."""
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+
+        if self.shuffle:
+            order = torch.randperm(len(self.num_nodes), generator=generator)
+        else:
+            order = torch.arange(len(self.num_nodes))
+
+        batches = []
+        for bucket in order.split(self.bucket_size):
+            # stable sort: shuffled samples of equal sizes keep their random order.
+            sizes, sorting = torch.sort(self.num_nodes[bucket], stable=True)
+            batches += pack_by_points_budget(
+                bucket[sorting].tolist(), sizes.tolist(), self.points_budget, self.max_batch_size
+            )
+
+        if self.shuffle:
+            batches = [batches[i] for i in torch.randperm(len(batches), generator=generator)]
+        return batches
+
+
+def pack_by_points_budget(
+    indices: Sequence[int],
+    sizes: Sequence[int],
+    points_budget: int,
+    max_batch_size: Optional[int] = None,
+) -> List[List[int]]:
+    """Greedily pack consecutive indices into batches under a total number of points.
+
+    Args:
+        indices (Sequence[int]): indices of the samples, in the order they should be packed.
+        sizes (Sequence[int]): number of points of each sample.
+        points_budget (int): maximal total number of points in a batch.
+        max_batch_size (int, optional): maximal number of samples in a batch. Defaults to None.
+
+    Returns:
+        List[List[int]]: list of batches of indices. Batches are never empty.
+
+    """
+    batches = []
+    batch, batch_num_nodes = [], 0
+    for idx, size in zip(indices, sizes):
+        budget_exceeded = batch_num_nodes + size > points_budget
+        batch_is_full = max_batch_size is not None and len(batch) >= max_batch_size
+        if batch and (budget_exceeded or batch_is_full):
+            batches.append(batch)
+            batch, batch_num_nodes = [], 0
+        batch.append(idx)
+        batch_num_nodes += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def batch_by_points_budget(
+    samples: Iterable[Data], points_budget: int, max_batch_size: Optional[int] = None
+) -> Iterator[List[Data]]:
+    """Group a stream of samples into lists of samples under a total number of points.
+
+    This is the counterpart of PointsBudgetBatchSampler for iterable datasets, for which
+    the number of points is only known once a sample is loaded and transformed.
+
+    Args:
+        samples (Iterable[Data]): stream of samples.
+        points_budget (int): maximal total number of points in a batch.
+        max_batch_size (int, optional): maximal number of samples in a batch. Defaults to None.
+
+    Yields:
+        List[Data]: list of samples to be collated into a single batch.
+
+    """
+    batch, batch_num_nodes = [], 0
+    for sample in samples:
+        budget_exceeded = batch_num_nodes + sample.num_nodes > points_budget
+        batch_is_full = max_batch_size is not None and len(batch) >= max_batch_size
+        if batch and (budget_exceeded or batch_is_full):
+            yield batch
+            batch, batch_num_nodes = [], 0
+        batch.append(sample)
+        batch_num_nodes += sample.num_nodes
+    if batch:
+        yield batch
+
+
+class BlockShuffleSampler(Sampler):
+    """Sampler that shuffles storage blocks, and then shuffles samples within a bounded window.
+
+    Samples from a same block (e.g. the subtiles of a LAS tile, which are stored contiguously in the
+    HDF5 file) are kept close in the sampling order, so that reads are near-sequential. Blocks are
+    visited in random order, and samples are shuffled within windows of `window_size` consecutive
+    samples, which typically span one or two blocks. This gives enough randomness for SGD while
+    avoiding fully random reads, which are slow on network filesystems and spinning disks.
+
+    Call `set_epoch` at the start of each epoch (Lightning does it for you) to get a different
+    order at each epoch.
+
+    Args:
+        block_ids (Sequence[Hashable]): identifier of the storage block of each sample.
+        window_size (int, optional): number of consecutive samples that are shuffled together.
+            Defaults to 400, i.e. the number of 50m subtiles in a 1km tile.
+        seed (int, optional): seed for shuffling, combined with the current epoch. Defaults to 0.
+
+    """
+
+    def __init__(self, block_ids: Sequence[Hashable], window_size: int = 400, seed: int = 0):
+        if window_size < 1:
+            raise ValueError(f"window_size should be a positive integer (got {window_size}).")
+        self.blocks: Dict[Hashable, List[int]] = {}
+        for idx, block_id in enumerate(block_ids):
+            self.blocks.setdefault(block_id, []).append(idx)
+        self.num_samples = len(block_ids)
+        self.window_size = window_size
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def __iter__(self) -> Iterator[int]:
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+
+        blocks = list(self.blocks.values())
+        order = torch.tensor(
+            [idx for i in torch.randperm(len(blocks), generator=generator) for idx in blocks[i]],
+            dtype=torch.long,
+        )
+        for window in order.split(self.window_size):
+            yield from window[torch.randperm(len(window), generator=generator)].tolist()
+
+    def __len__(self) -> int:
+        return self.num_samples
+
+
+def get_class_balancing_weights(class_histograms: Tensor, alpha: float = 0.5) -> Tensor:
+    """Get sampling weights that favor samples containing rare classes.
+
+    Each class gets an importance of (1 / f_c) ** alpha, where f_c is the frequency of class c
+    over all samples. Each sample is then weighted by the average importance of its points.
+    alpha=0 leads to uniform sampling, alpha=1 to inverse-frequency sampling, and the default
+    alpha=0.5 to square-root-of-inverse-frequency sampling.
+
+    Args:
+        class_histograms (Tensor): number of points of each class in each sample, of shape
+            (num_samples, num_classes).
+        alpha (float, optional): strength of the balancing. Defaults to 0.5.
+
+    Returns:
+        Tensor: weight of each sample, to be used with a WeightedRandomSampler.
+
+    """
+    class_histograms = class_histograms.double()
+    frequencies = class_histograms.sum(dim=0) / class_histograms.sum().clamp(min=1)
+    importance = torch.zeros_like(frequencies)
+    present = frequencies > 0
+    importance[present] = frequencies[present].pow(-alpha)
+    num_points = class_histograms.sum(dim=1).clamp(min=1)
+    return (class_histograms @ importance) / num_points
@@ -0,0 +1,143 @@
+"""Batch-level versions of per-sample normalizations and augmentations.
+
+They operate on a collated Batch, with statistics computed sample by sample via batch.batch,
+so that the work is vectorized across the batch and done on the device of the batch, instead of
+in dataloader workers. Per-sample semantics are kept: outputs match those of the per-sample
+transforms (up to float rounding of reductions), and random augmentations are drawn independently
+for each sample.
+
+"""
+
+import math
+from typing import Callable, List
+
+import torch
+from torch_geometric.data import Batch
+from torch_geometric.transforms import RandomFlip, RandomRotate
+
+from myria3d.pctl.transforms.transforms import (
+    NormalizePos,
+    NullifyLowestZ,
+    StandardizeRGBAndIntensity,
+)
+
+
+def segment_reduce(src: torch.Tensor, batch: Batch, reduce: str) -> torch.Tensor:
+    """Reduce values of each sample of the batch ("sum", "amin", "amax"...), to shape (num_graphs,)."""
+    out = src.new_zeros(batch.num_graphs)
+    return out.scatter_reduce_(0, batch.batch, src, reduce=reduce, include_self=False)
+
+
+class BatchNullifyLowestZ:
+    """Set lowest z of each sample to 0."""
+
+    def __call__(self, batch: Batch):
+        z_min = segment_reduce(batch.pos[:, 2], batch, "amin")
+        batch.pos = batch.pos.clone()
+        batch.pos[:, 2] = batch.pos[:, 2] - z_min[batch.batch]
+        return batch
+
+
+class BatchNormalizePos:
+    """Scale positions. See NormalizePos."""
+
+    def __init__(self, scaling_factor: float):
+        self.scaling_factor = scaling_factor
+
+    def __call__(self, batch: Batch):
+        batch.pos = batch.pos * self.scaling_factor
+        return batch
+
+
+class BatchStandardizeRGBAndIntensity:
+    """Standardize RGB and log(Intensity) features of each sample. See StandardizeRGBAndIntensity."""
+
+    def __call__(self, batch: Batch):
+        # Features names are the same for all samples.
+        x_features_names = batch.x_features_names[0]
+        batch.x = batch.x.clone()
+        idx = x_features_names.index("Intensity")
+        # Log transform to be less sensitive to large outliers - info is in lower values
+        batch.x[:, idx] = self.standardize_channel(torch.log(batch.x[:, idx] + 1), batch)
+        idx = x_features_names.index("rgb_avg")
+        batch.x[:, idx] = self.standardize_channel(batch.x[:, idx], batch)
+        return batch
+
+    def standardize_channel(self, channel_data: torch.Tensor, batch: Batch, clamp_sigma: int = 3):
+        """Sample-wise standardization y* = (y-y_mean)/y_std. clamping to ignore large values."""
+        num_nodes = torch.bincount(batch.batch, minlength=batch.num_graphs).to(channel_data.dtype)
+        mean = segment_reduce(channel_data, batch, "sum") / num_nodes
+        centered = channel_data - mean[batch.batch]
+        # Unbiased estimator, as torch.std. NaN for single-point samples.
+        std = torch.sqrt(segment_reduce(centered**2, batch, "sum") / (num_nodes - 1)) + 10**-6
+        std = torch.where(torch.isnan(std), torch.ones_like(std), std)
+        standard = centered / std[batch.batch]
+        clamp = clamp_sigma * std[batch.batch]
+        return torch.maximum(torch.minimum(standard, clamp), -clamp)
+
+
+class BatchRandomRotate:
+    """Rotate each sample around an axis by its own random angle. See PyG's RandomRotate."""
+
+    def __init__(self, degrees, axis: int = 0):
+        self.degrees = RandomRotate(degrees, axis).degrees
+        self.axis = axis
+
+    def __call__(self, batch: Batch):
+        low, high = self.degrees
+        degree = (torch.rand(batch.num_graphs) * (high - low) + low) * math.pi / 180.0
+        sin, cos = torch.sin(degree), torch.cos(degree)
+        zeros, ones = torch.zeros_like(degree), torch.ones_like(degree)
+        if self.axis == 0:
+            rows = [[ones, zeros, zeros], [zeros, cos, sin], [zeros, -sin, cos]]
+        elif self.axis == 1:
+            rows = [[cos, zeros, -sin], [zeros, ones, zeros], [sin, zeros, cos]]
+        else:
+            rows = [[cos, sin, zeros], [-sin, cos, zeros], [zeros, zeros, ones]]
+        matrices = torch.stack([torch.stack(row, dim=-1) for row in rows], dim=1)
+        matrices = matrices.to(batch.pos.device, batch.pos.dtype)[batch.batch]
+        # Post-multiply the points by the transformation matrix, as LinearTransformation.
+        batch.pos = torch.bmm(batch.pos.unsqueeze(1), matrices).squeeze(1)
+        return batch
+
+
+class BatchRandomFlip:
+    """Flip each sample along an axis with probability p. See PyG's RandomFlip."""
+
+    def __init__(self, axis: int, p: float = 0.5):
+        self.axis = axis
+        self.p = p
+
+    def __call__(self, batch: Batch):
+        flip = torch.rand(batch.num_graphs) < self.p
+        sign = torch.where(flip, -1.0, 1.0).to(batch.pos.device, batch.pos.dtype)
+        batch.pos = batch.pos.clone()
+        batch.pos[:, self.axis] = batch.pos[:, self.axis] * sign[batch.batch]
+        return batch
+
+
+def to_batch_transforms(transforms: List[Callable]) -> List[Callable]:
+    """Get batch-level versions of per-sample transforms.
+
+    Raises:
+        ValueError: if a transform has no batch-level version.
+
+    """
+    batch_transforms = []
+    for transform in transforms:
+        if isinstance(transform, NullifyLowestZ):
+            batch_transforms.append(BatchNullifyLowestZ())
+        elif isinstance(transform, NormalizePos):
+            batch_transforms.append(BatchNormalizePos(transform.scaling_factor))
+        elif isinstance(transform, StandardizeRGBAndIntensity):
+            batch_transforms.append(BatchStandardizeRGBAndIntensity())
+        elif isinstance(transform, RandomRotate):
+            batch_transforms.append(BatchRandomRotate(transform.degrees, transform.axis))
+        elif isinstance(transform, RandomFlip):
+            batch_transforms.append(BatchRandomFlip(transform.axis, transform.p))
+        else:
+            raise ValueError(
+                f"No batch-level version of {transform}. "
+                "Set datamodule.batch_level_transforms=false to apply transforms per sample."
+            )
+    return batch_transforms
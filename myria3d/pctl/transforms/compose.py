@@ -1,18 +1,46 @@
-from typing import Callable, List
+from typing import Callable, List, Optional
 
 from torch_geometric.transforms import BaseTransform
 
+from myria3d.pctl.transforms.fusion import fuse_transforms
+from myria3d.pctl.transforms.profiling import TransformsProfiler
+from myria3d.pctl.transforms.transforms import (
+    NodeAttributesSchema,
+    track_sampled_points,
+)
+
 
 class CustomCompose(BaseTransform):
     """
     Composes several transforms together.
     Edited to bypass downstream transforms if None is returned by a transform.
+    Transforms that subsample points share a single NodeAttributesSchema, declared once for the pipeline.
+    Sampled points are tracked as indices when possible (see track_sampled_points).
     Args:
         transforms (List[Callable]): List of transforms to compose.
+        node_attributes_schema (NodeAttributesSchema, optional): schema of the per-node attributes
+        of the samples. Defaults to None, i.e. inferred from the first subsampled sample.
+        fuse (bool, optional): run known chains of transforms as fused passes, with fewer copies and
+        gathers (see fusion.py). Outputs are identical to the eager ones. Defaults to False.
+        profiler (TransformsProfiler, optional): records time, number of points and drop rate of
+        each transform. Defaults to None.
     """
 
-    def __init__(self, transforms: List[Callable]):
-        self.transforms = transforms
+    def __init__(
+        self,
+        transforms: List[Callable],
+        node_attributes_schema: Optional[NodeAttributesSchema] = None,
+        fuse: bool = False,
+        profiler: Optional[TransformsProfiler] = None,
+    ):
+        track_sampled_points(transforms)
+        self.transforms = fuse_transforms(transforms) if fuse else transforms
+        self.node_attributes_schema = node_attributes_schema or NodeAttributesSchema()
+        for transform in self.transforms:
+            if hasattr(transform, "node_attributes_schema"):
+                transform.node_attributes_schema = self.node_attributes_schema
+        if profiler is not None:
+            self.transforms = profiler.wrap(self.transforms)
 
     def __call__(self, data):
         for transform in self.transforms:
@@ -0,0 +1,126 @@
+"""Fusion of known chains of transforms into fewer passes over the data.
+
+A fused pipeline gives exactly the same outputs as the eager one under a fixed seed: it performs
+the same operations, in the same order and with the same random draws, but it skips intermediate
+allocations and gathers.
+
+- Consecutive subsamplings (MinimumNumNodes, MaximumNumNodes) compose their indices, so that
+  per-node attributes are gathered once.
+- Consecutive position normalizations (Center, NullifyLowestZ, NormalizePos) work in-place on a
+  single buffer.
+
+Unknown transforms are left as they are, and act as barriers to fusion.
+
+"""
+
+from typing import Callable, List, Optional, Union
+
+import torch
+from torch_geometric.data import Data
+from torch_geometric.transforms import Center
+
+from myria3d.pctl.transforms.transforms import (
+    MaximumNumNodes,
+    MinimumNumNodes,
+    NodeAttributesSchema,
+    NormalizePos,
+    NullifyLowestZ,
+)
+
+SUBSAMPLINGS = (MinimumNumNodes, MaximumNumNodes)
+POS_NORMALIZATIONS = (Center, NullifyLowestZ, NormalizePos)
+
+
+class FusedSubsampling:
+    """Chain of subsamplings, with a single gather of per-node attributes."""
+
+    def __init__(self, transforms: List[Union[MinimumNumNodes, MaximumNumNodes]]):
+        self.transforms = transforms
+        self.node_attributes_schema = NodeAttributesSchema()
+
+    def __call__(self, data: Data):
+        num_nodes = data.num_nodes
+        choice: Optional[torch.Tensor] = None
+        for transform in self.transforms:
+            transform_choice = transform.get_choice(num_nodes)
+            if transform_choice is None:
+                continue
+            choice = transform_choice if choice is None else choice[transform_choice]
+            num_nodes = transform_choice.size(0)
+
+        if choice is None:
+            return data
+        return self.node_attributes_schema.subsample(data, choice)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.transforms})"
+
+
+class FusedPosNormalization:
+    """Chain of position normalizations, working in-place once positions are a new tensor."""
+
+    def __init__(self, transforms: List[Union[Center, NullifyLowestZ, NormalizePos]]):
+        self.transforms = transforms
+
+    def __call__(self, data: Data):
+        pos = data.pos
+        # Input positions may be referenced elsewhere (e.g. in copies): never modify them in-place.
+        owned = False
+        for transform in self.transforms:
+            if isinstance(transform, Center):
+                if owned:
+                    pos.sub_(pos.mean(dim=-2, keepdim=True))
+                else:
+                    pos = pos - pos.mean(dim=-2, keepdim=True)
+            elif isinstance(transform, NullifyLowestZ):
+                if not owned:
+                    pos = pos.clone()
+                pos[:, 2] = pos[:, 2] - pos[:, 2].min()
+            elif owned:
+                pos.mul_(transform.scaling_factor)
+            else:
+                pos = pos * transform.scaling_factor
+            owned = True
+        data.pos = pos
+        return data
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.transforms})"
+
+
+def fuse_transforms(transforms: List[Callable]) -> List[Callable]:
+    """Fuse known chains of transforms. Input transforms are not modified.
+
+    Args:
+        transforms (List[Callable]): transforms, in the order they are applied.
+
+    Returns:
+        List[Callable]: equivalent transforms, with fewer intermediate allocations and gathers.
+
+    """
+    fused = []
+    for transform in transforms:
+        if isinstance(transform, SUBSAMPLINGS) and _can_extend(fused, FusedSubsampling):
+            fused[-1].transforms.append(transform)
+            continue
+        elif isinstance(transform, POS_NORMALIZATIONS) and _can_extend(
+            fused, FusedPosNormalization
+        ):
+            fused[-1].transforms.append(transform)
+            continue
+        fused.append(transform)
+
+    return fused
+
+
+def _can_extend(fused: List[Callable], chain_class: type) -> bool:
+    """Whether the last transform can start or extend a chain of the given class."""
+    if not fused:
+        return False
+    if isinstance(fused[-1], chain_class):
+        return True
+    members = SUBSAMPLINGS if chain_class is FusedSubsampling else POS_NORMALIZATIONS
+    if isinstance(fused[-1], members):
+        fused[-1] = chain_class([fused[-1]])
+        return True
+    return False
@@ -0,0 +1,100 @@
+import time
+from typing import Callable, Dict, List
+
+import torch
+from torch.utils.data import get_worker_info
+from torch_geometric.data import Data
+
+
+class TransformsProfiler:
+    """Record wall time, number of points and drop rate of each transform of a pipeline.
+
+    Statistics are accumulated in a tensor in shared memory, with one slot per dataloader worker
+    (and one for the main process), so that they can be aggregated from the main process without
+    any communication. Wrap transforms before workers are started.
+
+    Args:
+        num_workers (int, optional): number of dataloader workers. Defaults to 0.
+
+    """
+
+    FIELDS = ["num_samples", "time_s", "num_nodes_in", "num_nodes_out", "num_dropped"]
+
+    def __init__(self, num_workers: int = 0):
+        self.num_slots = num_workers + 1
+        self.names: List[str] = []
+        self.stats = torch.zeros((self.num_slots, 0, len(self.FIELDS)), dtype=torch.float64)
+
+    def wrap(self, transforms: List[Callable]) -> List[Callable]:
+        """Wrap transforms so that they record their statistics. Resets statistics."""
+        self.names = [f"{idx:02d}_{t.__class__.__name__}" for idx, t in enumerate(transforms)]
+        self.stats = torch.zeros(
+            (self.num_slots, len(transforms), len(self.FIELDS)), dtype=torch.float64
+        ).share_memory_()
+        return [ProfiledTransform(t, self, idx) for idx, t in enumerate(transforms)]
+
+    def record(self, idx: int, time_s: float, num_nodes_in: int, num_nodes_out: int) -> None:
+        worker_info = get_worker_info()
+        slot = 0 if worker_info is None else (worker_info.id + 1) % self.num_slots
+        dropped = num_nodes_out == 0
+        self.stats[slot, idx] += torch.tensor(
+            [1, time_s, num_nodes_in, num_nodes_out, dropped], dtype=torch.float64
+        )
+
+    def reset(self) -> None:
+        self.stats.zero_()
+
+    def summary(self) -> Dict[str, float]:
+        """Statistics of each transform, aggregated over workers. Empty if nothing was recorded."""
+        stats = self.stats.sum(dim=0)
+        total_time_s = stats[:, 1].sum().item()
+        summary = {}
+        for name, (num_samples, time_s, nodes_in, nodes_out, dropped) in zip(self.names, stats):
+            if num_samples == 0:
+                continue
+            summary[f"{name}/time_ms_per_sample"] = (1000 * time_s / num_samples).item()
+            summary[f"{name}/time_share"] = (time_s / total_time_s).item() if total_time_s else 0.0
+            summary[f"{name}/num_nodes_in"] = (nodes_in / num_samples).item()
+            summary[f"{name}/num_nodes_out"] = (nodes_out / num_samples).item()
+            summary[f"{name}/drop_rate"] = (dropped / num_samples).item()
+        return summary
+
+    def format(self) -> str:
+        """Summary as a table, e.g. for logs."""
+        lines = [
+            f"{'transform':<40}{'ms/sample':>12}{'share':>8}{'nodes in':>12}{'nodes out':>12}{'drop':>8}"
+        ]
+        summary = self.summary()
+        for name in self.names:
+            if f"{name}/time_ms_per_sample" not in summary:
+                continue
+            lines.append(
+                f"{name:<40}"
+                f"{summary[f'{name}/time_ms_per_sample']:>12.3f}"
+                f"{summary[f'{name}/time_share']:>8.1%}"
+                f"{summary[f'{name}/num_nodes_in']:>12.0f}"
+                f"{summary[f'{name}/num_nodes_out']:>12.0f}"
+                f"{summary[f'{name}/drop_rate']:>8.1%}"
+            )
+        return "\n".join(lines)
+
+
+class ProfiledTransform:
+    """Transform that records its statistics into a TransformsProfiler."""
+
+    def __init__(self, transform: Callable, profiler: TransformsProfiler, idx: int):
+        self.transform = transform
+        self.profiler = profiler
+        self.idx = idx
+
+    def __call__(self, data: Data):
+        num_nodes_in = data.num_nodes
+        start = time.perf_counter()
+        data = self.transform(data)
+        time_s = time.perf_counter() - start
+        num_nodes_out = 0 if data is None else data.num_nodes
+        self.profiler.record(self.idx, time_s, num_nodes_in, num_nodes_out)
+        return data
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.transform})"
@@ -0,0 +1,70 @@
+"""Neighbors and subsampling pyramid of RandLA-Net, precomputed in dataloader workers.
+
+As in the original RandLA-Net input pipeline, the neighbor searches of the network (kNN graph at
+each level, and nearest point for each upsampling) are done by the dataloader workers, so that
+they overlap with model compute instead of being serialized with it.
+
+"""
+
+import torch
+from torch_geometric.data import Data
+
+from myria3d.models.modules.knn import knn
+from myria3d.models.modules.pyg_randla_net import decimation_indices, knn_neighbors
+
+
+class RandLANetPyramid:
+    """Attach RandLA-Net's neighbors, decimation and upsampling indices to a sample.
+
+    Indices are local to the sample, and are turned into indices in the batch by the model. For
+    each level, with N_l points at this level:
+        - pyramid_neighbors_{level} (N_l, num_neighbors): kNN of each point, including itself. -1
+          for missing neighbors, if the level has less than num_neighbors points.
+        - pyramid_decimation_{level} (N_l+1,): indices of the points kept for the next level.
+        - pyramid_upsampling_{level} (N_l,): index of the nearest point at the next level.
+
+    Must be the last transform that changes points, since indices refer to the points of the
+    sample as they are. Rigid transformations and scalings of positions can still come after.
+
+    Args:
+        decimation (int): decimation factor of the model.
+        num_neighbors (int): number of neighbors of the model.
+        num_levels (int, optional): number of levels of the model. Defaults to 4.
+        knn_backend (str, optional): backend of neighbor searches (see KNN_BACKENDS).
+            Defaults to "torch_cluster".
+
+    """
+
+    def __init__(
+        self,
+        decimation: int = 4,
+        num_neighbors: int = 16,
+        num_levels: int = 4,
+        knn_backend: str = "torch_cluster",
+    ):
+        self.decimation = decimation
+        self.num_neighbors = num_neighbors
+        self.num_levels = num_levels
+        self.knn_backend = knn_backend
+
+    def __call__(self, data: Data):
+        pos = data.pos
+        for level in range(self.num_levels):
+            data[f"pyramid_neighbors_{level}"] = knn_neighbors(
+                pos, self.num_neighbors, backend=self.knn_backend
+            )
+            ptr = torch.tensor([0, pos.size(0)])
+            idx_decim, _ = decimation_indices(ptr, self.decimation)
+            data[f"pyramid_decimation_{level}"] = idx_decim
+            pos_decim = pos[idx_decim]
+            data[f"pyramid_upsampling_{level}"] = knn(pos_decim, pos, 1, backend=self.knn_backend)[
+                1
+            ]
+            pos = pos_decim
+        return data
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(decimation={self.decimation}, "
+            f"num_neighbors={self.num_neighbors}, num_levels={self.num_levels})"
+        )
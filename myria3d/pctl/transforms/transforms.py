@@ -1,11 +1,11 @@
 import math
 import re
-from typing import Dict, List
+from typing import Callable, Dict, List, Optional, Union
 
 import numpy as np
 import torch
 from torch_geometric.data import Data
-from torch_geometric.transforms import BaseTransform
+from torch_geometric.transforms import BaseTransform, FixedPoints
 
 from myria3d.utils import utils
 
@@ -27,93 +27,338 @@ class ToTensor(BaseTransform):
         return data
 
 
-def subsample_data(data, num_nodes, choice: torch.Tensor):
-    # TODO: get num_nodes from data.num_nodes instead to simplify signature
-    out_nodes = torch.sum(choice) if choice.dtype == torch.bool else choice.size(0)
+class NodeAttributesSchema:
+    """Declare which attributes of a sample are per-node, so that subsampling is a plain gather.
+
+    Per-node tensors are gathered with a single index computed once per call, without
+    inspecting every key of the sample. The schema is declared once per pipeline (see
+    CustomCompose), and is inferred from the first subsampled sample if not specified.
+
+    Args:
+        node_keys (List[str], optional): keys of per-node tensors. Defaults to None (inferred).
+        index_keys (List[str], optional): keys of per-node indices of points in the original
+            cloud, as np.ndarray. They are only gathered when points are dropped for good (e.g.
+            artefacts), since they serve to interpolate predictions back to all points otherwise.
+            Defaults to ["idx_in_original_cloud"].
+
+    """
+
+    def __init__(
+        self,
+        node_keys: Optional[List[str]] = None,
+        index_keys: List[str] = ["idx_in_original_cloud"],
+    ):
+        self.node_keys = node_keys
+        self.index_keys = index_keys
+
+    def get_node_keys(self, data: Data) -> List[str]:
+        if self.node_keys is None:
+            self.node_keys = infer_node_keys(data, data.num_nodes, exclude=self.index_keys)
+        return self.node_keys
+
+    def add_node_keys(self, keys: List[str]) -> None:
+        """Declare per-node attributes created within the pipeline, after inference of the schema."""
+        if self.node_keys is not None:
+            self.node_keys = self.node_keys + [key for key in keys if key not in self.node_keys]
+
+    def subsample(self, data: Data, choice: torch.Tensor, subsample_indices: bool = False) -> Data:
+        """Subsample all per-node attributes of data.
+
+        Args:
+            data (Data): sample to subsample.
+            choice (torch.Tensor): indices of the nodes to keep, or boolean mask of these nodes.
+            subsample_indices (bool, optional): whether to also subsample index_keys. Defaults to False.
+
+        """
+        if choice.dtype == torch.bool:
+            choice = choice.nonzero().flatten()
+        choice = choice.long()
+        for key in self.get_node_keys(data):
+            if key in data:
+                data[key] = data[key].index_select(0, choice)
+        if subsample_indices:
+            choice_array = choice.numpy()
+            for key in self.index_keys:
+                if key in data:
+                    data[key] = data[key][choice_array]
+        if "num_nodes" in data:
+            data.num_nodes = choice.size(0)
+        return data
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(node_keys={self.node_keys}, index_keys={self.index_keys})"
+        )
+
+
+def infer_node_keys(data: Data, num_nodes: int, exclude: List[str] = []) -> List[str]:
+    """Get keys of the tensors of data that have one element per node."""
+    node_keys = []
     for key, item in data:
-        if key == "num_nodes":
-            data.num_nodes = out_nodes
-        elif key in ["copies", "idx_in_original_cloud"]:
+        if key in ["num_nodes", "copies"] + exclude:
             # Do not subsample copies of the original point cloud or indices of the original points
             # contained in the patch
             continue
         elif bool(re.search("edge", key)):
             continue
         elif torch.is_tensor(item) and item.size(0) == num_nodes:
-            data[key] = item[choice]
+            node_keys.append(key)
+    return node_keys
 
-    return data
+
+def subsample_data(data, num_nodes, choice: torch.Tensor):
+    """Subsample per-node tensors of data, inferring them from data. Indices are kept unchanged."""
+    return NodeAttributesSchema(
+        infer_node_keys(data, num_nodes, ["idx_in_original_cloud"])
+    ).subsample(data, choice)
 
 
 class MaximumNumNodes(BaseTransform):
     def __init__(self, num: int):
         self.num = num
+        self.node_attributes_schema = NodeAttributesSchema()
 
     def __call__(self, data):
-        num_nodes = data.num_nodes
-
-        if num_nodes <= self.num:
+        choice = self.get_choice(data.num_nodes)
+        if choice is None:
             return data
 
-        choice = torch.randperm(data.num_nodes)[: self.num]
-        data = subsample_data(data, num_nodes, choice)
+        data = self.node_attributes_schema.subsample(data, choice)
 
         return data
 
+    def get_choice(self, num_nodes: int) -> Optional[torch.Tensor]:
+        """Indices of the nodes to keep, or None if all nodes are kept as they are."""
+        if num_nodes <= self.num:
+            return None
+
+        return torch.randperm(num_nodes)[: self.num]
+
 
 class MinimumNumNodes(BaseTransform):
     def __init__(self, num: int):
         self.num = num
+        self.node_attributes_schema = NodeAttributesSchema()
 
     def __call__(self, data):
-        num_nodes = data.num_nodes
+        choice = self.get_choice(data.num_nodes)
+        if choice is None:
+            return data
 
+        data = self.node_attributes_schema.subsample(data, choice)
+
+        return data
+
+    def get_choice(self, num_nodes: int) -> Optional[torch.Tensor]:
+        """Indices of the nodes to keep, or None if all nodes are kept as they are."""
         if num_nodes >= self.num:
-            return data
+            return None
 
-        choice = torch.cat(
+        return torch.cat(
             [torch.randperm(num_nodes) for _ in range(math.ceil(self.num / num_nodes))],
             dim=0,
         )[: self.num]
 
-        data = subsample_data(data, num_nodes, choice)
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}({self.num}"
+
+
+class VoxelGridSampling(BaseTransform):
+    """Keep a single point per voxel, and record the voxel of each original point.
+
+    Voxel coordinates are hashed into int64 keys with vectorized integer ops. Contrary to PyG's
+    GridSampling, labels are never averaged across points of different classes.
+
+    Modes:
+    - "pick": keep a representative point of each voxel (the first one), with all its attributes.
+    - "mean": average float attributes (e.g. pos, x) over each voxel. y gets the majority class of
+    the voxel, and other attributes come from the representative point.
+
+    When copies of the original cloud are kept (test and inference), the voxel of each input point
+    is stored as data.copies["voxel_idx"], and the voxel of each sampled point as
+    data.sampled_voxel_idx. The latter follows any later subsampling, so that predictions can be
+    back-projected exactly to all points, by a gather (see Model.forward).
 
+    Args:
+        size (float): size of a voxel, in meters.
+        mode (str, optional): "pick" or "mean". Defaults to "pick".
+
+    """
+
+    MODES = ["pick", "mean"]
+
+    def __init__(self, size: float, mode: str = "pick"):
+        if mode not in self.MODES:
+            raise ValueError(f"mode should be one of {self.MODES} (got {mode}).")
+        self.size = size
+        self.mode = mode
+        self.node_attributes_schema = NodeAttributesSchema()
+
+    def __call__(self, data: Data):
+        voxel_idx, representatives = voxel_grid_indices(data.pos, self.size)
+        if self.mode == "pick":
+            data = self.node_attributes_schema.subsample(data, representatives)
+        else:
+            data = self._average_by_voxel(data, voxel_idx, representatives)
+        if "copies" in data:
+            data.copies["voxel_idx"] = voxel_idx
+            data.sampled_voxel_idx = torch.arange(representatives.size(0))
+            self.node_attributes_schema.add_node_keys(["sampled_voxel_idx"])
+        return data
+
+    def _average_by_voxel(
+        self, data: Data, voxel_idx: torch.Tensor, representatives: torch.Tensor
+    ):
+        num_voxels = representatives.size(0)
+        counts = torch.bincount(voxel_idx, minlength=num_voxels)
+        for key in self.node_attributes_schema.get_node_keys(data):
+            if key not in data:
+                continue
+            item = data[key]
+            if key == "y":
+                num_classes = int(item.max()) + 1 if item.numel() else 1
+                votes = torch.bincount(
+                    voxel_idx * num_classes + item, minlength=num_voxels * num_classes
+                )
+                data[key] = votes.view(num_voxels, num_classes).argmax(dim=1).to(item.dtype)
+            elif item.is_floating_point():
+                sums = torch.zeros((num_voxels,) + item.shape[1:], dtype=item.dtype)
+                sums.index_add_(0, voxel_idx, item)
+                data[key] = sums / counts.view((-1,) + (1,) * (item.dim() - 1)).to(item.dtype)
+            else:
+                data[key] = item[representatives]
+        if "num_nodes" in data:
+            data.num_nodes = num_voxels
         return data
 
     def __repr__(self) -> str:
-        return f"{self.__class__.__name__}({self.num}"
+        return f"{self.__class__.__name__}(size={self.size}, mode={self.mode})"
+
+
+def voxel_grid_indices(pos: torch.Tensor, size: float):
+    """Assign points to voxels of a regular grid starting at the lowest coordinates.
+
+    Args:
+        pos (torch.Tensor): positions of shape (N, D).
+        size (float): size of a voxel.
+
+    Returns:
+        torch.Tensor, torch.Tensor: voxel index of each point, of shape (N,), and index of the
+        representative point (the first one) of each voxel, of shape (V,). Voxels are sorted by key.
+
+    """
+    coords = torch.floor((pos - pos.min(dim=0).values) / size).long()
+    # Exact hashing (no collision): mixed-radix encoding of voxel coordinates.
+    dims = coords.max(dim=0).values + 1
+    keys = coords[:, 0]
+    for dim in range(1, coords.size(1)):
+        keys = keys * dims[dim] + coords[:, dim]
+    _, voxel_idx = torch.unique(keys, sorted=True, return_inverse=True)
+    num_voxels = int(voxel_idx.max()) + 1 if voxel_idx.numel() else 0
+    representatives = torch.full((num_voxels,), pos.size(0), dtype=torch.long)
+    representatives.scatter_reduce_(0, voxel_idx, torch.arange(pos.size(0)), reduce="amin")
+    return voxel_idx, representatives
 
 
 class CopyFullPos:
-    """Make a copy of the original positions - to be used for test and inference."""
+    """Keep a reference to the original positions - to be used for test and inference.
+
+    No transform modifies positions in-place, so that a reference is enough.
+
+    If the sampled points are original points (see track_sampled_points), they are tracked
+    via a per-node idx_in_pos_copy attribute, which CopySampledPos turns into indices.
+
+    Args:
+        clone (bool, optional): clone instead of keeping a reference. Defaults to False.
+
+    """
+
+    def __init__(self, clone: bool = False):
+        self.clone = clone
+        self.track_sampled_points = False
+        self.node_attributes_schema = NodeAttributesSchema()
 
     def __call__(self, data: Data):
         if "copies" not in data:
             data.copies = dict()
-        data.copies["pos_copy"] = data["pos"].clone()
+        data.copies["pos_copy"] = data["pos"].clone() if self.clone else data["pos"]
+        if self.track_sampled_points:
+            data.idx_in_pos_copy = torch.arange(data.num_nodes)
+            self.node_attributes_schema.add_node_keys(["idx_in_pos_copy"])
         return data
 
 
 class CopyFullPreparedTargets:
-    """Make a copy of all, prepared targets - to be used for test."""
+    """Keep a reference to all, prepared targets - to be used for test.
+
+    Args:
+        clone (bool, optional): clone instead of keeping a reference. Defaults to False.
+
+    """
+
+    def __init__(self, clone: bool = False):
+        self.clone = clone
 
     def __call__(self, data: Data):
         if "copies" not in data:
             data.copies = dict()
-        data.copies["transformed_y_copy"] = data["y"].clone()
+        data.copies["transformed_y_copy"] = data["y"].clone() if self.clone else data["y"]
         return data
 
 
 class CopySampledPos(BaseTransform):
-    """Make a copy of the unormalized positions of subsampled points - to be used for test and inference."""
+    """Keep track of the unormalized positions of subsampled points - to be used for test and inference.
+
+    If sampled points are tracked since CopyFullPos, only their indices in the original positions are
+    kept, as data.copies["sampled_idx"]. Otherwise, positions are kept as data.copies["pos_sampled_copy"].
+
+    Args:
+        clone (bool, optional): clone positions instead of keeping a reference. Defaults to False.
+
+    """
+
+    def __init__(self, clone: bool = False):
+        self.clone = clone
 
     def __call__(self, data: Data):
         if "copies" not in data:
             data.copies = dict()
-        data.copies["pos_sampled_copy"] = data["pos"].clone()
+        if "idx_in_pos_copy" in data:
+            data.copies["sampled_idx"] = data.idx_in_pos_copy
+            del data.idx_in_pos_copy
+            return data
+        data.copies["pos_sampled_copy"] = data["pos"].clone() if self.clone else data["pos"]
         return data
 
 
+def track_sampled_points(transforms: List[Callable]) -> None:
+    """Track sampled points as indices when all transforms between copies keep original points.
+
+    Transforms that may average points (e.g. GridSampling) prevent tracking, since sampled positions
+    are then new positions.
+
+    """
+    preserving_points = (
+        CopyFullPreparedTargets,
+        DropPointsByClass,
+        MaximumNumNodes,
+        MinimumNumNodes,
+        FixedPoints,
+    )
+    for idx, transform in enumerate(transforms):
+        if not isinstance(transform, CopyFullPos):
+            continue
+        for next_transform in transforms[idx + 1 :]:
+            if isinstance(next_transform, CopySampledPos):
+                transform.track_sampled_points = True
+                break
+            is_pick = (
+                isinstance(next_transform, VoxelGridSampling) and next_transform.mode == "pick"
+            )
+            if not (is_pick or isinstance(next_transform, preserving_points)):
+                break
+
+
 class StandardizeRGBAndIntensity(BaseTransform):
     """Standardize RGB and log(Intensity) features."""
 
@@ -142,6 +387,8 @@ class NullifyLowestZ(BaseTransform):
     """Center on x and y axis only. Set lowest z to 0."""
 
     def __call__(self, data):
+        # Not in-place, since positions may be referenced in copies.
+        data.pos = data.pos.clone()
         data.pos[:, 2] = data.pos[:, 2] - data.pos[:, 2].min()
         return data
 
@@ -165,6 +412,40 @@ class NormalizePos(BaseTransform):
         return "{}()".format(self.__class__.__name__)
 
 
+class ClassCodeMapper:
+    """Map integer class codes to other integer codes with a lookup table built once.
+
+    Works directly on numpy arrays and torch tensors, without any per-point Python call.
+    Codes that are not in the mapping are mapped to UNKNOWN_CODE.
+
+    Args:
+        mapping (Dict[int, int]): mapping from source codes to target codes.
+
+    """
+
+    UNKNOWN_CODE = -1
+
+    def __init__(self, mapping: Dict[int, int]):
+        self.mapping = mapping
+        table = np.full(max(mapping.keys(), default=-1) + 1, self.UNKNOWN_CODE, dtype=np.int64)
+        table[list(mapping.keys())] = list(mapping.values())
+        self.table = torch.from_numpy(table)
+
+    def __call__(self, codes: Union[np.ndarray, torch.Tensor]) -> torch.Tensor:
+        """Map codes. Returns a LongTensor, with UNKNOWN_CODE for codes that are not mapped."""
+        codes = torch.as_tensor(codes, dtype=torch.long)
+        in_table = (codes >= 0) & (codes < self.table.size(0))
+        mapped = self.table[codes.clamp(0, max(self.table.size(0) - 1, 0))]
+        return torch.where(in_table, mapped, self.UNKNOWN_CODE)
+
+    def compose(self, other: "ClassCodeMapper") -> "ClassCodeMapper":
+        """Mapper that applies this mapper, then the other one, in a single lookup."""
+        composed = other(self.table)
+        return ClassCodeMapper(
+            {code: int(target) for code, target in enumerate(composed) if target >= 0}
+        )
+
+
 class TargetTransform(BaseTransform):
     """
     Make target vector based on input classification dictionnary.
@@ -178,6 +459,8 @@ class TargetTransform(BaseTransform):
     - classification_dict = {1:"unclassified", 6:"building"}
     - y'' = [1,1,0,0,0]
 
+    Both mappings are merged into a single lookup table, which is built once.
+
     """
 
     def __init__(
@@ -185,8 +468,9 @@ class TargetTransform(BaseTransform):
         classification_preprocessing_dict: Dict[int, int],
         classification_dict: Dict[int, str],
     ):
-        self._set_preprocessing_mapper(classification_preprocessing_dict)
+        self._set_preprocessing_mapper(classification_preprocessing_dict, classification_dict)
         self._set_mapper(classification_dict)
+        self.full_mapper = self.preprocessing_mapper.compose(self.mapper)
 
         # Set to attribute to log potential type errors
         self.classification_dict = classification_dict
@@ -197,10 +481,10 @@ class TargetTransform(BaseTransform):
         return data
 
     def transform(self, y):
-        y = self.preprocessing_mapper(y)
-        try:
-            y = self.mapper(y)
-        except TypeError as e:
+        mapped_y = self.full_mapper(y)
+        unknown = mapped_y == ClassCodeMapper.UNKNOWN_CODE
+        if unknown.any():
+            unknown_codes = torch.as_tensor(y)[unknown].unique().tolist()
             log.error(
                 "A TypeError occured when mapping target from arbitrary integers "
                 "to consecutive integers (0-(n-1)) using the provided classification_dict "
@@ -210,15 +494,22 @@ class TargetTransform(BaseTransform):
                 "or transformed into a specified code via the preprocessing_mapper. \n"
                 f"Current classification_dict: \n{self.classification_dict}\n"
                 f"Current preprocessing_mapper: \n{self.classification_preprocessing_dict}\n"
-                f"Current unique values in preprocessed target array: \n{np.unique(y)}\n"
+                f"Unknown classification codes in target array: \n{unknown_codes}\n"
             )
-            raise e
-        return torch.LongTensor(y)
+            raise TypeError(f"Unknown classification codes: {unknown_codes}")
+        return mapped_y
+
+    def _set_preprocessing_mapper(self, classification_preprocessing_dict, classification_dict):
+        """Set mapper from source classification code to another code.
+
+        Codes that are not preprocessed are kept unchanged.
 
-    def _set_preprocessing_mapper(self, classification_preprocessing_dict):
-        """Set mapper from source classification code to another code."""
-        d = {key: value for key, value in classification_preprocessing_dict.items()}
-        self.preprocessing_mapper = np.vectorize(lambda class_code: d.get(class_code, class_code))
+        """
+        source_codes = set(classification_dict.keys()) | {COMMON_CODE_FOR_ALL_ARTEFACTS}
+        source_codes |= set(classification_preprocessing_dict.keys())
+        d = {code: code for code in range(max(source_codes) + 1)}
+        d.update(classification_preprocessing_dict)
+        self.preprocessing_mapper = ClassCodeMapper(d)
 
     def _set_mapper(self, classification_dict):
         """Set mapper from source classification code to consecutive integers."""
@@ -229,20 +520,24 @@ class TargetTransform(BaseTransform):
         # Here we update the dict so that code 65 remains unchanged.
         # Indeed, 65 is reserved for noise/artefacts points, that will be deleted by transform "DropPointsByClass".
         d.update({65: 65})
-        self.mapper = np.vectorize(lambda class_code: d.get(class_code))
+        self.mapper = ClassCodeMapper(d)
 
 
 class DropPointsByClass(BaseTransform):
     """Drop points with class -1 (i.e. artefacts that would have been mapped to code -1)"""
 
+    def __init__(self):
+        self.node_attributes_schema = NodeAttributesSchema()
+
     def __call__(self, data):
         points_to_drop = torch.isin(data.y, COMMON_CODE_FOR_ALL_ARTEFACTS)
         if points_to_drop.sum() > 0:
             points_to_keep = torch.logical_not(points_to_drop)
-            data = subsample_data(data, num_nodes=data.num_nodes, choice=points_to_keep)
-            # Here we also subsample these idx since we do not need to interpolate these points back
+            # Here we also subsample idx_in_original_cloud since we do not need to interpolate
+            # these points back.
             # It supposes that DropPointsByClass is run before copying the original point cloud
-            if "idx_in_original_cloud" in data:
-                data.idx_in_original_cloud = data.idx_in_original_cloud[points_to_keep.numpy()]
+            data = self.node_attributes_schema.subsample(
+                data, points_to_keep, subsample_indices=True
+            )
 
         return data
@@ -8,14 +8,22 @@ from omegaconf import DictConfig
 from pytorch_lightning import LightningDataModule
 from tqdm import tqdm
 
-from myria3d.models.model import Model
-
 sys.path.append(osp.dirname(osp.dirname(__file__)))
+from myria3d.models.export import (  # noqa
+    compile_model,
+    fold_batch_norms,
+    load_model_for_inference,
+    quantize_model,
+    warmup,
+)
 from myria3d.models.interpolation import Interpolator  # noqa
+from myria3d.pctl.dataloader.dataloader import split_idx_in_original_cloud  # noqa
 from myria3d.utils import utils  # noqa
 
 log = utils.get_logger(__name__)
 
+PREDICT_PRECISIONS = ["32", "bf16-mixed"]
+
 
 @utils.eval_time
 def predict(config: DictConfig) -> str:
@@ -40,16 +48,30 @@ def predict(config: DictConfig) -> str:
     # Those are the 2 needed inputs, in addition to the hydra config.
     assert os.path.exists(config.predict.ckpt_path)
     assert os.path.exists(config.predict.src_las)
+    device = utils.define_device_from_config_param(config.predict.gpus)
+    # Before data preparation, to fail early on an unsupported precision.
+    autocast = get_autocast(device, config.predict.get("precision", 32))
 
     datamodule: LightningDataModule = hydra.utils.instantiate(config.datamodule)
     datamodule._set_predict_data(config.predict.src_las)
 
     # Do not require gradient for faster predictions
     torch.set_grad_enabled(False)
-    model = Model.load_from_checkpoint(config.predict.ckpt_path)
-    device = utils.define_device_from_config_param(config.predict.gpus)
+    # Either a Lightning checkpoint or a model exported with myria3d.models.export.export_model.
+    model = load_model_for_inference(config.predict.ckpt_path)
     model.to(device)
-    model.eval()
+    fold_batch_norms(model)
+    if config.predict.get("quantize", False):
+        model = quantize_model(model)
+    if config.predict.get("compile", False):
+        model = compile_model(model)
+        with autocast:
+            warmup(
+                model,
+                batch_size=config.datamodule.get("batch_size") or 1,
+                num_nodes=config.predict.get("warmup_num_nodes", 12500),
+                pyramid_transform=datamodule.pyramid_transform,
+            )
 
     # TODO: Interpolator could be instantiated directly via hydra.
     itp = Interpolator(
@@ -64,10 +86,33 @@ def predict(config: DictConfig) -> str:
 
     for batch in tqdm(datamodule.predict_dataloader()):
         batch.to(device)
-        logits = model.predict_step(batch)["logits"]
-        itp.store_predictions(logits, batch.idx_in_original_cloud)
+        batch = datamodule.on_after_batch_transfer(batch, 0)
+        with autocast:
+            logits = model.predict_step(batch)["logits"]
+        itp.store_predictions(logits, split_idx_in_original_cloud(batch))
+
+    if "predict" in datamodule.transforms_profilers:
+        log.info(f"Transforms profiling:\n{datamodule.transforms_profilers['predict'].format()}")
 
     out_f = itp.reduce_predictions_and_save(
         config.predict.src_las, config.predict.output_dir, config.datamodule.get("epsg")
     )
     return out_f
+
+
+def get_autocast(device, precision) -> torch.autocast:
+    """Autocast context of inference: bfloat16 for "bf16-mixed", disabled for 32.
+
+    Raises:
+        ValueError: for any other precision, instead of silently running in float32.
+
+    """
+    if str(precision) not in PREDICT_PRECISIONS:
+        raise ValueError(
+            f"Unsupported predict.precision {precision}. Valid choices are: {PREDICT_PRECISIONS}."
+        )
+    return torch.autocast(
+        torch.device(device).type,
+        dtype=torch.bfloat16,
+        enabled=str(precision) == "bf16-mixed",
+    )
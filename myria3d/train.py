@@ -22,6 +22,7 @@ from pytorch_lightning import (
 from pytorch_lightning.loggers.logger import Logger
 
 from myria3d.models.model import Model
+from myria3d.models.pruning import format_report, get_cost, prune_model
 from myria3d.utils import utils
 from run import TASK_NAMES
 
@@ -31,7 +32,7 @@ NEURAL_NET_ARCHITECTURE_CONFIG_GROUP = "neural_net"
 
 
 def train(config: DictConfig) -> Trainer:
-    """Training pipeline (+ Test, + Finetuning)
+    """Training pipeline (+ Test, + Finetuning, + Pruning)
 
     Instantiates all PyTorch Lightning objects from config, then perform one of the following
     task based on parameter `task.task_name`:
@@ -58,6 +59,13 @@ def train(config: DictConfig) -> Trainer:
         for RecudeLROnPlateau scheduler). Additionnaly, a specific callback must be activated to change neural net output layer \
         after loading its weights. See configs/experiment/RandLaNetDebugFineTune.yaml for an example.
 
+    prune:
+        Prunes the channels of a checkpointed neural network (config.model.ckpt_path) with
+        config.prune.keep_ratio, finetunes it for config.prune.finetune_epochs, and tests both the
+        original and the pruned networks. Saves the pruned checkpoint (config.prune.output_path)
+        and a report of their parameters, FLOPs, latency and IoUs (config.prune.report_path).
+        See myria3d.models.pruning.
+
 
     Args:
         config (DictConfig): Configuration composed by Hydra.
@@ -169,5 +177,42 @@ def train(config: DictConfig) -> Trainer:
         log.info(f"Best checkpoint:\n{trainer.checkpoint_callback.best_model_path}")
         log.info("End of training and validating!")
 
+    if task_name == TASK_NAMES.PRUNE.value:
+        log.info("Starting pruning of a trained model!")
+        # Criterion is not saved in checkpoints.
+        model = Model.load_from_checkpoint(config.model.ckpt_path, criterion=model.criterion)
+        pruned = prune_model(
+            model, keep_ratio=config.prune.keep_ratio, channels=config.prune.get("channels")
+        )
+        log.info(f"Pruned channels: {pruned.hparams.neural_net_hparams['channels']}")
+        if config.prune.finetune_epochs:
+            log.info(f"Finetuning pruned model for {config.prune.finetune_epochs} epochs!")
+            finetuner: Trainer = hydra.utils.instantiate(
+                config.trainer,
+                callbacks=callbacks,
+                logger=logger,
+                min_epochs=None,
+                max_epochs=config.prune.finetune_epochs,
+            )
+            finetuner.fit(model=pruned, datamodule=datamodule)
+        reports = {}
+        for name, report_model in [("original", model), ("pruned", pruned)]:
+            log.info(f"Testing {name} model!")
+            metrics = trainer.test(model=report_model, datamodule=datamodule)[0]
+            reports[name] = get_cost(
+                report_model, config.prune.report_batch_size, config.prune.report_num_nodes
+            )
+            # Full tile IoUs if computed, else IoUs on subtiles.
+            prefix = "test/full_tile/iou" if "test/full_tile/iou" in metrics else "test/iou"
+            reports[name].update(
+                {key: value for key, value in metrics.items() if key.startswith(prefix)}
+            )
+        # The pruned model, tested last, is the one attached to the trainer.
+        trainer.save_checkpoint(config.prune.output_path)
+        report = format_report(reports)
+        with open(config.prune.report_path, "w") as f:
+            f.write(report)
+        log.info(f"Pruned checkpoint saved to {config.prune.output_path}. Report:\n{report}")
+
     # Returns the trainer for access to everything that was calculated.
     return trainer
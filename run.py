@@ -31,7 +31,9 @@ class TASK_NAMES(Enum):
     FIT = "fit"
     TEST = "test"
     FINETUNE = "finetune"
+    PRUNE = "prune"
     PREDICT = "predict"
+    EXPORT = "export"
     HDF5 = "create_hdf5"
 
 
@@ -44,7 +46,7 @@ log = utils.get_logger(__name__)
 def launch_train(
     config: DictConfig,
 ):  # pragma: no cover  (it's just an initialyzer of a class/method tested elsewhere)
-    """Training, evaluation, testing, or finetuning of a neural network."""
+    """Training, evaluation, testing, finetuning, or pruning of a neural network."""
     # Imports should be nested inside @hydra.main to optimize tab completion
     # Read more here: https://github.com/facebookresearch/hydra/issues/934
     from myria3d.train import train
@@ -80,6 +82,22 @@ def launch_predict(config: DictConfig):
         predict(config)
 
 
+@hydra.main(config_path=DEFAULT_DIRECTORY, config_name=DEFAULT_CONFIG_FILE)
+def launch_export(config: DictConfig):
+    """Export a trained model to an inference artifact, loadable by predict in place of the checkpoint."""
+    from myria3d.models.export import export_model, load_model_for_inference
+
+    # Next to the checkpoint by default.
+    ckpt_path = config.predict.ckpt_path
+    export_path = config.predict.get("export_path") or os.path.splitext(ckpt_path)[0] + ".pt"
+    if not os.path.isabs(ckpt_path):
+        ckpt_path = os.path.join(os.path.dirname(__file__), ckpt_path)
+    if not os.path.isabs(export_path):
+        export_path = os.path.join(os.path.dirname(__file__), export_path)
+    export_model(load_model_for_inference(ckpt_path), export_path)
+    log.info(f"Exported {ckpt_path} to {export_path}")
+
+
 @hydra.main(config_path="configs/", config_name="config.yaml")
 def launch_hdf5(config: DictConfig):
     """Build an HDF5 file from a directory with las files."""
@@ -114,7 +132,12 @@ if __name__ == "__main__":
 
     log.info(f"Task: {task_name}")
 
-    if task_name in [TASK_NAMES.FIT.value, TASK_NAMES.TEST.value, TASK_NAMES.FINETUNE.value]:
+    if task_name in [
+        TASK_NAMES.FIT.value,
+        TASK_NAMES.TEST.value,
+        TASK_NAMES.FINETUNE.value,
+        TASK_NAMES.PRUNE.value,
+    ]:
         # load environment variables from `.env` file if it exists
         # recursively searches for `.env` in all folders starting from work dir
         dotenv.load_dotenv(override=True)
@@ -124,6 +147,9 @@ if __name__ == "__main__":
         dotenv.load_dotenv(os.path.join(DEFAULT_DIRECTORY, DEFAULT_ENV))
         launch_predict()
 
+    elif task_name == TASK_NAMES.EXPORT.value:
+        launch_export()
+
     elif task_name == TASK_NAMES.HDF5.value:
         launch_hdf5()
 
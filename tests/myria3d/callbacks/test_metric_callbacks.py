@@ -0,0 +1,55 @@
+from types import SimpleNamespace
+
+import numpy as np
+import torch
+
+from myria3d.callbacks.metric_callbacks import FullTileTestMetrics
+
+
+def test_FullTileTestMetrics_counts_each_point_of_a_tile_once():
+    callback = FullTileTestMetrics(num_classes=2)
+    callback.on_test_epoch_start(None, None)
+
+    # Two overlapping subtiles of tile A (point 2 is predicted twice), then a subtile of tile B.
+    batch = SimpleNamespace(
+        basename=["A", "A"], idx_in_original_cloud=[np.array([0, 1, 2]), np.array([2, 3])]
+    )
+    outputs = {
+        "logits": torch.tensor([[1.0, 0.0], [0.0, 1.0], [1.0, 0.0], [0.0, 3.0], [1.0, 0.0]]),
+        "targets": torch.tensor([0, 1, 1, 1, 0]),
+    }
+    callback.on_test_batch_end(None, None, outputs, batch, 0)
+    assert not callback.confusion_matrices_by_tile
+
+    batch = SimpleNamespace(basename=["B"], idx_in_original_cloud=[np.array([0])])
+    outputs = {"logits": torch.tensor([[0.0, 1.0]]), "targets": torch.tensor([1])}
+    callback.on_test_batch_end(None, None, outputs, batch, 1)
+    # Tile A is complete and reduced as soon as a batch without it comes in.
+    assert torch.equal(callback.confusion_matrices_by_tile["A"], torch.tensor([[2, 0], [0, 2]]))
+
+    callback._reduce_tile("B")
+    assert torch.equal(callback.confusion_matrices_by_tile["B"], torch.tensor([[0, 0], [0, 1]]))
+
+
+def test_FullTileTestMetrics_sums_confusion_matrices_across_ranks():
+    callback = FullTileTestMetrics(num_classes=2)
+    callback.on_test_epoch_start(None, None)
+    batch = SimpleNamespace(basename=["A"], idx_in_original_cloud=[np.array([0, 1])])
+    outputs = {"logits": torch.tensor([[1.0, 0.0], [1.0, 0.0]]), "targets": torch.tensor([0, 1])}
+    callback.on_test_batch_end(None, None, outputs, batch, 0)
+
+    # Another rank predicted the two other points of tile A, both right.
+    other_rank_confmat = torch.tensor([[1, 0], [0, 1]])
+    trainer = SimpleNamespace(
+        strategy=SimpleNamespace(reduce=lambda confmat, reduce_op: confmat + other_rank_confmat)
+    )
+    logged = {}
+    pl_module = SimpleNamespace(
+        device=torch.device("cpu"),
+        hparams=SimpleNamespace(classification_dict={0: "a", 1: "b"}),
+        log=lambda name, value: logged.__setitem__(name, float(value)),
+    )
+    callback.on_test_epoch_end(trainer, pl_module)
+    assert logged["test/full_tile/acc"] == 0.75
+    assert logged["test/full_tile/iou/a"] == 2 / 3
+    assert logged["test/full_tile/iou/b"] == 0.5
@@ -0,0 +1,49 @@
+from typing import Callable
+
+import pytest
+import torch
+from torch_geometric.data import Batch, Data
+
+from myria3d.models.model import Model
+
+
+@pytest.fixture
+def model() -> Model:
+    """A RandLA-Net Model with default channels, in eval mode."""
+    return Model(
+        neural_net_class_name="PyGRandLANet",
+        neural_net_hparams=dict(num_features=2, num_classes=7, return_logits=True),
+        interpolation_k=10,
+        num_workers=1,
+    ).eval()
+
+
+@pytest.fixture
+def batch() -> Batch:
+    """A batch of two random clouds."""
+    return get_batch()
+
+
+def get_batch() -> Batch:
+    return Batch.from_data_list(
+        [Data(x=torch.rand((n, 2)), pos=torch.rand((n, 3)) * 50) for n in [300, 250]]
+    )
+
+
+@pytest.fixture
+def new_batch() -> Callable[[], Batch]:
+    """Factory of batches of two random clouds, e.g. to update running statistics."""
+    return get_batch
+
+
+@pytest.fixture
+def forward() -> Callable[[Model, Batch], torch.Tensor]:
+    """Forward pass of the neural network of a Model without gradients, with a fixed seed."""
+
+    def _forward(model: Model, batch: Batch) -> torch.Tensor:
+        # Same decimations in all models.
+        torch.manual_seed(0)
+        with torch.no_grad():
+            return model.model(batch.x, batch.pos, batch.batch, batch.ptr)
+
+    return _forward
@@ -0,0 +1,50 @@
+import pytest
+import torch
+from torch_geometric.nn import knn_interpolate as pyg_knn_interpolate
+from torch_scatter import scatter
+
+from myria3d.models.modules.knn import KNN_BACKENDS, knn, knn_interpolate
+
+
+def get_clouds(sizes, width=50):
+    pos = torch.rand((sum(sizes), 3)) * torch.tensor([width, width, 10])
+    batch = torch.repeat_interleave(torch.arange(len(sizes)), torch.tensor(sizes))
+    return pos, batch
+
+
+def sum_of_squared_distances(x, y, row, col):
+    return scatter(((x[col] - y[row]) ** 2).sum(dim=1), row, dim_size=y.size(0))
+
+
+@pytest.mark.parametrize("backend", KNN_BACKENDS)
+@pytest.mark.parametrize("k", [1, 16])
+def test_knn_backends_find_nearest_neighbors(backend, k):
+    # Includes a cloud with less than k points, and one with no queries.
+    x, batch_x = get_clouds([2000, 10, 2990, 100])
+    y, batch_y = get_clouds([1000, 500, 1500])
+    row, col = knn(x, y, k, batch_x, batch_y, backend=backend)
+    expected_row, expected_col = knn(x, y, k, batch_x, batch_y, backend="torch_cluster")
+
+    assert torch.equal(row, expected_row)
+    assert torch.equal(batch_x[col], batch_y[row])
+    assert torch.allclose(
+        sum_of_squared_distances(x, y, row, col),
+        sum_of_squared_distances(x, y, expected_row, expected_col),
+        atol=1e-4,
+    )
+
+
+@pytest.mark.parametrize("backend", KNN_BACKENDS)
+def test_knn_interpolate_matches_pyg(backend):
+    pos_x, batch_x = get_clouds([300, 200])
+    pos_y, batch_y = get_clouds([1000, 800])
+    x = torch.rand((pos_x.size(0), 5))
+    output = knn_interpolate(x, pos_x, pos_y, batch_x, batch_y, k=3, backend=backend)
+    expected = pyg_knn_interpolate(x, pos_x, pos_y, batch_x, batch_y, k=3)
+    assert torch.allclose(output, expected, atol=1e-5)
+
+
+def test_knn_raises_for_unknown_backend():
+    x = torch.rand((10, 3))
+    with pytest.raises(ValueError):
+        knn(x, x, 3, backend="unknown")
@@ -2,7 +2,7 @@ import pytest
 import torch
 from torch_geometric.data import Batch, Data
 
-from myria3d.models.modules.pyg_randla_net import PyGRandLANet
+from myria3d.models.modules.pyg_randla_net import PyGRandLANet, decimation_indices
 
 
 @pytest.mark.parametrize("num_nodes", [[12500, 12500], [50, 50], [12500, 10000]])
@@ -38,3 +38,87 @@ def test_fake_run_pyg_randlanet(num_nodes):
     )
     output = model(data.x, data.pos, data.batch, data.ptr)
     assert output.shape == torch.Size([sum(num_nodes), num_classes])
+
+
+def test_decimation_indices_decimates_each_cloud_separately():
+    ptr = torch.LongTensor([0, 100, 101, 101 + 37, 101 + 37 + 8])
+    idx_decim, ptr_decim = decimation_indices(ptr, 4)
+    assert torch.equal(ptr_decim, torch.LongTensor([0, 25, 26, 35, 37]))
+    # Indices are distinct and stay within their cloud.
+    assert idx_decim.unique().size(0) == idx_decim.size(0)
+    for i in range(ptr.size(0) - 1):
+        sample_idx = idx_decim[ptr_decim[i] : ptr_decim[i + 1]]
+        assert ((sample_idx >= ptr[i]) & (sample_idx < ptr[i + 1])).all()
+
+
+def test_decimation_indices_draws_points_uniformly():
+    ptr = torch.LongTensor([0, 4, 12])
+    counts = torch.zeros(12)
+    for _ in range(2000):
+        counts[decimation_indices(ptr, 4)[0]] += 1
+    # Each point of a cloud of n points is kept with probability 1/n, and 2/n, resp.
+    assert torch.allclose(counts[:4] / 2000, torch.full((4,), 1 / 4), atol=0.05)
+    assert torch.allclose(counts[4:] / 2000, torch.full((8,), 2 / 8), atol=0.05)
+
+
+@pytest.mark.parametrize("training", [True, False])
+def test_dense_aggregation_gives_same_outputs_with_same_weights(training):
+    # Includes a cloud with less points than neighbors at each level.
+    num_nodes = [300, 10, 1000]
+    data = Batch.from_data_list(
+        [Data(x=torch.rand((n, 9)), pos=torch.rand((n, 3))) for n in num_nodes]
+    )
+    model = PyGRandLANet(9, 6, decimation=1, num_neighbors=16).train(training)
+    dense_model = PyGRandLANet(9, 6, decimation=1, num_neighbors=16, dense_aggregation=True)
+    dense_model.load_state_dict(model.state_dict())
+    dense_model.train(training)
+
+    torch.manual_seed(0)
+    output = model(data.x, data.pos, data.batch, data.ptr)
+    torch.manual_seed(0)
+    dense_output = dense_model(data.x, data.pos, data.batch, data.ptr)
+    assert torch.allclose(dense_output, output, atol=1e-4)
+
+
+@pytest.mark.parametrize("dense_aggregation", [False, True])
+def test_bf16_autocast_keeps_float32_outputs(dense_aggregation):
+    data = Batch.from_data_list(
+        [Data(x=torch.rand((n, 9)), pos=torch.rand((n, 3))) for n in [300, 500]]
+    )
+    model = PyGRandLANet(9, 6, dense_aggregation=dense_aggregation).eval()
+    torch.manual_seed(0)
+    with torch.no_grad():
+        output = model(data.x, data.pos, data.batch, data.ptr)
+    torch.manual_seed(0)
+    with torch.no_grad(), torch.autocast("cpu", dtype=torch.bfloat16):
+        bf16_output = model(data.x, data.pos, data.batch, data.ptr)
+    assert bf16_output.dtype == torch.float32
+    assert torch.allclose(bf16_output, output, atol=0.05)
+
+
+@pytest.mark.parametrize("dense_aggregation", [False, True])
+def test_checkpointing_gives_same_outputs_gradients_and_running_stats(dense_aggregation):
+    data = Batch.from_data_list(
+        [Data(x=torch.rand((n, 9)), pos=torch.rand((n, 3))) for n in [300, 10, 500]]
+    )
+    model = PyGRandLANet(9, 6, dense_aggregation=dense_aggregation)
+    checkpointed_model = PyGRandLANet(
+        9, 6, dense_aggregation=dense_aggregation, checkpointing=True
+    )
+    checkpointed_model.load_state_dict(model.state_dict())
+
+    outputs = []
+    for module in [model, checkpointed_model]:
+        torch.manual_seed(0)
+        output = module(data.x, data.pos, data.batch, data.ptr)
+        output.sum().backward()
+        outputs.append(output)
+    assert torch.allclose(outputs[1], outputs[0], atol=1e-5)
+    for (name, param), checkpointed_param in zip(
+        model.named_parameters(), checkpointed_model.parameters()
+    ):
+        assert torch.allclose(checkpointed_param.grad, param.grad, atol=1e-4), name
+    for (name, buffer), checkpointed_buffer in zip(
+        model.named_buffers(), checkpointed_model.buffers()
+    ):
+        assert torch.equal(checkpointed_buffer, buffer), name
@@ -0,0 +1,78 @@
+import pytest
+import torch
+from torch_geometric.data import Batch, Data
+
+from myria3d.models.distillation import DistillationModel
+from myria3d.models.export import export_model
+from myria3d.models.model import Model
+
+
+def get_model_kwargs(**neural_net_hparams):
+    return dict(
+        neural_net_class_name="PyGRandLANet",
+        neural_net_hparams=dict(
+            num_features=2, num_classes=7, return_logits=True, **neural_net_hparams
+        ),
+        num_classes=7,
+        interpolation_k=10,
+        num_workers=1,
+        criterion=torch.nn.CrossEntropyLoss(),
+    )
+
+
+@pytest.fixture
+def teacher_path(tmp_path):
+    path = str(tmp_path / "teacher.pt")
+    export_model(Model(**get_model_kwargs()).eval(), path)
+    return path
+
+
+def get_student(teacher_path: str) -> DistillationModel:
+    return DistillationModel(
+        teacher_ckpt_path=teacher_path,
+        **get_model_kwargs(channels=[8, 16, 32, 64]),
+    )
+
+
+def get_batch():
+    return Batch.from_data_list(
+        [
+            Data(x=torch.rand((n, 2)), pos=torch.rand((n, 3)) * 50, y=torch.randint(7, (n,)))
+            for n in [300, 250]
+        ]
+    )
+
+
+def test_distillation_trains_the_student_only(teacher_path):
+    model = get_student(teacher_path).train()
+    assert not model.teacher.training
+    loss = model.training_step(get_batch(), 0)["loss"]
+    loss.backward()
+    assert all(param.grad is None for param in model.teacher.parameters())
+    assert all(param.grad is not None for param in model.model.parameters())
+
+
+def test_distillation_loss_is_null_for_same_logits(teacher_path):
+    model = get_student(teacher_path)
+    logits = torch.rand((100, 7))
+    assert model.distillation_loss(logits, logits).abs() < 1e-6
+    assert model.distillation_loss(logits, logits.log_softmax(dim=1)).abs() < 1e-6
+    assert model.distillation_loss(logits, torch.rand((100, 7))) > 0
+
+
+def test_student_checkpoint_loads_as_a_model(teacher_path):
+    model = get_student(teacher_path)
+    checkpoint = {"state_dict": model.state_dict()}
+    model.on_save_checkpoint(checkpoint)
+    student = Model(**get_model_kwargs(channels=[8, 16, 32, 64]))
+    student.load_state_dict(checkpoint["state_dict"])
+
+    model.on_load_checkpoint(checkpoint)
+    model.load_state_dict(checkpoint["state_dict"])
+
+
+def test_distillation_raises_for_different_classes(teacher_path):
+    kwargs = get_model_kwargs()
+    kwargs["num_classes"] = 5
+    with pytest.raises(ValueError):
+        DistillationModel(teacher_ckpt_path=teacher_path, **kwargs)
@@ -0,0 +1,53 @@
+import pytest
+import torch
+from torch_geometric.nn.norm import BatchNorm
+
+from myria3d.models.export import (
+    compile_model,
+    export_model,
+    fold_batch_norms,
+    load_model_for_inference,
+    quantize_model,
+    warmup,
+)
+
+
+def test_exported_model_has_same_weights_and_hparams(tmp_path, model, batch, forward):
+    path = str(tmp_path / "model.pt")
+    export_model(model, path)
+    exported = load_model_for_inference(path)
+    assert not exported.training
+    assert exported.hparams.interpolation_k == 10
+    assert torch.allclose(forward(exported, batch), forward(model, batch))
+
+
+def test_compiled_model_matches_eager_model(model, batch, forward):
+    expected = forward(model, batch)
+    compile_model(model)
+    warmup(model, batch_size=2, num_nodes=200)
+    assert torch.allclose(forward(model, batch), expected, atol=1e-4)
+
+
+def test_folded_batch_norms_give_same_outputs(model, batch, new_batch, forward):
+    # Non-trivial running statistics.
+    model.train()
+    for _ in range(3):
+        forward(model, new_batch())
+    model.eval()
+    expected = forward(model, batch)
+    fold_batch_norms(model)
+    assert not any(isinstance(module, BatchNorm) for module in model.modules())
+    assert torch.allclose(forward(model, batch), expected, atol=1e-4)
+
+
+def test_fold_batch_norms_raises_in_training_mode(model):
+    with pytest.raises(ValueError):
+        fold_batch_norms(model.train())
+
+
+def test_quantized_model_gives_close_outputs(model, batch, forward):
+    model = fold_batch_norms(model)
+    expected = forward(model, batch)
+    quantize_model(model)
+    assert not any(isinstance(module, torch.nn.Linear) for module in model.model.modules())
+    assert torch.allclose(forward(model, batch), expected, atol=0.05)
@@ -1,12 +1,16 @@
+from types import SimpleNamespace
+
 import hydra
+import numpy as np
+import torch
 from pytorch_lightning import LightningDataModule, LightningModule
 from tests.conftest import make_default_hydra_cfg
 
-from myria3d.models.model import Model
+from myria3d.models.model import get_batch_y, get_voxel_backprojection_idx
 from myria3d.utils import utils  # noqa
 
 
-def test_model_get_batch_tensor_by_enumeration():
+def test_model_get_batch_y():
     config = make_default_hydra_cfg(
         overrides=[
             "predict.src_las=tests/data/toy_dataset_src/862000_6652000.classified_toy_dataset.100mx100m.las",
@@ -20,13 +24,32 @@ def test_model_get_batch_tensor_by_enumeration():
     datamodule: LightningDataModule = hydra.utils.instantiate(config.datamodule)
     datamodule._set_predict_data(config.predict.src_las)
 
-    model = Model(
-        neural_net_class_name="PyGRandLANet",
-        neural_net_hparams=dict(num_features=2, num_classes=7),
-    )
     for batch in datamodule.predict_dataloader():
         # Check that no error is raised ("TypeError: object of type 'numpy.int64' has no len()")
-        _ = model._get_batch_tensor_by_enumeration(batch.idx_in_original_cloud)
+        _ = get_batch_y(batch)
+
+
+def test_get_batch_y_with_both_collaters():
+    sizes = [2, 3, 0, 1]
+    # GeometricNoneProofCollater: a list of indices per sample.
+    batch = SimpleNamespace(idx_in_original_cloud=[np.arange(size) for size in sizes])
+    assert get_batch_y(batch).tolist() == [0, 0, 1, 1, 1, 3]
+    # CSRCollater: concatenated indices, with boundaries.
+    batch = SimpleNamespace(
+        idx_in_original_cloud=torch.arange(6),
+        idx_in_original_cloud_ptr=torch.LongTensor([0, 2, 5, 5, 6]),
+    )
+    assert get_batch_y(batch).tolist() == [0, 0, 1, 1, 1, 3]
+
+
+def test_get_voxel_backprojection_idx():
+    # Two samples: voxels 0,1,2 then voxels 0,1. Voxel 1 of the first sample was not sampled.
+    voxel_idx = torch.LongTensor([0, 1, 2, 2, 0, 0, 1])
+    batch_y = torch.LongTensor([0, 0, 0, 0, 1, 1, 1])
+    sampled_voxel_idx = torch.LongTensor([2, 0, 1, 0])
+    batch_x = torch.LongTensor([0, 0, 1, 1])
+    node_idx = get_voxel_backprojection_idx(voxel_idx, batch_y, sampled_voxel_idx, batch_x)
+    assert node_idx.tolist() == [1, -1, 0, 0, 3, 3, 2]
 
 
 def test_model_forward():
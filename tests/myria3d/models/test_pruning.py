@@ -0,0 +1,38 @@
+import pytest
+import torch
+from torch_geometric.nn.norm import BatchNorm
+
+from myria3d.models.model import Model
+from myria3d.models.pruning import format_report, get_cost, prune_model
+
+
+def zero_second_half_of_channels(model: Model) -> None:
+    """Zero the outputs of half of the channels of each pruned layer, i.e. all but fp1."""
+    for name, module in model.model.named_modules():
+        if isinstance(module, BatchNorm) and not name.startswith(("fp1.", "mlp_classif.")):
+            num_channels = module.module.num_features
+            module.module.weight.data.uniform_(0.5, 1.5)
+            module.module.weight.data[num_channels // 2 :] = 0.0
+            module.module.bias.data[num_channels // 2 :] = 0.0
+
+
+def test_pruning_of_zeroed_channels_gives_same_outputs(model, batch, forward):
+    zero_second_half_of_channels(model)
+    pruned = prune_model(model, keep_ratio=0.5)
+    assert pruned.hparams.neural_net_hparams["channels"] == [16, 64, 128, 256]
+    assert not pruned.training
+    assert torch.allclose(forward(pruned, batch), forward(model, batch), atol=1e-5)
+
+
+def test_pruned_model_is_cheaper(model):
+    pruned = prune_model(model, channels=[8, 32, 64, 128])
+    cost = get_cost(model, batch_size=2, num_nodes=500, num_steps=1)
+    pruned_cost = get_cost(pruned, batch_size=2, num_nodes=500, num_steps=1)
+    assert pruned_cost["num_parameters"] < cost["num_parameters"]
+    assert pruned_cost["gflops"] < cost["gflops"]
+    assert "| gflops |" in format_report({"original": cost, "pruned": pruned_cost})
+
+
+def test_pruning_to_wider_channels_raises(model):
+    with pytest.raises(ValueError):
+        prune_model(model, channels=[64, 128, 256, 512])
@@ -0,0 +1,67 @@
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+from torch_geometric.data import Data
+
+from myria3d.pctl.dataloader.dataloader import (
+    CSRCollater,
+    GeometricNoneProofCollater,
+    split_idx_in_original_cloud,
+)
+
+
+def get_sample(num_nodes, num_nodes_full=None):
+    num_nodes_full = num_nodes_full or 2 * num_nodes
+    return Data(
+        pos=torch.rand((num_nodes, 3)),
+        x=torch.rand((num_nodes, 2)),
+        y=torch.randint(0, 6, (num_nodes,)),
+        x_features_names=["Intensity", "rgb_avg"],
+        basename=f"tile_{num_nodes}",
+        idx_in_original_cloud=np.arange(num_nodes_full),
+        copies={
+            "pos_copy": torch.rand((num_nodes_full, 3)),
+            "sampled_idx": torch.randint(0, num_nodes_full, (num_nodes,)),
+        },
+    )
+
+
+class SamplesDataset(torch.utils.data.Dataset):
+    def __init__(self, sizes):
+        self.sizes = sizes
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def __getitem__(self, idx):
+        torch.manual_seed(idx)
+        return get_sample(self.sizes[idx]) if self.sizes[idx] else None
+
+
+def test_csr_collater_matches_pyg_collater():
+    samples = [get_sample(num_nodes) for num_nodes in [10, 1, 25]]
+    expected = GeometricNoneProofCollater()(samples)
+    batch = CSRCollater()(samples + [None])
+
+    assert batch.num_graphs == 3
+    for key in ["pos", "x", "y", "batch", "ptr"]:
+        assert torch.equal(batch[key], expected[key])
+    for key in ["pos_copy", "sampled_idx"]:
+        assert torch.equal(batch.copies[key], expected.copies[key])
+    assert batch.basename == expected.basename
+    assert batch.x_features_names == expected.x_features_names
+    for idx, expected_idx in zip(
+        split_idx_in_original_cloud(batch), expected.idx_in_original_cloud
+    ):
+        assert np.array_equal(idx, expected_idx)
+    assert CSRCollater()([None]) is None
+
+
+def test_csr_collater_in_dataloader_workers():
+    dataloader = DataLoader(
+        SamplesDataset([10, 0, 25, 3, 7]), batch_size=2, num_workers=2, collate_fn=CSRCollater()
+    )
+    batches = list(dataloader)
+    assert [b.num_graphs for b in batches] == [1, 2, 1]
+    assert [len(idx) for idx in split_idx_in_original_cloud(batches[1])] == [50, 6]
+    assert torch.equal(batches[2].pos, SamplesDataset([0] * 4 + [7])[4].pos)
@@ -0,0 +1,19 @@
+import pytest
+
+from myria3d.pctl.datamodule.hdf5 import HDF5LidarDataModule
+
+
+@pytest.mark.parametrize(
+    "sampling_kwargs", [{"block_shuffle_window": 400}, {"class_balancing_alpha": 0.5}]
+)
+def test_points_budget_with_another_sampling_raises(sampling_kwargs):
+    with pytest.raises(ValueError):
+        HDF5LidarDataModule(
+            data_dir=None,
+            split_csv_path=None,
+            hdf5_file_path="unused.hdf5",
+            epsg=None,
+            transforms={},
+            points_budget=400000,
+            **sampling_kwargs,
+        )
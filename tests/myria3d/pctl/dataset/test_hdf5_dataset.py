@@ -0,0 +1,52 @@
+import os.path as osp
+
+import h5py
+import numpy as np
+
+from myria3d.pctl.dataset.hdf5 import HDF5Dataset
+
+
+def make_hdf5_file(hdf5_file_path: str, num_points: int = 20) -> None:
+    """Minimal HDF5 dataset, with one sample per split and no indices of samples."""
+    with h5py.File(hdf5_file_path, "w") as hdf5_file:
+        for split in ["train", "val", "test"]:
+            sample_path = osp.join(split, "tile.las", "00000")
+            hdf5_file.create_dataset(
+                osp.join(sample_path, "x"), data=np.random.rand(num_points, 2)
+            )
+            hdf5_file[osp.join(sample_path, "x")].attrs["x_features_names"] = ["a", "b"]
+            hdf5_file.create_dataset(
+                osp.join(sample_path, "pos"), data=np.random.rand(num_points, 3)
+            )
+            hdf5_file.create_dataset(osp.join(sample_path, "y"), data=np.full(num_points, 2))
+            hdf5_file.create_dataset(
+                osp.join(sample_path, "idx_in_original_cloud"), data=np.arange(num_points)
+            )
+
+
+def test_samples_num_nodes_after_reading_a_sample(tmp_path):
+    hdf5_file_path = str(tmp_path / "dataset.hdf5")
+    make_hdf5_file(hdf5_file_path)
+    dataset = HDF5Dataset(hdf5_file_path, epsg=None, las_paths_by_split_dict=None)
+    # Leaves the HDF5 file open read-only, as after a sanity validation without workers.
+    assert dataset.valdata[0].num_nodes == 20
+    assert dataset.samples_num_nodes == [20, 20, 20]
+    assert dataset.valdata[0].num_nodes == 20
+    # Indexed into the file for next runs.
+    assert HDF5Dataset(hdf5_file_path, None, None).samples_num_nodes == [20, 20, 20]
+
+
+def test_samples_class_histograms_after_reading_a_sample(tmp_path):
+    hdf5_file_path = str(tmp_path / "dataset.hdf5")
+    make_hdf5_file(hdf5_file_path)
+    dataset = HDF5Dataset(hdf5_file_path, epsg=None, las_paths_by_split_dict=None)
+    # Leaves the HDF5 file open read-only, as after a sanity validation without workers.
+    assert dataset.valdata[0].num_nodes == 20
+    histograms = dataset.samples_class_histograms
+    assert histograms.shape == (3, 256)
+    assert (histograms[:, 2] == 20).all()
+    assert dataset.valdata[0].num_nodes == 20
+    # Indexed into the file for next runs.
+    assert np.array_equal(
+        HDF5Dataset(hdf5_file_path, None, None).samples_class_histograms, histograms
+    )
@@ -0,0 +1,18 @@
+import numpy as np
+
+from myria3d.pctl.dataloader.dataloader import GeometricNoneProofDataloader
+from myria3d.pctl.dataset.iterable import InferenceDataset
+from myria3d.pctl.dataset.toy_dataset import TOY_EPSG, TOY_LAS_DATA
+
+
+def test_InferenceDataset_shards_subtiles_across_workers():
+    dataset = InferenceDataset(TOY_LAS_DATA, TOY_EPSG, tile_width=110, subtile_width=50)
+    dataset.load_tile()
+    idx_single_process = np.sort(np.concatenate([d.idx_in_original_cloud for d in dataset]))
+
+    dataloader = GeometricNoneProofDataloader(dataset=dataset, batch_size=2, num_workers=2)
+    idx_multi_workers = np.sort(
+        np.concatenate([idx for batch in dataloader for idx in batch.idx_in_original_cloud])
+    )
+    # Each subtile is prepared by exactly one worker.
+    assert np.array_equal(idx_single_process, idx_multi_workers)
@@ -0,0 +1,79 @@
+import pytest
+import torch
+from torch_geometric.data import Data
+
+from myria3d.pctl.sampler.sampler import (
+    BlockShuffleSampler,
+    PointsBudgetBatchSampler,
+    batch_by_points_budget,
+    get_class_balancing_weights,
+    pack_by_points_budget,
+)
+
+
+@pytest.mark.parametrize("shuffle", [True, False])
+def test_PointsBudgetBatchSampler(shuffle):
+    num_nodes = torch.randint(300, 40000, (200,)).tolist()
+    points_budget = 100000
+    sampler = PointsBudgetBatchSampler(num_nodes, points_budget, shuffle=shuffle, bucket_size=50)
+
+    batches = list(sampler)
+    assert len(batches) == len(sampler)
+    # All samples are seen exactly once
+    assert sorted(idx for batch in batches for idx in batch) == list(range(200))
+    # Budget is respected
+    for batch in batches:
+        assert sum(num_nodes[idx] for idx in batch) <= points_budget
+
+
+def test_PointsBudgetBatchSampler_changes_order_with_epoch():
+    num_nodes = torch.randint(300, 40000, (200,)).tolist()
+    sampler = PointsBudgetBatchSampler(num_nodes, 100000, shuffle=True, bucket_size=50)
+    sampler.set_epoch(0)
+    epoch_0 = list(sampler)
+    assert epoch_0 == list(sampler)  # deterministic for a given epoch.
+    sampler.set_epoch(1)
+    assert epoch_0 != list(sampler)
+
+
+def test_pack_by_points_budget_with_oversized_sample_and_max_batch_size():
+    # The oversized sample gets a batch of its own.
+    assert pack_by_points_budget([0, 1, 2, 3], [10, 200, 10, 10], points_budget=100) == [
+        [0],
+        [1],
+        [2, 3],
+    ]
+    assert pack_by_points_budget([0, 1, 2], [1, 1, 1], points_budget=100, max_batch_size=2) == [
+        [0, 1],
+        [2],
+    ]
+
+
+def test_batch_by_points_budget():
+    samples = [Data(pos=torch.rand((n, 3))) for n in [50, 30, 30, 120, 10]]
+    batches = list(batch_by_points_budget(samples, points_budget=100))
+    assert [[d.num_nodes for d in batch] for batch in batches] == [[50, 30], [30], [120], [10]]
+
+
+def test_BlockShuffleSampler_keeps_blocks_close():
+    # 10 blocks of 20 contiguous samples.
+    block_ids = [i // 20 for i in range(200)]
+    sampler = BlockShuffleSampler(block_ids, window_size=20)
+    order = list(sampler)
+    assert len(order) == len(sampler)
+    assert sorted(order) == list(range(200))
+    assert order != list(range(200))
+    # Windows are aligned with blocks here: each window of the order comes from a single block.
+    for start in range(0, 200, 20):
+        assert len({block_ids[idx] for idx in order[start : start + 20]}) == 1
+
+
+def test_get_class_balancing_weights():
+    # Class 1 is rare: the sample that contains it should be drawn more often.
+    class_histograms = torch.tensor([[100, 0], [90, 10], [100, 0]])
+    weights = get_class_balancing_weights(class_histograms, alpha=0.5)
+    assert weights[1] > weights[0]
+    assert weights[0] == weights[2]
+    # alpha=0 means uniform sampling.
+    weights = get_class_balancing_weights(class_histograms, alpha=0.0)
+    assert torch.allclose(weights, torch.ones(3, dtype=weights.dtype))
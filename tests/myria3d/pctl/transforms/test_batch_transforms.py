@@ -0,0 +1,62 @@
+import pytest
+import torch
+from torch_geometric.data import Batch, Data
+from torch_geometric.transforms import RandomFlip, RandomRotate
+
+from myria3d.pctl.transforms.batch_transforms import to_batch_transforms
+from myria3d.pctl.transforms.transforms import (
+    NormalizePos,
+    NullifyLowestZ,
+    StandardizeRGBAndIntensity,
+    TargetTransform,
+)
+
+
+def get_samples():
+    # Includes a single-point sample, for which std is not defined.
+    return [
+        Data(
+            pos=torch.rand((num_nodes, 3)) * 50,
+            x=torch.rand((num_nodes, 2)) * 1000,
+            x_features_names=["Intensity", "rgb_avg"],
+        )
+        for num_nodes in [50, 1, 300]
+    ]
+
+
+def test_batch_normalizations_match_sample_normalizations():
+    normalizations = [
+        NullifyLowestZ(),
+        NormalizePos(subtile_width=50),
+        StandardizeRGBAndIntensity(),
+    ]
+    samples = get_samples()
+
+    expected = []
+    for sample in samples:
+        sample = sample.clone()
+        for transform in normalizations:
+            sample = transform(sample)
+        expected.append(sample)
+    expected = Batch.from_data_list(expected)
+
+    batch = Batch.from_data_list([sample.clone() for sample in samples])
+    for transform in to_batch_transforms(normalizations):
+        batch = transform(batch)
+
+    assert torch.allclose(batch.pos, expected.pos)
+    assert torch.allclose(batch.x, expected.x, atol=1e-5)
+
+
+def test_batch_augmentations_are_rigid_per_sample():
+    batch = Batch.from_data_list(get_samples())
+    pos = batch.pos.clone()
+    for transform in to_batch_transforms([RandomRotate(180, axis=2), RandomFlip(0)]):
+        batch = transform(batch)
+    assert torch.allclose(batch.pos.norm(dim=1), pos.norm(dim=1), atol=1e-4)
+    assert torch.equal(batch.pos[:, 2], pos[:, 2])
+
+
+def test_to_batch_transforms_raises_for_unknown_transform():
+    with pytest.raises(ValueError):
+        to_batch_transforms([TargetTransform({}, {1: "unclassified"})])
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+import torch
+from torch_geometric.data import Data
+from torch_geometric.transforms import Center, GridSampling
+
+from myria3d.pctl.transforms.compose import CustomCompose
+from myria3d.pctl.transforms.fusion import FusedPosNormalization, FusedSubsampling
+from myria3d.pctl.transforms.transforms import (
+    CopyFullPos,
+    CopyFullPreparedTargets,
+    CopySampledPos,
+    DropPointsByClass,
+    MaximumNumNodes,
+    MinimumNumNodes,
+    NormalizePos,
+    NullifyLowestZ,
+    StandardizeRGBAndIntensity,
+    TargetTransform,
+)
+
+CLASSIFICATION_DICT = {1: "unclassified", 2: "ground", 6: "building"}
+
+
+def get_eval_transforms(min_nodes, max_nodes):
+    return [
+        TargetTransform({}, CLASSIFICATION_DICT),
+        DropPointsByClass(),
+        CopyFullPos(),
+        CopyFullPreparedTargets(),
+        GridSampling(0.25),
+        MinimumNumNodes(min_nodes),
+        MaximumNumNodes(max_nodes),
+        CopySampledPos(),
+        Center(),
+        NullifyLowestZ(),
+        NormalizePos(subtile_width=50),
+        StandardizeRGBAndIntensity(),
+    ]
+
+
+def get_sample(num_nodes):
+    return Data(
+        pos=torch.rand((num_nodes, 3)) * 50,
+        x=torch.rand((num_nodes, 2)),
+        y=torch.LongTensor(np.random.choice([1, 2, 6, 65], size=num_nodes)),
+        x_features_names=["Intensity", "rgb_avg"],
+        idx_in_original_cloud=np.arange(num_nodes),
+    )
+
+
+@pytest.mark.parametrize("min_nodes,max_nodes", [(300, 2000), (5000, 10000), (10, 50)])
+def test_fused_transforms_give_same_outputs_as_eager_transforms(min_nodes, max_nodes):
+    eager = CustomCompose(get_eval_transforms(min_nodes, max_nodes))
+    fused = CustomCompose(get_eval_transforms(min_nodes, max_nodes), fuse=True)
+    assert any(isinstance(t, FusedSubsampling) for t in fused.transforms)
+    assert any(isinstance(t, FusedPosNormalization) for t in fused.transforms)
+
+    sample = get_sample(3000)
+    torch.manual_seed(0)
+    eager_data = eager(sample.clone())
+    torch.manual_seed(0)
+    fused_data = fused(sample.clone())
+
+    for key in ["pos", "x", "y"]:
+        assert torch.equal(eager_data[key], fused_data[key])
+    assert np.array_equal(eager_data.idx_in_original_cloud, fused_data.idx_in_original_cloud)
+    for key in ["pos_copy", "transformed_y_copy", "pos_sampled_copy"]:
+        assert torch.equal(eager_data.copies[key], fused_data.copies[key])
+
+
+def test_fused_transforms_do_not_modify_copies():
+    # Copies are references: positions must never be modified in-place afterwards.
+    fused = CustomCompose([CopySampledPos(), NullifyLowestZ(), Center()], fuse=True)
+    pos = torch.rand((10, 3))
+    data = fused(Data(pos=pos.clone()))
+    assert torch.equal(data.copies["pos_sampled_copy"], pos)
@@ -0,0 +1,41 @@
+import torch
+from torch.utils.data import DataLoader
+from torch_geometric.data import Data
+
+from myria3d.pctl.transforms.compose import CustomCompose
+from myria3d.pctl.transforms.profiling import TransformsProfiler
+from myria3d.pctl.transforms.transforms import MaximumNumNodes, MinimumNumNodes
+
+
+class DatasetWithTransform(torch.utils.data.Dataset):
+    def __init__(self, transform):
+        self.transform = transform
+
+    def __len__(self):
+        return 8
+
+    def __getitem__(self, idx):
+        # Samples of 100 points, except for empty odd samples that are dropped.
+        return self.transform(Data(pos=torch.rand((100 * (idx % 2 == 0), 3))))
+
+
+def test_TransformsProfiler_aggregates_statistics_across_workers():
+    profiler = TransformsProfiler(num_workers=2)
+    transform = CustomCompose([MaximumNumNodes(50), MinimumNumNodes(80)], profiler=profiler)
+    dataloader = DataLoader(
+        DatasetWithTransform(transform), batch_size=None, num_workers=2, collate_fn=lambda d: d
+    )
+    _ = list(dataloader)
+
+    summary = profiler.summary()
+    assert summary["00_MaximumNumNodes/num_nodes_in"] == 50  # mean of 100 and 0.
+    assert summary["00_MaximumNumNodes/num_nodes_out"] == 25
+    assert summary["00_MaximumNumNodes/drop_rate"] == 0.5
+    # Dropped samples do not reach the next transforms.
+    assert summary["01_MinimumNumNodes/num_nodes_in"] == 50
+    assert summary["01_MinimumNumNodes/num_nodes_out"] == 80
+    assert profiler.stats[0].sum() == 0  # all samples were prepared by workers.
+    assert "MaximumNumNodes" in profiler.format()
+
+    profiler.reset()
+    assert profiler.summary() == {}
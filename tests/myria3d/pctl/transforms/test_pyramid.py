@@ -0,0 +1,66 @@
+import pytest
+import torch
+from torch_geometric.data import Batch, Data
+
+from myria3d.models.modules.pyg_randla_net import (
+    PyGRandLANet,
+    get_pyramid,
+    get_pyramid_indices,
+    neighbors_to_edge_index,
+)
+from myria3d.pctl.dataloader.dataloader import CSRCollater, GeometricNoneProofCollater
+from myria3d.pctl.transforms.pyramid import RandLANetPyramid
+
+NUM_FEATURES = 4
+
+
+def get_samples(num_nodes):
+    return [Data(pos=torch.rand((n, 3)), x=torch.rand((n, NUM_FEATURES))) for n in num_nodes]
+
+
+@pytest.mark.parametrize("collater", [GeometricNoneProofCollater(), CSRCollater()])
+def test_pyramid_indices_match_neighbor_searches_in_the_batch(collater):
+    transform = RandLANetPyramid(decimation=4, num_neighbors=16)
+    batch = collater([transform(sample) for sample in get_samples([300, 10, 1000])])
+    neighbors, idx_decim, idx_upsampling = get_pyramid_indices(
+        get_pyramid(batch), batch.ptr, 4, num_levels=4
+    )
+
+    ptr, pos, batch_vector = batch.ptr, batch.pos, batch.batch
+    for level in range(4):
+        edge_index = neighbors_to_edge_index(neighbors[level])
+        # Each point has min(16, num_points of its cloud) distinct neighbors, in its cloud.
+        num_neighbors = torch.bincount(edge_index[1], minlength=pos.size(0))
+        expected = ptr.diff().clamp(max=16)[batch_vector]
+        assert torch.equal(num_neighbors, expected)
+        assert torch.equal(batch_vector[edge_index[0]], batch_vector[edge_index[1]])
+        # Decimated points stay in their cloud, and are the nearest of upsampled points.
+        pos_decim, batch_decim = pos[idx_decim[level]], batch_vector[idx_decim[level]]
+        assert torch.equal(batch_decim[idx_upsampling[level]], batch_vector)
+        assert torch.equal(pos_decim[idx_upsampling[level][idx_decim[level]]], pos_decim)
+        ptr = torch.cat([ptr.new_zeros(1), torch.bincount(batch_decim).cumsum(0)])
+        pos, batch_vector = pos_decim, batch_decim
+
+
+@pytest.mark.parametrize("dense_aggregation", [False, True])
+def test_randla_net_with_pyramid_gives_same_outputs(dense_aggregation):
+    # Without decimation, outputs do not depend on the random choice of points.
+    model = PyGRandLANet(
+        NUM_FEATURES, 6, decimation=1, num_neighbors=16, dense_aggregation=dense_aggregation
+    ).eval()
+    transform = RandLANetPyramid(decimation=1, num_neighbors=16)
+    samples = get_samples([200, 5, 300])
+    batch = Batch.from_data_list(samples)
+    batch_with_pyramid = Batch.from_data_list([transform(s.clone()) for s in samples])
+
+    with torch.no_grad():
+        expected = model(batch.x, batch.pos, batch.batch, batch.ptr)
+        output = model(batch.x, batch.pos, batch.batch, batch.ptr, get_pyramid(batch_with_pyramid))
+    assert torch.allclose(output, expected, atol=1e-5)
+
+
+def test_randla_net_with_pyramid_raises_for_other_decimation():
+    model = PyGRandLANet(NUM_FEATURES, 6, decimation=4).eval()
+    batch = Batch.from_data_list([RandLANetPyramid(decimation=2)(s) for s in get_samples([50])])
+    with pytest.raises(ValueError):
+        model(batch.x, batch.pos, batch.batch, batch.ptr, get_pyramid(batch))
@@ -3,10 +3,17 @@ import pytest
 import torch
 import torch_geometric
 
+from myria3d.pctl.transforms.compose import CustomCompose
 from myria3d.pctl.transforms.transforms import (
+    ClassCodeMapper,
+    CopyFullPos,
+    CopySampledPos,
     DropPointsByClass,
+    MaximumNumNodes,
     MinimumNumNodes,
+    NodeAttributesSchema,
     TargetTransform,
+    VoxelGridSampling,
     subsample_data,
 )
 
@@ -124,6 +131,70 @@ def test_TargetTransform_throws_type_error_if_invalid_classification_dict():
         _ = tt(invalid_input_data)
 
 
+def test_NodeAttributesSchema():
+    x = torch.rand((5, 3))
+    idx = np.arange(5)
+    data = torch_geometric.data.Data(x=x, y=torch.arange(5), idx_in_original_cloud=idx)
+    schema = NodeAttributesSchema()
+    transformed_data = schema.subsample(data, torch.BoolTensor([True, False, True, False, True]))
+    # Schema is inferred on first use, and indices are not among the node keys.
+    assert schema.node_keys == ["x", "y"]
+    assert torch.equal(transformed_data.x, x[[0, 2, 4]])
+    assert torch.equal(transformed_data.y, torch.LongTensor([0, 2, 4]))
+    assert transformed_data.idx_in_original_cloud.shape[0] == 5
+    # Indices are subsampled when explicitly asked.
+    transformed_data = schema.subsample(
+        transformed_data, torch.IntTensor([2]), subsample_indices=True
+    )
+    assert torch.equal(transformed_data.y, torch.LongTensor([4]))
+    assert np.array_equal(transformed_data.idx_in_original_cloud, np.array([2]))
+
+
+@pytest.mark.parametrize("mode", ["pick", "mean"])
+def test_VoxelGridSampling(mode):
+    # Two voxels of 1m: the first one with 3 points, the second one with a single point.
+    pos = torch.Tensor([[0.1, 0.1, 0.1], [0.5, 0.5, 0.5], [0.9, 0.9, 0.9], [1.5, 0.1, 0.1]])
+    y = torch.LongTensor([2, 1, 1, 6])
+    x = torch.Tensor([[0.0], [3.0], [6.0], [9.0]])
+    data = torch_geometric.data.Data(pos=pos, x=x, y=y, copies={})
+    transformed_data = VoxelGridSampling(1.0, mode=mode)(data)
+    assert transformed_data.num_nodes == 2
+    assert torch.equal(transformed_data.copies["voxel_idx"], torch.LongTensor([0, 0, 0, 1]))
+    if mode == "pick":
+        assert torch.equal(transformed_data.pos, pos[[0, 3]])
+        assert torch.equal(transformed_data.y, torch.LongTensor([2, 6]))
+    else:
+        assert torch.allclose(transformed_data.x, torch.Tensor([[3.0], [9.0]]))
+        # Majority class instead of mixing labels.
+        assert torch.equal(transformed_data.y, torch.LongTensor([1, 6]))
+
+
+def test_copies_track_sampled_points_as_indices():
+    transforms = [CopyFullPos(), VoxelGridSampling(1.0), MaximumNumNodes(3), CopySampledPos()]
+    pos = torch.rand((100, 3)) * 10
+    data = CustomCompose(transforms)(torch_geometric.data.Data(pos=pos.clone()))
+    # A reference to the original positions, and indices of sampled points instead of their positions.
+    assert torch.equal(data.copies["pos_copy"], pos)
+    assert "pos_sampled_copy" not in data.copies
+    assert torch.equal(data.copies["pos_copy"][data.copies["sampled_idx"]], data.pos)
+
+    # Points that may be averaged cannot be tracked.
+    transforms = [CopyFullPos(), VoxelGridSampling(1.0, mode="mean"), CopySampledPos()]
+    data = CustomCompose(transforms)(torch_geometric.data.Data(pos=pos.clone()))
+    assert "sampled_idx" not in data.copies
+    assert torch.equal(data.copies["pos_sampled_copy"], data.pos)
+
+
+def test_ClassCodeMapper():
+    mapper = ClassCodeMapper({1: 0, 2: 0, 6: 1})
+    codes = np.array([1, 2, 6, 3, 99999, -2])
+    unknown = ClassCodeMapper.UNKNOWN_CODE
+    assert mapper(codes).tolist() == [0, 0, 1, unknown, unknown, unknown]
+    # Composition applies both mappings in a single lookup.
+    composed = ClassCodeMapper({2: 1, 6: 6}).compose(ClassCodeMapper({1: 0, 6: 1}))
+    assert composed(torch.tensor([2, 6, 1])).tolist() == [0, 1, unknown]
+
+
 def test_DropPointsByClass():
     # points with class 65 are droped.
     y = torch.Tensor([1, 65, 65, 2, 65])
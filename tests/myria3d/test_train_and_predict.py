@@ -3,6 +3,7 @@ from typing import List
 
 import numpy as np
 import pytest
+import torch
 from lightning.pytorch.accelerators import find_usable_cuda_devices
 from pathlib import Path
 from pdaltools import las_info
@@ -10,7 +11,7 @@ from pdaltools import las_info
 
 from myria3d.pctl.dataset.toy_dataset import TOY_LAS_DATA
 from myria3d.pctl.dataset.utils import pdal_read_las_array
-from myria3d.predict import predict
+from myria3d.predict import get_autocast, predict
 from myria3d.train import train
 from tests.conftest import (
     make_default_hydra_cfg,
@@ -143,6 +144,21 @@ def test_predict_on_single_point_cloud(one_epoch_trained_RandLaNet_checkpoint, t
     run_hydra_decorated_command(command)
 
 
+@pytest.mark.parametrize(
+    "precision, dtype",
+    [(32, torch.float32), ("32", torch.float32), ("bf16-mixed", torch.bfloat16)],
+)
+def test_get_autocast_with_supported_precision(precision, dtype):
+    with get_autocast("cpu", precision):
+        assert (torch.ones((2, 2)) @ torch.ones((2, 2))).dtype == dtype
+
+
+@pytest.mark.parametrize("precision", ["bf16", "bf16-true", "16-mixed", 16, "bf16_mixed"])
+def test_get_autocast_raises_on_unsupported_precision(precision):
+    with pytest.raises(ValueError):
+        get_autocast("cpu", precision)
+
+
 def test_RandLaNet_predict_with_invariance_checks(one_epoch_trained_RandLaNet_checkpoint, tmpdir):
     """Train a model for one epoch, and run test and predict functions using the trained model.
 